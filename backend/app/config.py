@@ -5,6 +5,11 @@ from typing import Optional
 class Settings(BaseSettings):
     # Database
     DATABASE_URL: str
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    # Connections are replaced after this long instead of being pinged on every
+    # checkout; keep it below any server/proxy idle timeout
+    DB_POOL_RECYCLE_SECONDS: int = 1800
     
     # Security
     SECRET_KEY: str
@@ -19,15 +24,37 @@ class Settings(BaseSettings):
     STOCKFISH_PATH: str = "/usr/games/stockfish"
     STOCKFISH_DEPTH: int = 18
     STOCKFISH_TIME_LIMIT: float = 0.8
+    # Fixed node budget per position instead of depth/time, so results and timings are
+    # repeatable across machines and load (used by the benchmarks); unset keeps depth/time
+    STOCKFISH_NODES: Optional[int] = None
+    STOCKFISH_POOL_SIZE: int = 2  # Persistent engine processes kept per event loop
+    # Transposition table per engine process. Kept across a game's positions (searched
+    # last to first), so it is sized for one game; multiply by pool size x workers for RAM
+    STOCKFISH_HASH_MB: int = 256
+    # Evaluations are cached in Redis by position so recurring positions skip the engine; 0 disables
+    STOCKFISH_EVAL_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    # Most recently used evaluations also kept in memory per process (entries); 0 disables
+    STOCKFISH_LOCAL_EVAL_CACHE_SIZE: int = 20_000
 
     # Puzzle deep analysis (on-demand, higher depth for quality)
-    PUZZLE_ANALYSIS_DEPTH: int = 22
-    PUZZLE_ANALYSIS_TIME: float = 3.0
+    # Node budget rather than depth/time so solutions are the same on any hardware;
+    # cached solutions from a different node budget are recomputed
+    PUZZLE_ANALYSIS_NODES: int = 2_000_000
+    # Deprecated and ignored (replaced by PUZZLE_ANALYSIS_NODES); still declared so
+    # existing .env files that set them keep loading
+    PUZZLE_ANALYSIS_DEPTH: Optional[int] = None
+    PUZZLE_ANALYSIS_TIME: Optional[float] = None
+    PUZZLE_MULTIPV: int = 3  # Candidate lines per puzzle; lines beyond the threshold are discarded anyway
     PUZZLE_MULTIPV_SOLUTION_THRESHOLD_CP: int = 50  # Moves within this CP of best are valid
+    PUZZLE_CANDIDATE_BATCH_SIZE: int = 8  # Random candidates fetched per request; cached ones are tried first
+    
+    # Dashboard
+    DASHBOARD_CACHE_TTL_SECONDS: int = 60  # Serve the stored dashboard response while younger than this
     
     # AI Chess Coach
     ENABLE_COACH: bool = False
     COACH_PROVIDER: str = "ollama"  # Options: "openai", "ollama"
+    COACH_CONCURRENCY: int = 2  # Max in-flight commentary requests per game (keep low for Ollama)
     
     # OpenAI Settings (paid)
     OPENAI_API_KEY: Optional[str] = None
@@ -35,10 +62,26 @@ class Settings(BaseSettings):
     
     # Ollama Settings (free, local)
     OLLAMA_BASE_URL: str = "http://localhost:11434"
-    OLLAMA_MODEL: str = "llama3.1"  # or "mistral", "phi3", etc.
+    OLLAMA_MODEL: str = "qwen2.5:3b-instruct-q4_K_M"  # 4-bit quantized; or "llama3.1", "mistral", "phi3", etc.
+    
+    # Small models for routine mistakes; blunders over the threshold and endgames
+    # use OPENAI_MODEL / OLLAMA_MODEL. Leave empty to always use the main model.
+    OPENAI_MODEL_SMALL: Optional[str] = "gpt-4o-mini"
+    OLLAMA_MODEL_SMALL: Optional[str] = "qwen2.5:1.5b-instruct-q4_K_M"
+    COACH_LARGE_MODEL_MIN_CP_LOSS: int = 300
+    
+    # Max tokens generated per coach response (prompts ask for <= 40 words)
+    COACH_MAX_TOKENS: int = 80
+    
+    # Send a templated draft as an OpenAI Predicted Output for move commentary.
+    # Only models accepting it get one; rejected draft tokens are still billed.
+    COACH_OPENAI_PREDICTION: bool = False
+    # Model name prefixes that accept Predicted Outputs (other models get the plain request)
+    COACH_OPENAI_PREDICTION_MODELS: list = ["gpt-4o", "gpt-4.1"]
     
     # Redis
     REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_MAX_CONNECTIONS: int = 32  # Per-process pool for publishers and caches (SSE readers have their own)
     # Environment
     ENVIRONMENT: str = "development"
     
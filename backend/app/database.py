@@ -3,11 +3,13 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
 
+# No pool_pre_ping: it costs a SELECT 1 round-trip on every checkout (i.e. every
+# request and every worker task). Recycling bounds connection age instead.
 engine = create_engine(
     settings.DATABASE_URL,
-    pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_recycle=settings.DB_POOL_RECYCLE_SECONDS
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
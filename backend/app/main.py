@@ -1,13 +1,35 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from .config import settings
 from .database import engine, Base
-from .routers import auth, games, stats, puzzles
+from .routers import auth, games, stats, puzzles, coach
 from .logging_config import setup_logging
-from .schema_migrations import ensure_lichess_columns, ensure_puzzle_analysis_cache
+from .schema_migrations import (
+    ensure_lichess_columns,
+    ensure_move_fen_before,
+    ensure_puzzle_analysis_cache,
+    ensure_puzzle_analysis_nodes,
+    ensure_puzzle_solutions_json,
+    drop_game_move_uci_list,
+    ensure_hot_path_indexes,
+    ensure_user_stats_dashboard_cache,
+    ensure_rating_history_index,
+    drop_redundant_game_indexes,
+    ensure_puzzle_candidates,
+    ensure_user_stats_analyzed_games,
+    ensure_user_stats_index,
+    ensure_analysis_jobs_active_index,
+    ensure_import_dedup_indexes,
+    ensure_unanalyzed_games_index,
+    ensure_game_analysis_claim,
+)
+from .services.engine_pool import engine_pool
+import logging
 
 # Configure logging with datetime
 setup_logging()
+logger = logging.getLogger(__name__)
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -15,7 +37,9 @@ Base.metadata.create_all(bind=engine)
 app = FastAPI(
     title="Chess Analytics API",
     description="API for chess game analytics and statistics",
-    version="1.0.0"
+    version="1.0.0",
+    # Encode responses with orjson instead of the stdlib json encoder
+    default_response_class=ORJSONResponse
 )
 
 
@@ -23,6 +47,35 @@ app = FastAPI(
 def run_startup_migrations() -> None:
     ensure_lichess_columns(engine)
     ensure_puzzle_analysis_cache(engine)
+    ensure_move_fen_before(engine)
+    ensure_puzzle_analysis_nodes(engine)
+    ensure_puzzle_solutions_json(engine)
+    drop_game_move_uci_list(engine)
+    ensure_hot_path_indexes(engine)
+    ensure_user_stats_dashboard_cache(engine)
+    ensure_rating_history_index(engine)
+    drop_redundant_game_indexes(engine)
+    ensure_puzzle_candidates(engine)
+    ensure_user_stats_analyzed_games(engine)
+    ensure_user_stats_index(engine)
+    ensure_analysis_jobs_active_index(engine)
+    ensure_import_dedup_indexes(engine)
+    ensure_unanalyzed_games_index(engine)
+    ensure_game_analysis_claim(engine)
+
+
+@app.on_event("startup")
+async def prewarm_engine_pool() -> None:
+    # Puzzle analysis borrows engines from the pool; start them before the first request
+    try:
+        await engine_pool.prewarm()
+    except Exception as e:
+        logger.warning(f"Could not prewarm Stockfish engine pool: {e}")
+
+
+@app.on_event("shutdown")
+async def close_engine_pool() -> None:
+    await engine_pool.close()
 
 # Configure CORS
 app.add_middleware(
@@ -38,6 +91,7 @@ app.include_router(auth.router, prefix="/api")
 app.include_router(games.router, prefix="/api")
 app.include_router(stats.router, prefix="/api")
 app.include_router(puzzles.router, prefix="/api")
+app.include_router(coach.router, prefix="/api")
 
 
 @app.get("/")
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Text, Boolean, Index
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Text, Boolean, Index, JSON
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy import and_
 from datetime import datetime
 from .database import Base
 
@@ -36,7 +37,8 @@ class Game(Base):
     chess_com_id = Column(String, unique=True, index=True, nullable=True)
     lichess_url = Column(String, nullable=True)
     lichess_id = Column(String, unique=True, index=True, nullable=True)
-    pgn = Column(Text, nullable=False)
+    # Deferred: list/stats queries never need it; load with undefer(Game.pgn) where they do
+    pgn = deferred(Column(Text, nullable=False))
     
     # Players
     white_player = Column(String, nullable=False)
@@ -62,6 +64,8 @@ class Game(Base):
     # Analysis
     is_analyzed = Column(Boolean, default=False)  # Deprecated, use analysis_state instead
     analysis_state = Column(String, default="unanalyzed", nullable=False)  # 'unanalyzed', 'in_progress', 'analyzed'
+    # When an analysis task claimed the game; NULL unless a worker is analyzing it
+    analysis_claimed_at = Column(DateTime, nullable=True)
     average_centipawn_loss = Column(Float, nullable=True)
     accuracy = Column(Float, nullable=True)
     num_moves = Column(Integer, nullable=True)
@@ -76,11 +80,47 @@ class Game(Base):
     
     # Relationships
     user = relationship("User", back_populates="games")
-    moves = relationship("Move", back_populates="game", cascade="all, delete-orphan")
+    # Query moves explicitly (one query for all games); lazy loads per game are an N+1
+    moves = relationship("Move", back_populates="game", cascade="all, delete-orphan", lazy="raise")
     
     __table_args__ = (
-        Index('ix_games_user_date', 'user_id', 'date_played'),
         Index('ix_games_user_opening', 'user_id', 'opening_eco'),
+        # Stats and puzzle queries filter the user's games by these columns
+        Index('ix_games_user_result', 'user_id', 'result'),
+        Index('ix_games_user_analyzed', 'user_id', 'is_analyzed'),
+        # Batch analysis picks a user's unanalyzed games newest first; the index
+        # shrinks as games get analyzed
+        Index(
+            'ix_games_user_unanalyzed_date',
+            'user_id', 'date_played',
+            postgresql_where=analysis_state != 'analyzed',
+            sqlite_where=analysis_state != 'analyzed',
+        ),
+        # Import de-duplication reads a user's platform ids straight from these
+        Index(
+            'ix_games_user_chess_com_id',
+            'user_id', 'chess_com_id',
+            postgresql_where=chess_com_id.isnot(None),
+            sqlite_where=chess_com_id.isnot(None),
+        ),
+        Index(
+            'ix_games_user_lichess_id',
+            'user_id', 'lichess_id',
+            postgresql_where=lichess_id.isnot(None),
+            sqlite_where=lichess_id.isnot(None),
+        ),
+        # A user's games by date; rating history reads only these columns, so Postgres
+        # can answer it from the index
+        Index('ix_games_user_rating_date', 'user_id', 'date_played', postgresql_include=['user_rating', 'result']),
+        # Same for the single aggregate behind calculate_user_stats
+        Index(
+            'ix_games_user_stats',
+            'user_id',
+            postgresql_include=[
+                'result', 'user_color', 'is_analyzed', 'accuracy', 'average_centipawn_loss',
+                'num_blunders', 'num_mistakes', 'num_inaccuracies',
+            ],
+        ),
     )
 
 
@@ -97,6 +137,7 @@ class Move(Base):
     
     move_san = Column(String, nullable=False)  # Standard Algebraic Notation
     move_uci = Column(String, nullable=False)  # UCI notation
+    fen_before = Column(String(90), nullable=True)  # Position before the move (NULL for rows analyzed before this was stored)
     
     # Analysis
     evaluation_before = Column(Float, nullable=True)  # In centipawns
@@ -118,6 +159,13 @@ class Move(Base):
     
     __table_args__ = (
         Index('ix_moves_game_halfmove', 'game_id', 'half_move'),
+        # Puzzle candidates: only the small set of mistakes/blunders with a known best move
+        Index(
+            'ix_moves_puzzle_candidates',
+            'game_id',
+            postgresql_where=and_(classification.in_(['mistake', 'blunder']), best_move_uci.isnot(None)),
+            sqlite_where=and_(classification.in_(['mistake', 'blunder']), best_move_uci.isnot(None)),
+        ),
     )
 
 
@@ -158,6 +206,8 @@ class UserStats(Base):
     total_blunders = Column(Integer, default=0)
     total_mistakes = Column(Integer, default=0)
     total_inaccuracies = Column(Integer, default=0)
+    # Analyzed games counted in the averages above; NULL until the next full recalculation
+    analyzed_games = Column(Integer, nullable=True)
     
     # Peak rating (if we track it)
     peak_rating = Column(Integer, nullable=True)
@@ -166,6 +216,10 @@ class UserStats(Base):
     # Last updated
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Serialized /stats/dashboard response; cleared whenever stats are recalculated
+    dashboard_cache = Column(JSON, nullable=True)
+    dashboard_cache_updated_at = Column(DateTime, nullable=True)
+    
     # Relationships
     user = relationship("User", back_populates="stats")
 
@@ -216,6 +270,17 @@ class AnalysisJob(Base):
     
     # Relationships
     user = relationship("User")
+    
+    __table_args__ = (
+        # Every finished game bumps the user's running jobs; keep that lookup off the
+        # ever-growing history of completed jobs
+        Index(
+            'ix_analysis_jobs_user_active',
+            'user_id',
+            postgresql_where=status.in_(['pending', 'processing']),
+            sqlite_where=status.in_(['pending', 'processing']),
+        ),
+    )
 
 
 class PuzzleAnalysisCache(Base):
@@ -229,8 +294,11 @@ class PuzzleAnalysisCache(Base):
     game_id = Column(Integer, ForeignKey("games.id"), nullable=False, index=True)
     move_id = Column(Integer, ForeignKey("moves.id"), nullable=False, index=True)
 
-    # JSON array of UCI moves that are valid solutions, e.g. ["e2e4"] or ["e2e4", "d2d4"]
-    solution_uci_list = Column(Text, nullable=False)
+    # Array of UCI moves that are valid solutions, e.g. ["e2e4"] or ["e2e4", "d2d4"]
+    solution_uci_list = Column(JSON, nullable=False)
+
+    # Engine node budget the solutions were computed with (NULL for depth/time-based rows)
+    analysis_nodes = Column(Integer, nullable=True)
 
     created_at = Column(DateTime, default=datetime.utcnow)
 
@@ -238,3 +306,44 @@ class PuzzleAnalysisCache(Base):
         Index("ix_puzzle_cache_game_move", "game_id", "move_id", unique=True),
     )
 
+
+class PuzzleCandidate(Base):
+    """
+    Denormalized puzzle positions: user mistakes/blunders with a known best move,
+    played on the user's turn. Rebuilt for a game whenever its analysis completes,
+    so puzzle selection reads one narrow table instead of joining moves and games.
+    """
+    __tablename__ = "puzzle_candidates"
+
+    move_id = Column(Integer, ForeignKey("moves.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    game_id = Column(Integer, ForeignKey("games.id", ondelete="CASCADE"), nullable=False)
+    half_move = Column(Integer, nullable=False)
+    fen_before = Column(String(90), nullable=True)
+    best_move_uci = Column(String, nullable=False)
+    classification = Column(String, nullable=False)
+    user_color = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index("ix_puzzle_candidates_user", "user_id"),
+        Index("ix_puzzle_candidates_game", "game_id"),
+    )
+
+
+class CoachCommentaryCache(Base):
+    """
+    Cache for generated coach commentary. Keyed by a SHA-1 of the inputs
+    that determine the commentary (position, move, classification, model).
+    """
+    __tablename__ = "coach_commentary_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key_hash = Column(String(40), nullable=False)
+    model = Column(String, nullable=False)
+    commentary = Column(Text, nullable=False)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_coach_cache_key_hash", "key_hash", unique=True),
+    )
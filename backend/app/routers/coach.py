@@ -0,0 +1,107 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+import asyncio
+import chess
+import json
+import logging
+from sqlalchemy import update
+from sse_starlette.sse import EventSourceResponse
+from ..database import SessionLocal, get_db
+from ..models import User, Game, Move
+from ..services.coach_service import CoachService, CommentaryStreamError
+from ..services.puzzle_service import fen_from_pgn_at_half_move
+from .games import get_current_user_from_token_or_query
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/coach", tags=["Coach"])
+
+
+def _save_commentary(move_id: int, commentary: str) -> None:
+    """Store a finished commentary on the move unless it already has one"""
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Move)
+            .where(Move.id == move_id, Move.coach_commentary.is_(None))
+            .values(coach_commentary=commentary)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+@router.get("/stream")
+async def stream_move_commentary(
+    move_id: int = Query(..., description="ID of the analyzed move to comment on"),
+    current_user: User = Depends(get_current_user_from_token_or_query),
+    db: Session = Depends(get_db)
+):
+    """
+    Stream coach commentary for a move via Server-Sent Events.
+
+    Emits one `token` event per generated chunk so the first words show up
+    while the model is still generating, then a `done` event with the full text.
+    The commentary is saved on the move once complete; a stream that fails or is
+    cut off ends with an `error` event instead and nothing is saved.
+    """
+    coach_service = CoachService()
+    if not coach_service.is_enabled():
+        raise HTTPException(status_code=503, detail="AI coach is not enabled")
+
+    row = db.query(Move, Game).join(Game, Move.game_id == Game.id).filter(
+        Move.id == move_id,
+        Game.user_id == current_user.id
+    ).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Move not found")
+    move, game = row
+
+    if move.classification not in ["blunder", "mistake"]:
+        raise HTTPException(status_code=400, detail="Commentary is only available for mistakes and blunders")
+
+    # Position before the move: stored on the row, else rebuilt from the game's PGN
+    fen_before = move.fen_before or fen_from_pgn_at_half_move(game.pgn, move.half_move)
+    if not fen_before:
+        raise HTTPException(status_code=422, detail="Game PGN could not be parsed")
+    board = chess.Board(fen_before)
+    total_moves = game.num_moves or 0
+
+    best_move_san = None
+    if move.best_move_uci:
+        try:
+            best_move_san = board.san(chess.Move.from_uci(move.best_move_uci))
+        except ValueError:
+            best_move_san = None
+
+    phase = "opening" if move.half_move < 20 else ("endgame" if move.half_move > total_moves * 0.7 else "middlegame")
+    commentary_kwargs = dict(
+        move_san=move.move_san,
+        classification=move.classification,
+        centipawn_loss=move.centipawn_loss or 0,
+        fen_before=fen_before,
+        best_move_san=best_move_san,
+        game_phase=phase,
+        user_color=game.user_color
+    )
+    # Don't hold a connection (and open transaction) for the whole LLM stream
+    db.close()
+
+    async def event_generator():
+        parts = []
+        try:
+            async for token in coach_service.stream_move_commentary(**commentary_kwargs):
+                parts.append(token)
+                yield {"event": "token", "data": json.dumps({"token": token})}
+        except CommentaryStreamError as e:
+            logger.warning(f"Coach commentary stream for move {move_id} did not complete: {e}")
+            yield {"event": "error", "data": json.dumps({"move_id": move_id, "error": "Commentary generation failed"})}
+            return
+
+        commentary = "".join(parts).strip()
+        if commentary:
+            await asyncio.to_thread(_save_commentary, move_id, commentary)
+
+        yield {"event": "done", "data": json.dumps({"move_id": move_id, "commentary": commentary or None})}
+
+    return EventSourceResponse(event_generator())
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request
 from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import insert
+from sqlalchemy.orm import Session, undefer
 from typing import List, Optional
 from datetime import datetime
 import json
@@ -9,7 +10,7 @@ import asyncio
 import logging
 from sse_starlette.sse import EventSourceResponse
 from ..database import get_db
-from ..models import User, Game, Move, ImportJob, AnalysisJob
+from ..models import User, Game, Move, ImportJob, AnalysisJob, PuzzleAnalysisCache, PuzzleCandidate
 from ..schemas import (
     GameResponse, 
     GameDetailResponse, 
@@ -23,7 +24,8 @@ from ..config import settings
 from ..services.chess_com_service import ChessComService
 from ..services.analysis_service import AnalysisService
 from ..services.stats_service import StatsService
-from ..services.redis_pubsub import redis_pubsub
+from ..services.puzzle_service import refresh_puzzle_candidates
+from ..services.redis_pubsub import redis_pubsub, is_event_id
 from ..worker.tasks import analyze_game_task, import_games_task, import_lichess_games_task
 
 logger = logging.getLogger(__name__)
@@ -31,6 +33,9 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False
 
 router = APIRouter(prefix="/games", tags=["Games"])
 
+# How long one XREAD waits for analysis events before looping (sse_starlette pings meanwhile)
+SSE_BLOCK_MS = 15000
+
 
 async def analyze_game_background(game_id: int):
     """Background task to analyze a single game"""
@@ -38,7 +43,7 @@ async def analyze_game_background(game_id: int):
     from ..database import SessionLocal
     db = SessionLocal()
     try:
-        game = db.query(Game).filter(Game.id == game_id).first()
+        game = db.query(Game).options(undefer(Game.pgn)).filter(Game.id == game_id).first()
         if not game:
             print(f"ERROR: Game {game_id} not found in background task")
             return
@@ -53,15 +58,17 @@ async def analyze_game_background(game_id: int):
         if game.analysis_state != "in_progress":
             print(f"WARNING: Game {game_id} state is '{game.analysis_state}', setting to 'in_progress'")
             game.analysis_state = "in_progress"
-            db.commit()
-            db.refresh(game)
             print(f"✓ Game {game_id} analysis_state set to 'in_progress' in background task")
         else:
             print(f"✓ Game {game_id} already has analysis_state 'in_progress'")
         
+        # Release the connection while the engine runs rather than holding a transaction open
+        pgn, user_color = game.pgn, game.user_color
+        db.commit()
+        
         # Analyze the game
         analysis_service = AnalysisService()
-        result = await analysis_service.analyze_game(game.pgn, game.user_color)
+        result = await analysis_service.analyze_game(pgn, user_color)
         
         if "error" in result:
             error_msg = result['error']
@@ -72,6 +79,8 @@ async def analyze_game_background(game_id: int):
             game.num_moves = 0
             game.analyzed_at = datetime.utcnow()
             db.commit()
+            # No stats change, but the dashboard lists this game's analysis state
+            StatsService.clear_dashboard_cache(db, game.user_id)
             return
         
         # Update game with analysis results
@@ -86,20 +95,20 @@ async def analyze_game_background(game_id: int):
         game.num_inaccuracies = stats.get("num_inaccuracies", 0)
         game.analyzed_at = datetime.utcnow()
         
-        # Store move analysis
-        for move_data in result.get("moves", []):
-            move = Move(
-                game_id=game_id,
-                **move_data
-            )
-            db.add(move)
+        # Store move analysis in one executemany INSERT
+        moves_data = result.get("moves", [])
+        if moves_data:
+            db.execute(insert(Move), [{"game_id": game_id, **move_data} for move_data in moves_data])
         
-        db.commit()
-        db.refresh(game)
+        # Committed together with the puzzle candidates below
+        db.flush()
         print(f"Game {game_id} analysis completed, state set to 'analyzed'")
         
+        # Index this game's puzzle positions for puzzle selection
+        refresh_puzzle_candidates(db, game_id)
+        
         # Update user stats after analysis
-        StatsService.calculate_user_stats(db, game.user_id)
+        StatsService.add_analyzed_game(db, game)
         
     except Exception as e:
         print(f"Error analyzing game {game_id}: {e}")
@@ -367,7 +376,7 @@ def get_game(
 ):
     """Get detailed information about a specific game"""
     
-    game = db.query(Game).filter(
+    game = db.query(Game).options(undefer(Game.pgn)).filter(
         Game.id == game_id,
         Game.user_id == current_user.id
     ).first()
@@ -434,8 +443,13 @@ async def analyze_game(
         return {"message": "Game already analyzed", "status": "completed"}
     
     # 2. Prepare the DB for the worker
+    stats_removed = True
     if force and game.analysis_state == "analyzed":
         logger.info(f"Force re-analysis requested for game {game_id}, deleting existing moves")
+        stats_removed = StatsService.remove_analyzed_game(db, game)
+        db.query(PuzzleCandidate).filter(PuzzleCandidate.game_id == game_id).delete()
+        # Cached puzzle solutions reference the moves about to be deleted
+        db.query(PuzzleAnalysisCache).filter(PuzzleAnalysisCache.game_id == game_id).delete()
         deleted_moves = db.query(Move).filter(Move.game_id == game_id).delete()
         logger.debug(f"Deleted {deleted_moves} existing move records")
         game.is_analyzed = False
@@ -443,6 +457,9 @@ async def analyze_game(
 
     game.analysis_state = "in_progress"
     db.commit()
+    if not stats_removed:
+        # The old analysis couldn't be subtracted; recount without it
+        StatsService.calculate_user_stats(db, current_user.id)
     logger.info(f"Game {game_id} marked as 'in_progress' and queued for analysis")
     
     # 3. THE MAGIC LINE: Dispatch to Redis
@@ -671,13 +688,16 @@ async def get_current_user_from_token_or_query(
 
 @router.get("/events/analysis")
 async def stream_analysis_events(
+    request: Request,
     current_user: User = Depends(get_current_user_from_token_or_query)
 ):
     """
     Server-Sent Events endpoint for real-time game analysis updates.
     
     Frontend can subscribe to this endpoint to receive notifications when games
-    finish analyzing. Events are streamed via SSE as they occur.
+    finish analyzing. Events are read from the user's Redis Stream and carry its
+    entry ID, so a reconnecting EventSource resumes after the `Last-Event-ID`
+    it last saw instead of missing completions that happened in between.
     
     Authentication can be provided via:
     - Authorization header: `Bearer <token>` (standard)
@@ -687,13 +707,17 @@ async def stream_analysis_events(
         EventSourceResponse: SSE stream of game analysis completion events
     """
     logger.info(f"SSE connection established for user {current_user.id} (username: {current_user.username})")
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and not is_event_id(last_event_id):
+        # XREAD would reject it on every read; start from the newest event instead
+        logger.warning(f"Ignoring malformed Last-Event-ID {last_event_id!r} from user {current_user.id}")
+        last_event_id = None
     
     async def event_generator():
-        """Generator function that yields SSE events from Redis"""
-        pubsub = None
+        """Generator function that yields SSE events from the user's Redis Stream"""
         try:
-            # Get Redis subscriber for this user
-            pubsub = redis_pubsub.get_subscriber(current_user.id)
+            # Fresh connections only want events from now on
+            last_id = last_event_id or await redis_pubsub.latest_event_id(current_user.id)
             
             # Send initial connection message
             yield {
@@ -706,37 +730,21 @@ async def stream_analysis_events(
             }
             logger.debug(f"Sent connection event to user {current_user.id}")
             
-            # Listen for messages from Redis
+            # Block on the stream until events arrive; no polling between reads
             while True:
                 try:
-                    # Check for new messages (non-blocking with timeout)
-                    message = pubsub.get_message(timeout=1.0, ignore_subscribe_messages=True)
-                    
-                    if message and message['type'] == 'message':
-                        # Parse the message data
-                        try:
-                            data = json.loads(message['data'])
-                            logger.debug(
-                                f"Received Redis message for user {current_user.id}: "
-                                f"game_id={data.get('game_id')}, type={data.get('type')}"
-                            )
-                            
-                            # Send SSE event to frontend
-                            yield {
-                                "event": "game_analysis_completed",
-                                "data": json.dumps(data)
-                            }
-                            logger.info(
-                                f"Sent SSE event to user {current_user.id}: "
-                                f"game {data.get('game_id')} analysis completed"
-                            )
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Failed to parse Redis message as JSON: {e}, message={message}")
-                        except Exception as e:
-                            logger.error(f"Error processing Redis message: {e}", exc_info=True)
-                    
-                    # Yield empty comment to keep connection alive
-                    await asyncio.sleep(0.1)
+                    events = await redis_pubsub.read_events(
+                        current_user.id, last_id, block_ms=SSE_BLOCK_MS
+                    )
+                    for event_id, data in events:
+                        # The worker already stored the event as JSON; forward it as-is
+                        yield {
+                            "event": "game_analysis_completed",
+                            "id": event_id,
+                            "data": data
+                        }
+                        last_id = event_id
+                        logger.debug(f"Sent SSE event to user {current_user.id}: {data}")
                     
                 except asyncio.CancelledError:
                     logger.info(f"SSE connection cancelled for user {current_user.id}")
@@ -762,14 +770,6 @@ async def stream_analysis_events(
                     "message": str(e)
                 })
             }
-        finally:
-            # Clean up Redis subscription
-            if pubsub:
-                try:
-                    pubsub.close()
-                    logger.info(f"Closed Redis subscription for user {current_user.id}")
-                except Exception as e:
-                    logger.warning(f"Error closing Redis subscription for user {current_user.id}: {e}")
     
     return EventSourceResponse(event_generator())
 
@@ -790,6 +790,8 @@ def delete_game(
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
     
+    # No ON DELETE CASCADE on the puzzle cache's game/move keys; remove its rows first
+    db.query(PuzzleAnalysisCache).filter(PuzzleAnalysisCache.game_id == game_id).delete()
     db.delete(game)
     db.commit()
     
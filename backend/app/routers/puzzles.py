@@ -11,12 +11,12 @@ router = APIRouter(prefix="/puzzles", tags=["Puzzles"])
 
 
 @router.get("/next", response_model=PuzzleResponse)
-def get_next(
+async def get_next(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Get the next puzzle for the current user from their analyzed games."""
-    puzzle = get_next_puzzle(db, current_user.id)
+    puzzle = await get_next_puzzle(db, current_user.id)
     if not puzzle:
         raise HTTPException(
             status_code=404,
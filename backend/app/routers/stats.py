@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 from typing import List
 from ..database import get_db
@@ -23,13 +24,9 @@ def get_user_stats(
 ):
     """Get overall user statistics"""
     
-    # Calculate/update stats if needed
-    StatsService.calculate_user_stats(db, current_user.id)
-    
-    # Get stats from database
-    user_stats = db.query(User).filter(User.id == current_user.id).first().stats
-    
-    return user_stats
+    # Calculate/update stats if any game changed since the last calculation;
+    # the returned values are what was just stored, so no need to reload the row
+    return StatsService.calculate_user_stats(db, current_user.id, force=False)
 
 
 @router.get("/openings", response_model=List[OpeningStatsItem])
@@ -67,15 +64,25 @@ def get_performance_over_time(
     return performance
 
 
-@router.get("/dashboard", response_model=DashboardStats)
+@router.get(
+    "/dashboard",
+    response_model=None,
+    response_class=ORJSONResponse,
+    responses={200: {"model": DashboardStats}},
+)
 def get_dashboard_stats(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all statistics for the dashboard"""
     
-    dashboard_data = StatsService.get_dashboard_data(db, current_user.id)
-    return dashboard_data
+    dashboard = StatsService.get_cached_dashboard(db, current_user.id)
+    if dashboard is None:
+        dashboard_data = StatsService.get_dashboard_data(db, current_user.id)
+        # Data is built from trusted aggregations; skip response_model re-validation
+        dashboard = DashboardStats.build(dashboard_data).model_dump(mode="json")
+        StatsService.save_dashboard_cache(db, current_user.id, dashboard)
+    return ORJSONResponse(content=dashboard)
 
 
 @router.post("/recalculate", status_code=202)
@@ -1,4 +1,4 @@
-from sqlalchemy import inspect, text
+from sqlalchemy import String, inspect, text
 
 
 def ensure_lichess_columns(engine) -> None:
@@ -39,18 +39,21 @@ def ensure_puzzle_analysis_cache(engine) -> None:
     with engine.begin() as connection:
         inspector = inspect(connection)
         if "puzzle_analysis_cache" not in inspector.get_table_names():
-            # Use dialect-appropriate syntax (PostgreSQL SERIAL vs SQLite INTEGER)
+            # Use dialect-appropriate syntax (PostgreSQL SERIAL/JSON vs SQLite INTEGER/TEXT)
             dialect = engine.dialect.name
             if dialect == "sqlite":
                 id_col = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+                json_type = "TEXT"
             else:
                 id_col = "id SERIAL PRIMARY KEY"
+                json_type = "JSON"
             connection.execute(text(f"""
                 CREATE TABLE puzzle_analysis_cache (
                     {id_col},
                     game_id INTEGER NOT NULL REFERENCES games(id),
                     move_id INTEGER NOT NULL REFERENCES moves(id),
-                    solution_uci_list TEXT NOT NULL,
+                    solution_uci_list {json_type} NOT NULL,
+                    analysis_nodes INTEGER,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     UNIQUE(game_id, move_id)
                 )
@@ -58,3 +61,200 @@ def ensure_puzzle_analysis_cache(engine) -> None:
             connection.execute(
                 text("CREATE UNIQUE INDEX ix_puzzle_cache_game_move ON puzzle_analysis_cache(game_id, move_id)")
             )
+
+
+def ensure_move_fen_before(engine) -> None:
+    """Backfill moves.fen_before column for existing databases."""
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if "moves" in inspector.get_table_names():
+            move_columns = {column["name"] for column in inspector.get_columns("moves")}
+            if "fen_before" not in move_columns:
+                connection.execute(text("ALTER TABLE moves ADD COLUMN fen_before VARCHAR(90)"))
+
+
+def ensure_puzzle_analysis_nodes(engine) -> None:
+    """Backfill puzzle_analysis_cache.analysis_nodes column for existing databases."""
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if "puzzle_analysis_cache" in inspector.get_table_names():
+            cache_columns = {column["name"] for column in inspector.get_columns("puzzle_analysis_cache")}
+            if "analysis_nodes" not in cache_columns:
+                connection.execute(text("ALTER TABLE puzzle_analysis_cache ADD COLUMN analysis_nodes INTEGER"))
+
+
+def ensure_puzzle_solutions_json(engine) -> None:
+    """Convert puzzle_analysis_cache.solution_uci_list from JSON-encoded TEXT to a native JSON column."""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if "puzzle_analysis_cache" not in inspector.get_table_names():
+            return
+        for column in inspector.get_columns("puzzle_analysis_cache"):
+            if column["name"] == "solution_uci_list" and isinstance(column["type"], String):
+                connection.execute(text(
+                    "ALTER TABLE puzzle_analysis_cache "
+                    "ALTER COLUMN solution_uci_list TYPE JSON USING solution_uci_list::json"
+                ))
+
+
+def drop_game_move_uci_list(engine) -> None:
+    """Drop the unused games.move_uci_list column from existing databases."""
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if "games" in inspector.get_table_names():
+            game_columns = {column["name"] for column in inspector.get_columns("games")}
+            if "move_uci_list" in game_columns:
+                connection.execute(text("ALTER TABLE games DROP COLUMN move_uci_list"))
+
+
+def ensure_game_analysis_claim(engine) -> None:
+    """Backfill games.analysis_claimed_at column for existing databases."""
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if "games" in inspector.get_table_names():
+            game_columns = {column["name"] for column in inspector.get_columns("games")}
+            if "analysis_claimed_at" not in game_columns:
+                connection.execute(text("ALTER TABLE games ADD COLUMN analysis_claimed_at TIMESTAMP"))
+
+
+def ensure_hot_path_indexes(engine) -> None:
+    """Create composite indexes used by stats and puzzle queries on existing databases."""
+    statements = [
+        "CREATE INDEX IF NOT EXISTS ix_games_user_result ON games(user_id, result)",
+        "CREATE INDEX IF NOT EXISTS ix_games_user_analyzed ON games(user_id, is_analyzed)",
+        "CREATE INDEX IF NOT EXISTS ix_moves_puzzle_candidates ON moves(game_id) "
+        "WHERE classification IN ('mistake', 'blunder') AND best_move_uci IS NOT NULL",
+    ]
+    with engine.begin() as connection:
+        table_names = set(inspect(connection).get_table_names())
+        if "games" not in table_names or "moves" not in table_names:
+            return
+        for statement in statements:
+            connection.execute(text(statement))
+
+
+def ensure_user_stats_dashboard_cache(engine) -> None:
+    """Backfill user_stats dashboard cache columns for existing databases."""
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if "user_stats" in inspector.get_table_names():
+            stats_columns = {column["name"] for column in inspector.get_columns("user_stats")}
+            json_type = "TEXT" if engine.dialect.name == "sqlite" else "JSON"
+            if "dashboard_cache" not in stats_columns:
+                connection.execute(text(f"ALTER TABLE user_stats ADD COLUMN dashboard_cache {json_type}"))
+            if "dashboard_cache_updated_at" not in stats_columns:
+                connection.execute(text("ALTER TABLE user_stats ADD COLUMN dashboard_cache_updated_at TIMESTAMP"))
+
+
+def ensure_user_stats_analyzed_games(engine) -> None:
+    """Backfill user_stats.analyzed_games column for existing databases."""
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if "user_stats" in inspector.get_table_names():
+            stats_columns = {column["name"] for column in inspector.get_columns("user_stats")}
+            if "analyzed_games" not in stats_columns:
+                connection.execute(text("ALTER TABLE user_stats ADD COLUMN analyzed_games INTEGER"))
+
+
+def ensure_rating_history_index(engine) -> None:
+    """Create the covering index for rating history on existing databases."""
+    if engine.dialect.name == "postgresql":
+        statement = (
+            "CREATE INDEX IF NOT EXISTS ix_games_user_rating_date ON games(user_id, date_played) "
+            "INCLUDE (user_rating, result)"
+        )
+    else:
+        statement = "CREATE INDEX IF NOT EXISTS ix_games_user_rating_date ON games(user_id, date_played)"
+    with engine.begin() as connection:
+        if "games" in inspect(connection).get_table_names():
+            connection.execute(text(statement))
+
+
+def drop_redundant_game_indexes(engine) -> None:
+    """Drop game indexes that other indexes already cover from existing databases."""
+    statements = [
+        # Same key as ix_games_user_rating_date, which also carries the rating columns
+        "DROP INDEX IF EXISTS ix_games_user_date",
+        # Stats aggregate every result per user from ix_games_user_stats instead
+        "DROP INDEX IF EXISTS ix_games_user_color_result",
+    ]
+    with engine.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement))
+
+
+def ensure_puzzle_candidates(engine) -> None:
+    """Fill puzzle_candidates from already-analyzed games when the table is new and empty."""
+    with engine.begin() as connection:
+        table_names = set(inspect(connection).get_table_names())
+        if not {"puzzle_candidates", "moves", "games"} <= table_names:
+            return
+        if connection.execute(text("SELECT 1 FROM puzzle_candidates LIMIT 1")).first():
+            return
+        connection.execute(text("""
+            INSERT INTO puzzle_candidates
+                (user_id, move_id, game_id, half_move, fen_before, best_move_uci, classification, user_color)
+            SELECT g.user_id, m.id, m.game_id, m.half_move, m.fen_before, m.best_move_uci, m.classification, g.user_color
+            FROM moves m
+            JOIN games g ON g.id = m.game_id
+            WHERE g.analysis_state = 'analyzed'
+              AND m.best_move_uci IS NOT NULL
+              AND m.classification IN ('mistake', 'blunder')
+              AND ((g.user_color = 'white' AND m.is_white) OR (g.user_color = 'black' AND NOT m.is_white))
+        """))
+
+
+def ensure_user_stats_index(engine) -> None:
+    """Create the covering index for the user stats aggregate on existing databases."""
+    if engine.dialect.name == "postgresql":
+        statement = (
+            "CREATE INDEX IF NOT EXISTS ix_games_user_stats ON games(user_id) "
+            "INCLUDE (result, user_color, is_analyzed, accuracy, average_centipawn_loss, "
+            "num_blunders, num_mistakes, num_inaccuracies)"
+        )
+    else:
+        statement = "CREATE INDEX IF NOT EXISTS ix_games_user_stats ON games(user_id)"
+    with engine.begin() as connection:
+        if "games" in inspect(connection).get_table_names():
+            connection.execute(text(statement))
+
+
+def ensure_analysis_jobs_active_index(engine) -> None:
+    """Create the partial index over running analysis jobs on existing databases."""
+    with engine.begin() as connection:
+        if "analysis_jobs" in inspect(connection).get_table_names():
+            connection.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_analysis_jobs_user_active ON analysis_jobs(user_id) "
+                    "WHERE status IN ('pending', 'processing')"
+                )
+            )
+
+
+def ensure_import_dedup_indexes(engine) -> None:
+    """Create the partial indexes over each user's platform game ids on existing databases."""
+    statements = [
+        "CREATE INDEX IF NOT EXISTS ix_games_user_chess_com_id ON games(user_id, chess_com_id) "
+        "WHERE chess_com_id IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS ix_games_user_lichess_id ON games(user_id, lichess_id) "
+        "WHERE lichess_id IS NOT NULL",
+    ]
+    with engine.begin() as connection:
+        if "games" not in inspect(connection).get_table_names():
+            return
+        for statement in statements:
+            connection.execute(text(statement))
+
+
+def ensure_unanalyzed_games_index(engine) -> None:
+    """Create the partial index over unanalyzed games on existing databases."""
+    with engine.begin() as connection:
+        if "games" in inspect(connection).get_table_names():
+            connection.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_games_user_unanalyzed_date ON games(user_id, date_played) "
+                    "WHERE analysis_state <> 'analyzed'"
+                )
+            )
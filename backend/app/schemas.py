@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from datetime import datetime
 
 
@@ -199,6 +199,29 @@ class DashboardStats(BaseModel):
     opening_stats: List[OpeningStatsItem]
     time_control_stats: List[TimeControlStats]
     performance_over_time: List[PerformanceOverTime]
+    
+    @classmethod
+    def build(cls, data: Dict[str, Any]) -> "DashboardStats":
+        """
+        Assemble dashboard stats from StatsService.get_dashboard_data output
+        
+        Everything here comes from our own DB aggregations, so nested models
+        are built with model_construct instead of being re-validated.
+        """
+        return cls.model_construct(
+            user_stats=_construct_from_attributes(UserStatsResponse, data["user_stats"]),
+            recent_games=[_construct_from_attributes(GameResponse, g) for g in data["recent_games"]],
+            opening_stats=[OpeningStatsItem.model_construct(**o) for o in data["opening_stats"]],
+            time_control_stats=[TimeControlStats.model_construct(**t) for t in data["time_control_stats"]],
+            performance_over_time=[PerformanceOverTime.model_construct(**p) for p in data["performance_over_time"]],
+        )
+
+
+def _construct_from_attributes(model: type, obj: Any) -> BaseModel:
+    """Build a model from an ORM object or dict without validation"""
+    if isinstance(obj, dict):
+        return model.model_construct(**{name: obj.get(name) for name in model.model_fields})
+    return model.model_construct(**{name: getattr(obj, name) for name in model.model_fields})
 
 
 # Opening Schemas
@@ -3,14 +3,67 @@ import chess.pgn
 import chess.engine
 import asyncio
 import logging
+from contextlib import asynccontextmanager
 from io import StringIO
 from typing import Any, List, Dict, Optional, Tuple
 from ..config import settings
 from .coach_service import CoachService
+from .engine_pool import engine_pool
+from . import position_cache
 
 # Set up logger for AnalysisService
 logger = logging.getLogger(__name__)
 
+# Move classification thresholds, all in centipawns from the mover's perspective
+BEST_MAX_CP_LOSS = 10
+EXCELLENT_MAX_CP_LOSS = 25
+GOOD_MAX_CP_LOSS = 50
+MISTAKE_MIN_CP_LOSS = 150
+BLUNDER_MIN_CP_LOSS = 300
+
+WINNING_CP = 150  # Clearly better (+1.5)
+LOSING_CP = -150  # Clearly worse (-1.5)
+EQUAL_CP = 50  # Within +/-0.5 is roughly equal
+CLEARLY_LOSING_CP = -200  # Worse than -2.0
+BIG_ADVANTAGE_CP = 200  # Better than +2.0
+WINNING_BIG_CP = 250  # Better than +2.5
+STILL_SOLID_CP = -100  # Above -1.0 the position is still holding
+
+
+def _classify_with_evals(abs_loss: float, eval_before: float, eval_after: float) -> str:
+    """
+    Classify a move with a loss above GOOD_MAX_CP_LOSS when both evaluations are known
+    
+    Kept free of None checks so the hot path is plain float comparisons.
+    """
+    # A BLUNDER is a move that:
+    # 1. Turns a winning position (>+1.5) into a losing position (<-1.5) OR
+    # 2. Turns an equal or slightly better position into a clearly losing one (<-2.0) OR
+    # 3. Loses massive material/advantage (>300 CP) from any position
+    if eval_before > WINNING_CP:
+        if eval_after < LOSING_CP:
+            return "blunder"
+    elif eval_before > -EQUAL_CP and eval_after < CLEARLY_LOSING_CP:
+        return "blunder"
+    
+    if abs_loss >= BLUNDER_MIN_CP_LOSS:
+        return "blunder"
+    
+    # A MISTAKE is a move that:
+    # 1. Turns advantage into equality or slight disadvantage OR
+    # 2. Turns winning into only slightly better OR
+    # 3. Significantly worsens the position (150-300 CP)
+    if eval_before > BIG_ADVANTAGE_CP and -EQUAL_CP <= eval_after <= EQUAL_CP:
+        return "mistake"
+    if eval_before > WINNING_BIG_CP and EQUAL_CP < eval_after < WINNING_CP:
+        return "mistake"
+    if abs_loss >= MISTAKE_MIN_CP_LOSS:
+        return "mistake"
+    
+    # An INACCURACY misses the best move but keeps a solid position
+    return "inaccuracy" if eval_after > STILL_SOLID_CP else "mistake"
+
+
 
 class AnalysisService:
     """Service for analyzing chess games with Stockfish"""
@@ -19,9 +72,23 @@ class AnalysisService:
         self.stockfish_path = settings.STOCKFISH_PATH
         self.depth = settings.STOCKFISH_DEPTH
         self.time_limit = settings.STOCKFISH_TIME_LIMIT
+        self.nodes = settings.STOCKFISH_NODES
         self.coach_service = CoachService()
+        self.engine_pool = engine_pool
         logger.debug(f"AnalysisService initialized: depth={self.depth}, time_limit={self.time_limit}s, stockfish_path={self.stockfish_path}")
     
+    @asynccontextmanager
+    async def _acquire_engine(self):
+        """Borrow a persistent Stockfish process from the shared pool"""
+        async with self.engine_pool.acquire() as engine:
+            yield engine
+    
+    def _limit(self) -> chess.engine.Limit:
+        """Search limit per position: the node budget if one is set, else depth/time"""
+        if self.nodes:
+            return chess.engine.Limit(nodes=self.nodes)
+        return chess.engine.Limit(depth=self.depth, time=self.time_limit)
+    
     def parse_pgn(self, pgn_string: str) -> Optional[chess.pgn.Game]:
         """Parse a PGN string into a chess.pgn.Game object"""
         try:
@@ -47,65 +114,24 @@ class AnalysisService:
         abs_loss = abs(cp_loss)
         
         # Perfect or near-perfect moves
-        if abs_loss <= 10:
+        if abs_loss <= BEST_MAX_CP_LOSS:
             return "best"
-        elif abs_loss <= 25:
+        elif abs_loss <= EXCELLENT_MAX_CP_LOSS:
             return "excellent"
-        elif abs_loss <= 50:
+        elif abs_loss <= GOOD_MAX_CP_LOSS:
             return "good"
         
-        # For mistakes and blunders, consider the position evaluation
-        # Convert centipawns to pawns for easier reasoning
-        eval_before_pawns = (eval_before / 100) if eval_before else 0
-        eval_after_pawns = (eval_after / 100) if eval_after else 0
-        
-        # A BLUNDER is a move that:
-        # 1. Turns a winning position (>+1.5) into a losing position (<-1.5) OR
-        # 2. Turns an equal position into a losing position (<-2.0) OR
-        # 3. Loses massive material/advantage (>300 CP) from any position
         if eval_before is not None and eval_after is not None:
-            # Check if position went from winning to losing
-            if eval_before_pawns > 1.5 and eval_after_pawns < -1.5:
-                return "blunder"
-            
-            # Check if position went from equal/slightly better to clearly losing
-            if abs(eval_before_pawns) < 0.5 and eval_after_pawns < -2.0:
-                return "blunder"
-            
-            # Check if position went from slightly better to clearly losing
-            if 0.5 <= eval_before_pawns <= 1.5 and eval_after_pawns < -2.0:
-                return "blunder"
+            return _classify_with_evals(abs_loss, eval_before, eval_after)
         
-        # Massive centipawn loss is always a blunder (losing a piece without compensation)
-        if abs_loss >= 300:
+        # Without both evaluations only the size of the loss is known
+        if abs_loss >= BLUNDER_MIN_CP_LOSS:
             return "blunder"
-        
-        # A MISTAKE is a move that:
-        # 1. Significantly worsens the position (150-300 CP) OR
-        # 2. Turns advantage into equality or slight disadvantage
-        if eval_before is not None and eval_after is not None:
-            # Turn advantage into equality or worse
-            if eval_before_pawns > 2.0 and -0.5 <= eval_after_pawns <= 0.5:
-                return "mistake"
-            
-            # Turn winning into only slightly better
-            if eval_before_pawns > 2.5 and 0.5 < eval_after_pawns < 1.5:
-                return "mistake"
-        
-        # Moderate centipawn loss
-        if 150 <= abs_loss < 300:
+        if abs_loss >= MISTAKE_MIN_CP_LOSS:
             return "mistake"
-        
-        # An INACCURACY is missing the best move but maintaining a solid position
-        if 50 < abs_loss < 150:
-            # If position is still good after the move, it's just an inaccuracy
-            if eval_after is not None and eval_after_pawns > -1.0:
-                return "inaccuracy"
-            # If position became clearly worse, it's a mistake
-            else:
-                return "mistake"
-        
-        return "good"
+        if eval_after is not None and eval_after > STILL_SOLID_CP:
+            return "inaccuracy"
+        return "mistake"
     
     def get_evaluation_cp(self, info: Dict) -> Optional[float]:
         """Extract centipawn evaluation from engine info"""
@@ -127,6 +153,27 @@ class AnalysisService:
             cp = score.relative.cp
             return float(cp) if cp is not None else None
     
+    async def _evaluate(
+        self,
+        engine: chess.engine.UciProtocol,
+        board: chess.Board,
+        key: str,
+        cached: Dict[str, position_cache.Evaluation],
+        fresh: Dict[str, position_cache.Evaluation],
+    ) -> position_cache.Evaluation:
+        """Evaluation and best move for the position, from the cache or the engine"""
+        if key in cached:
+            return cached[key]
+        if key in fresh:
+            # Repeated earlier in this game (e.g. a repetition or shuffling pieces)
+            return fresh[key]
+        info = await engine.analyse(board, self._limit())
+        pv = info.get("pv", [])
+        evaluation = (self.get_evaluation_cp(info), pv[0] if pv else None)
+        if evaluation[0] is not None:
+            fresh[key] = evaluation
+        return evaluation
+    
     async def analyze_game(self, pgn_string: str, user_color: str) -> Dict:
         """
         Analyze a complete game and return move-by-move analysis
@@ -135,7 +182,12 @@ class AnalysisService:
         - Single analysis per position - reuse evaluation from previous position
         - Each position analyzed once (N+1 analyses for N moves, instead of 2N)
         - Efficient board state management (copy/pop instead of rebuilding)
-        - Coach commentary limited to 5 per game with timeout protection
+        - Positions evaluated in earlier games come from the Redis position cache,
+          looked up for the whole game in one round-trip
+        - Positions are searched from the end of the game backward, so the engine's
+          hash table carries later lines into the positions that lead to them
+        - Coach commentary limited to 5 per game, generated concurrently with timeout protection
+        - Stockfish process borrowed from a persistent pool, not spawned per game
         
         For a 40-move game: ~41 engine analyses (one per position, reused)
         Previously: ~80 analyses (before + after per move) = 50% faster!
@@ -146,7 +198,7 @@ class AnalysisService:
                 - stats: Overall game stats
 
         """
-        logger.info(f"Starting game analysis for user_color={user_color}")
+        logger.info("Starting game analysis for user_color=%s", user_color)
         game = self.parse_pgn(pgn_string)
         if not game:
             logger.error("Failed to parse PGN")
@@ -161,204 +213,197 @@ class AnalysisService:
         blunders = 0
         mistakes = 0
         inaccuracies = 0
-        coach_commentary_count = 0  # Limit coach commentaries to avoid long analysis times
+        coach_requests = []  # (index into moves_analysis, commentary kwargs)
+        coach_commentary_count = 0
         max_coach_commentaries = 5  # Maximum 5 coach insights per game
+        # Skip best-move SAN and FEN work entirely when the coach is off
+        coach_enabled = self.coach_service.is_enabled()
         
         # Determine if we should analyze this move (only user's moves)
         is_user_white = user_color == "white"
-        logger.debug(f"User is playing {'white' if is_user_white else 'black'}")
+        logger.debug("User is playing %s", "white" if is_user_white else "black")
         
         try:
-            logger.debug(f"Starting Stockfish engine at {self.stockfish_path}")
-            transport, engine = await chess.engine.popen_uci(self.stockfish_path)
-            logger.info("Stockfish engine started successfully")
-            
-            move_number = 1
-            half_move = 0
-            
-            # Build list of all moves first
-            all_moves = []
-            temp_board = game.board()
-            for node in game.mainline():
-                move = node.move
-                is_white = temp_board.turn == chess.WHITE
-                san = temp_board.san(move)
-                all_moves.append({
-                    'move': move,
-                    'is_white': is_white,
-                    'san': san
-                })
-                temp_board.push(move)
-            
-            logger.info(f"Game has {len(all_moves)} moves to analyze")
+            # Key every position of the game (initial position first) and fetch the
+            # ones evaluated before in a single cache round-trip
+            position_keys = [position_cache.position_key(board, self.depth, self.time_limit, self.nodes)]
+            replay = board.copy(stack=False)
+            for move in game.mainline_moves():
+                replay.push(move)
+                position_keys.append(position_cache.position_key(replay, self.depth, self.time_limit, self.nodes))
+            cached = await asyncio.to_thread(position_cache.get_many, position_keys)
+            fresh = {}
             
-            # Analyze initial position (before first move)
-            logger.debug("Analyzing initial position")
-            eval_before = None
-            best_move = None
-            try:
-                info = await engine.analyse(
-                    board,
-                    chess.engine.Limit(depth=self.depth, time=self.time_limit)
-                )
-                eval_before = self.get_evaluation_cp(info)
-                pv = info.get("pv", [])
-                best_move = pv[0] if pv else None
-                logger.debug(f"Initial position evaluation: {eval_before} cp")
-            except Exception as e:
-                logger.warning(f"Error evaluating initial position: {e}")
-            
-            # Now analyze each move - reuse evaluation from previous position
-            for idx, move_info in enumerate(all_moves):
-                move = move_info['move']
-                is_white_move = move_info['is_white']
-                move_san = move_info['san']
+            async with self._acquire_engine() as engine:
+                move_number = 1
+                half_move = 0
+                total_moves = len(position_keys) - 1
                 
-                # Log progress every 10 moves
-                if (idx + 1) % 10 == 0:
-                    logger.debug(f"Analyzing move {idx + 1}/{len(all_moves)}: {move_san}")
+                logger.info("Game has %s moves to analyze (%s positions cached)", total_moves, len(cached))
                 
-                # eval_before comes from previous iteration's eval_after (or initial analysis)
-                # best_move comes from previous analysis
-                
-                # Make the move
-                board.push(move)
+                # Evaluate every position from the final one back to the start. The
+                # engine's hash table then already holds the lines found later in the
+                # game when it searches the positions leading into them.
+                evaluations = [(None, None)] * len(position_keys)
+                for position_idx in range(total_moves, -1, -1):
+                    try:
+                        evaluations[position_idx] = await self._evaluate(
+                            engine, replay, position_keys[position_idx], cached, fresh
+                        )
+                    except Exception as e:
+                        logger.warning("Error evaluating position %s: %s", position_idx, e)
+                    if position_idx:
+                        replay.pop()
                 
-                # Analyze position after the move (this eval will be reused as eval_before for next move)
-                try:
-                    info_after = await engine.analyse(
-                        board,
-                        chess.engine.Limit(depth=self.depth, time=self.time_limit)
-                    )
-                    eval_after = self.get_evaluation_cp(info_after)
-                    # Get best move for next position from PV
-                    pv = info_after.get("pv", [])
-                    next_best_move = pv[0] if pv else None
-                except Exception as e:
-                    logger.warning(f"Error evaluating position after move {move_san}: {e}")
-                    eval_after = None
-                    next_best_move = None
+                # Initial position (before first move)
+                eval_before, best_move = evaluations[0]
+                logger.debug("Initial position evaluation: %s cp", eval_before)
                 
-                # Calculate centipawn loss using reused evaluations
-                cp_loss = None
-                eval_after_raw = eval_after  # Save before any mutation for storage and next-iteration reuse
-                eval_before_for_classification = eval_before
-                eval_after_for_classification = eval_after
+                # Now classify each move - the evaluation after a move is the one before the next
+                for idx, move in enumerate(game.mainline_moves()):
+                    is_white_move = board.turn == chess.WHITE
+                    move_san = board.san(move)
+                    
+                    # Log progress every 10 moves
+                    if (idx + 1) % 10 == 0:
+                        logger.debug("Analyzing move %s/%s: %s", idx + 1, total_moves, move_san)
+                    
+                    # eval_before comes from previous iteration's eval_after (or initial analysis)
+                    # best_move comes from previous analysis
+                    
+                    # Remember the position before the move (stored on the move for puzzles)
+                    fen_before = board.fen()
+                    
+                    # Make the move
+                    board.push(move)
+                    
+                    # Position after the move (this eval will be reused as eval_before for next move);
+                    # the best move for the next position comes with its evaluation
+                    eval_after, next_best_move = evaluations[idx + 1]
+                    
+                    # Calculate centipawn loss using reused evaluations
+                    cp_loss = None
+                    eval_after_raw = eval_after  # Save before any mutation for storage and next-iteration reuse
+                    eval_before_for_classification = eval_before
+                    eval_after_for_classification = eval_after
 
-                if eval_before is not None and eval_after is not None:
-                    # Flip eval_before for black moves so both eval_before and eval_after
-                    # are from white's perspective before computing cp_loss.
-                    # eval_before (raw) is from side-to-move's perspective; for black that's black's POV.
-                    # eval_after (raw) is always from the next side-to-move's perspective; after a black
-                    # move that's white's POV — already the same perspective as flipped eval_before.
-                    # This keeps cp_loss consistent with the stored values:
-                    #   stored eval_before = -eval_before_raw (flipped)
-                    #   stored eval_after  = -eval_after_raw
-                    #   cp_loss = stored_eval_before + stored_eval_after
-                    if not is_white_move:
-                        eval_before = -eval_before
+                    if eval_before is not None and eval_after is not None:
+                        # Flip eval_before for black moves so both eval_before and eval_after
+                        # are from white's perspective before computing cp_loss.
+                        # eval_before (raw) is from side-to-move's perspective; for black that's black's POV.
+                        # eval_after (raw) is always from the next side-to-move's perspective; after a black
+                        # move that's white's POV — already the same perspective as flipped eval_before.
+                        # This keeps cp_loss consistent with the stored values:
+                        #   stored eval_before = -eval_before_raw (flipped)
+                        #   stored eval_after  = -eval_after_raw
+                        #   cp_loss = stored_eval_before + stored_eval_after
+                        if not is_white_move:
+                            eval_before = -eval_before
 
-                    cp_loss = eval_before - eval_after
+                        cp_loss = eval_before - eval_after
+                        
+                        # Only count user's moves in statistics
+                        should_analyze = (is_white_move and is_user_white) or (not is_white_move and not is_user_white)
+                        
+                        if should_analyze and cp_loss is not None:
+                            total_cp_loss += max(0, cp_loss)  # Only count losses
+                            num_analyzed_moves += 1
+                    
+                    # Classify the move using ORIGINAL evaluations (from current player's perspective)
+                    # For black moves, we need to flip the evaluations for classification
+                    if not is_white_move and eval_before_for_classification is not None:
+                        eval_before_for_classification = -eval_before_for_classification
+                        eval_after_for_classification = -eval_after_for_classification
                     
-                    # Only count user's moves in statistics
+                    classification = self.classify_move(cp_loss, eval_before_for_classification, eval_after_for_classification)
+                    
+                    # Count errors (only for user's moves)
                     should_analyze = (is_white_move and is_user_white) or (not is_white_move and not is_user_white)
+                    if should_analyze:
+                        if classification == "blunder":
+                            blunders += 1
+                            logger.debug("Blunder detected on move %s (cp_loss=%s)", move_san, cp_loss)
+                        elif classification == "mistake":
+                            mistakes += 1
+                            logger.debug("Mistake detected on move %s (cp_loss=%s)", move_san, cp_loss)
+                        elif classification == "inaccuracy":
+                            inaccuracies += 1
                     
-                    if should_analyze and cp_loss is not None:
-                        total_cp_loss += max(0, cp_loss)  # Only count losses
-                        num_analyzed_moves += 1
-                
-                # Classify the move using ORIGINAL evaluations (from current player's perspective)
-                # For black moves, we need to flip the evaluations for classification
-                if not is_white_move and eval_before_for_classification is not None:
-                    eval_before_for_classification = -eval_before_for_classification
-                    eval_after_for_classification = -eval_after_for_classification
-                
-                classification = self.classify_move(cp_loss, eval_before_for_classification, eval_after_for_classification)
-                
-                # Count errors (only for user's moves)
-                should_analyze = (is_white_move and is_user_white) or (not is_white_move and not is_user_white)
-                if should_analyze:
-                    if classification == "blunder":
-                        blunders += 1
-                        logger.debug(f"Blunder detected on move {move_san} (cp_loss={cp_loss:.1f})")
-                    elif classification == "mistake":
-                        mistakes += 1
-                        logger.debug(f"Mistake detected on move {move_san} (cp_loss={cp_loss:.1f})")
-                    elif classification == "inaccuracy":
-                        inaccuracies += 1
-                
-                # Generate coach commentary for user's clear mistakes and blunders only
-                # Limit to max_coach_commentaries to prevent long analysis times
-                coach_commentary = None
-                if should_analyze and classification in ["blunder", "mistake"] and coach_commentary_count < max_coach_commentaries:
-                    try:
-                        # Determine game phase
-                        phase = "opening" if half_move < 20 else ("endgame" if half_move > len(all_moves) * 0.7 else "middlegame")
-                        
-                        # OPTIMIZATION: Use board.copy() and pop() instead of rebuilding from scratch
-                        # This is much faster than rebuilding the entire game
-                        temp_board = board.copy()
-                        temp_board.pop()  # Undo the last move to get position before
-                        fen_before = temp_board.fen()
-                        
-                        # Get best move in SAN
-                        best_move_san = None
-                        if best_move:
-                            best_move_san = temp_board.san(best_move)
-                        
-                        # Generate commentary with timeout protection
+                    # Queue coach commentary for user's clear mistakes and blunders only;
+                    # requests are sent concurrently once the engine work is done.
+                    # Limit to max_coach_commentaries to prevent long analysis times
+                    if (
+                        coach_enabled
+                        and should_analyze
+                        and classification in ["blunder", "mistake"]
+                        and len(coach_requests) < max_coach_commentaries
+                    ):
                         try:
-                            coach_commentary = await asyncio.wait_for(
-                                self.coach_service.generate_move_commentary(
-                                    move_san=move_san,
-                                    classification=classification,
-                                    centipawn_loss=cp_loss if cp_loss is not None else 0,  # Still passed for coach context
-                                    fen_before=fen_before,
-                                    fen_after=board.fen(),
-                                    best_move_san=best_move_san,
-                                    game_phase=phase,
-                                    user_color=user_color
-                                ),
-                                timeout=25.0  # 25 second timeout for coach commentary
-                            )
-                        except asyncio.TimeoutError:
-                            logger.warning(f"Coach commentary generation timed out for move {move_san}. Continuing analysis without commentary.")
-                            coach_commentary = None
-                        
-                        # Increment counter if commentary was generated
-                        if coach_commentary:
-                            coach_commentary_count += 1
-                            logger.debug(f"Coach commentary generated for move {move_san} ({coach_commentary_count}/{max_coach_commentaries})")
-                    except Exception as e:
-                        logger.warning(f"Error generating coach commentary for move {move_san}: {e}")
-                        coach_commentary = None
-                
-                # Store move analysis (cp_loss not stored, only used for classification)
-                moves_analysis.append({
-                    "move_number": move_number,
-                    "is_white": is_white_move,
-                    "half_move": half_move,
-                    "move_san": move_san,
-                    "move_uci": move.uci(),
-                    "evaluation_before": eval_before,
-                    "evaluation_after": -eval_after_raw if eval_after_raw is not None else None,  # Flip for next player
-                    "best_move_uci": best_move.uci() if best_move else None,
-                    "classification": classification,
-                    "centipawn_loss": cp_loss, 
-                    "coach_commentary": coach_commentary,
-                })
-                
-                # Reuse eval_after as eval_before for next move (use raw/unmutated value)
-                eval_before = eval_after_raw
-                best_move = next_best_move
-                
-                if not is_white_move:
-                    move_number += 1
-                
-                half_move += 1
+                            # Determine game phase
+                            phase = "opening" if half_move < 20 else ("endgame" if half_move > total_moves * 0.7 else "middlegame")
+                            
+                            # OPTIMIZATION: Use board.copy() and pop() instead of rebuilding from scratch
+                            # This is much faster than rebuilding the entire game
+                            # Only the last move is needed on the stack to pop back
+                            temp_board = board.copy(stack=1)
+                            temp_board.pop()  # Undo the last move to get position before
+                            
+                            # Get best move in SAN
+                            best_move_san = None
+                            if best_move:
+                                best_move_san = temp_board.san(best_move)
+                            
+                            coach_requests.append((len(moves_analysis), {
+                                "move_san": move_san,
+                                "classification": classification,
+                                "centipawn_loss": cp_loss if cp_loss is not None else 0,  # Still passed for coach context
+                                "fen_before": fen_before,
+                                "fen_after": board.fen(),
+                                "best_move_san": best_move_san,
+                                "game_phase": phase,
+                                "user_color": user_color,
+                            }))
+                        except Exception as e:
+                            logger.warning("Error preparing coach commentary for move %s: %s", move_san, e)
+                    
+                    # Store move analysis (cp_loss not stored, only used for classification)
+                    moves_analysis.append({
+                        "move_number": move_number,
+                        "is_white": is_white_move,
+                        "half_move": half_move,
+                        "move_san": move_san,
+                        "move_uci": move.uci(),
+                        "fen_before": fen_before,
+                        "evaluation_before": eval_before,
+                        "evaluation_after": -eval_after_raw if eval_after_raw is not None else None,  # Flip for next player
+                        "best_move_uci": best_move.uci() if best_move else None,
+                        "classification": classification,
+                        "centipawn_loss": cp_loss, 
+                        "coach_commentary": None,
+                    })
+                    
+                    # Reuse eval_after as eval_before for next move (use raw/unmutated value)
+                    eval_before = eval_after_raw
+                    best_move = next_best_move
+                    
+                    if not is_white_move:
+                        move_number += 1
+                    
+                    half_move += 1
+            
+            await asyncio.to_thread(position_cache.set_many, fresh)
             
-            await engine.quit()
-            logger.debug("Stockfish engine closed")
+            # Generate queued coach commentary concurrently, after the engine
+            # has been returned to the pool
+            if coach_requests:
+                commentaries = await self.coach_service.generate_move_commentaries_batch(
+                    [request for _, request in coach_requests],
+                    timeout=25.0  # 25 second timeout per coach commentary
+                )
+                for (move_index, _), coach_commentary in zip(coach_requests, commentaries):
+                    if coach_commentary:
+                        moves_analysis[move_index]["coach_commentary"] = coach_commentary
+                        coach_commentary_count += 1
             
             # Calculate overall statistics
             # Note: average_centipawn_loss is not stored, but accuracy can still be calculated
@@ -370,9 +415,13 @@ class AnalysisService:
             if avg_cp_loss is not None:
                 accuracy = max(0, min(100, 100 - avg_cp_loss / 10))
             
-            logger.info(f"Analysis complete: {len(moves_analysis)} moves analyzed, accuracy={accuracy:.1f}%, "
-                       f"blunders={blunders}, mistakes={mistakes}, inaccuracies={inaccuracies}, "
-                       f"coach_commentaries={coach_commentary_count}")
+            # accuracy is None when none of the user's moves could be evaluated
+            logger.info(
+                "Analysis complete: %s moves analyzed, accuracy=%s, blunders=%s, mistakes=%s, "
+                "inaccuracies=%s, coach_commentaries=%s",
+                len(moves_analysis), f"{accuracy:.1f}%" if accuracy is not None else "N/A",
+                blunders, mistakes, inaccuracies, coach_commentary_count
+            )
             
             return {
                 "moves": moves_analysis,
@@ -404,15 +453,15 @@ class AnalysisService:
         eco_code = game.headers.get("ECO")
         opening_name = game.headers.get("Opening")
         
-        # Count opening moves (typically first 10-15 moves or until out of book)
-        board = game.board()
+        # Count opening moves (typically first 10-15 moves or until out of book),
+        # following the mainline pointers; assume the opening is over after 20 ply
         ply = 0
-        for node in game.mainline():
+        node = game.next()
+        while node is not None and ply < 20:
             ply += 1
-            if ply > 20:  # Assume opening is over after 20 ply
-                break
+            node = node.next()
         
-        return eco_code, opening_name, min(ply, 20)
+        return eco_code, opening_name, ply
     
     async def analyze_position(self, fen: str) -> Dict:
         """
@@ -436,15 +485,10 @@ class AnalysisService:
             return {"error": "Invalid FEN string"}
         
         try:
-            logger.debug("Starting Stockfish engine for position analysis")
-            transport, engine = await chess.engine.popen_uci(self.stockfish_path)
-            
             # Analyze the position
-            logger.debug(f"Analyzing position with depth={self.depth}, time_limit={self.time_limit}s")
-            info = await engine.analyse(
-                board,
-                chess.engine.Limit(depth=self.depth, time=self.time_limit)
-            )
+            logger.debug(f"Analyzing position with {self._limit()}")
+            async with self._acquire_engine() as engine:
+                info = await engine.analyse(board, self._limit())
             
             # Extract evaluation
             score = info.get("score")
@@ -472,8 +516,6 @@ class AnalysisService:
                 best_move_uci = best_move.uci()
                 best_move_san = board.san(best_move)
             
-            await engine.quit()
-            
             logger.debug(f"Position analysis complete: eval={evaluation}, best_move={best_move_san}, mate_in={mate_in}")
             
             return {
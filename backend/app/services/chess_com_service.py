@@ -1,12 +1,90 @@
+import ijson
+import orjson
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util import Retry
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import re
 import chess.pgn
 from io import StringIO
 from ..config import settings
 
+# Archive URLs end in .../YYYY/MM
+ARCHIVE_MONTH_RE = re.compile(r"/(\d{4})/(\d{1,2})/?$")
+
+# Monthly archives downloaded at once; each fetch is mostly waiting on the network.
+# Kept low since Chess.com answers bursts of parallel requests with 429s (retried by the session)
+ARCHIVE_FETCH_CONCURRENCY = 8
+
+
+def parse_game_data(game_data: Dict, target_username: str) -> Optional[Dict]:
+    """Parse a Chess.com game into our format (module-level so it can run in a process pool)"""
+    target_username = target_username.lower()
+    
+    white_username = game_data["white"]["username"].lower()
+    black_username = game_data["black"]["username"].lower()
+    
+    # Determine user's color and rating
+    if white_username == target_username:
+        user_color = "white"
+        user_result = game_data["white"]["result"]
+        user_rating = game_data["white"].get("rating")
+        opponent = game_data["black"]["username"]
+    elif black_username == target_username:
+        user_color = "black"
+        user_result = game_data["black"]["result"]
+        user_rating = game_data["black"].get("rating")
+        opponent = game_data["white"]["username"]
+    else:
+        return None  # User not in this game
+    
+    # Determine result
+    if user_result == "win":
+        result = "win"
+    elif user_result in ["checkmated", "resigned", "timeout", "lose", "abandoned"]:
+        result = "loss"
+    elif user_result in ["agreed", "stalemate", "repetition", "timevsinsufficient", "insufficient"]:
+        result = "draw"
+    else:
+        result = "draw"  # Default to draw for unknown results
+    
+    # Get PGN
+    pgn = game_data.get("pgn", "")
+    
+    # Extract opening from PGN headers if available
+    opening_eco = None
+    opening_name = None
+    try:
+        pgn_io = StringIO(pgn)
+        game = chess.pgn.read_game(pgn_io)
+        if game:
+            opening_eco = game.headers.get("ECO")
+            opening_name = game.headers.get("Opening")
+    except:
+        pass
+    
+    return {
+        "chess_com_url": game_data.get("url"),
+        "chess_com_id": game_data.get("url", "").split("/")[-1] if game_data.get("url") else None,
+        "pgn": pgn,
+        "white_player": game_data["white"]["username"],
+        "black_player": game_data["black"]["username"],
+        "white_elo": game_data["white"].get("rating"),
+        "black_elo": game_data["black"].get("rating"),
+        "user_color": user_color,
+        "user_rating": user_rating,
+        "result": result,
+        "termination": user_result,
+        "time_class": game_data.get("time_class"),
+        "time_control": game_data.get("time_control"),
+        "opening_eco": opening_eco,
+        "opening_name": opening_name,
+        "date_played": datetime.fromtimestamp(game_data.get("end_time", 0)),
+    }
+
 
 class ChessComService:
     """Service for interacting with Chess.com API"""
@@ -20,13 +98,20 @@ class ChessComService:
         session.headers.update({
             "User-Agent": settings.CHESS_COM_USER_AGENT
         })
+        # 403 means we are blocked, not a transient failure, so it is not retried
         retries = Retry(
             total=5,
             backoff_factor=1,
-            status_forcelist=[403, 429, 500, 502, 503, 504],
-            allowed_methods=["GET"]
+            backoff_jitter=1.0,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            respect_retry_after_header=True
         )
-        session.mount("https://", HTTPAdapter(max_retries=retries))
+        session.mount("https://", HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=retries
+        ))
         return session
     
     def get_archive_urls(self, username: str) -> List[str]:
@@ -45,102 +130,97 @@ class ChessComService:
         elif response.status_code != 200:
             raise Exception(f"Failed to fetch archives from Chess.com: HTTP {response.status_code}. Please try again later.")
         
-        archives = response.json().get("archives", [])
+        archives = orjson.loads(response.content).get("archives", [])
         if not archives:
             raise Exception(f"No games found for user '{username}' on Chess.com.")
         
         return archives
     
-    def get_games_from_archive(self, archive_url: str) -> List[Dict]:
-        """Fetch games from a specific monthly archive"""
-        response = self.session.get(archive_url, timeout=15)
+    def get_games_from_archive(self, archive_url: str, target_username: Optional[str] = None) -> List[Dict]:
+        """
+        Fetch games from a specific monthly archive
         
-        if response.status_code != 200:
-            raise Exception(f"Failed to fetch archive: {response.status_code}")
+        The archive is stream-parsed so that only games involving
+        target_username (when given) are ever materialized.
+        """
+        response = self.session.get(archive_url, timeout=15, stream=True)
         
-        games = response.json().get("games", [])
-        return games
+        try:
+            if response.status_code != 200:
+                raise Exception(f"Failed to fetch archive: {response.status_code}")
+            
+            # Let urllib3 undo gzip/deflate before ijson reads the raw stream
+            response.raw.decode_content = True
+            target = target_username.lower() if target_username else None
+            
+            games = []
+            for game in ijson.items(response.raw, "games.item", use_float=True):
+                if target and (
+                    game["white"]["username"].lower() != target
+                    and game["black"]["username"].lower() != target
+                ):
+                    continue
+                games.append(game)
+            return games
+        finally:
+            response.close()
     
-    def get_all_games(self, username: str) -> List[Dict]:
-        """Fetch all games for a player"""
-        username = username.lower()
-        archives = self.get_archive_urls(username)
+    def _fetch_archives(self, archives: List[str], username: str) -> List[Dict]:
+        """
+        Download several monthly archives concurrently, keeping archive order
         
-        all_games = []
-        for archive_url in archives:
+        An archive that fails to download is skipped rather than failing the import.
+        """
+        def fetch(archive_url: str) -> List[Dict]:
             try:
-                games = self.get_games_from_archive(archive_url)
-                all_games.extend(games)
+                return self.get_games_from_archive(archive_url, username)
             except Exception as e:
                 print(f"Error fetching {archive_url}: {e}")
-                continue
+                return []
+        
+        if len(archives) <= 1:
+            return [game for archive_url in archives for game in fetch(archive_url)]
         
-        return all_games
+        with ThreadPoolExecutor(max_workers=min(ARCHIVE_FETCH_CONCURRENCY, len(archives))) as pool:
+            return [game for games in pool.map(fetch, archives) for game in games]
+    
+    def get_all_games(self, username: str) -> List[Dict]:
+        """Fetch all games for a player"""
+        username = username.lower()
+        archives = self.get_archive_urls(username)
+        return self._fetch_archives(archives, username)
     
     def parse_game_data(self, game_data: Dict, target_username: str) -> Optional[Dict]:
         """Parse a Chess.com game into our format"""
-        target_username = target_username.lower()
-        
-        white_username = game_data["white"]["username"].lower()
-        black_username = game_data["black"]["username"].lower()
-        
-        # Determine user's color and rating
-        if white_username == target_username:
-            user_color = "white"
-            user_result = game_data["white"]["result"]
-            user_rating = game_data["white"].get("rating")
-            opponent = game_data["black"]["username"]
-        elif black_username == target_username:
-            user_color = "black"
-            user_result = game_data["black"]["result"]
-            user_rating = game_data["black"].get("rating")
-            opponent = game_data["white"]["username"]
-        else:
-            return None  # User not in this game
-        
-        # Determine result
-        if user_result == "win":
-            result = "win"
-        elif user_result in ["checkmated", "resigned", "timeout", "lose", "abandoned"]:
-            result = "loss"
-        elif user_result in ["agreed", "stalemate", "repetition", "timevsinsufficient", "insufficient"]:
-            result = "draw"
-        else:
-            result = "draw"  # Default to draw for unknown results
-        
-        # Get PGN
-        pgn = game_data.get("pgn", "")
-        
-        # Extract opening from PGN headers if available
-        opening_eco = None
-        opening_name = None
-        try:
-            pgn_io = StringIO(pgn)
-            game = chess.pgn.read_game(pgn_io)
-            if game:
-                opening_eco = game.headers.get("ECO")
-                opening_name = game.headers.get("Opening")
-        except:
-            pass
-        
-        return {
-            "chess_com_url": game_data.get("url"),
-            "chess_com_id": game_data.get("url", "").split("/")[-1] if game_data.get("url") else None,
-            "pgn": pgn,
-            "white_player": game_data["white"]["username"],
-            "black_player": game_data["black"]["username"],
-            "white_elo": game_data["white"].get("rating"),
-            "black_elo": game_data["black"].get("rating"),
-            "user_color": user_color,
-            "user_rating": user_rating,
-            "result": result,
-            "termination": user_result,
-            "time_class": game_data.get("time_class"),
-            "time_control": game_data.get("time_control"),
-            "opening_eco": opening_eco,
-            "opening_name": opening_name,
-            "date_played": datetime.fromtimestamp(game_data.get("end_time", 0)),
-        }
+        return parse_game_data(game_data, target_username)
+    
+    @staticmethod
+    def _filter_archives_by_month(
+        archives: List[str],
+        from_year: Optional[int],
+        from_month: Optional[int],
+        to_year: Optional[int],
+        to_month: Optional[int]
+    ) -> List[str]:
+        """Select archives in the requested month window with a binary search"""
+        keyed = []
+        unparsed = []
+        for archive_url in archives:
+            match = ARCHIVE_MONTH_RE.search(archive_url)
+            if match:
+                keyed.append((int(match.group(1)) * 12 + int(match.group(2)), archive_url))
+            else:
+                # If parsing fails, include the archive
+                unparsed.append(archive_url)
+        
+        # The API returns archives in chronological order, so this is ~linear
+        keyed.sort()
+        keys = [key for key, _ in keyed]
+        
+        lo = bisect_left(keys, from_year * 12 + (from_month or 1)) if from_year else 0
+        hi = bisect_right(keys, to_year * 12 + (to_month or 12)) if to_year else len(keys)
+        
+        return [archive_url for _, archive_url in keyed[lo:hi]] + unparsed
     
     def fetch_and_parse_games(
         self, 
@@ -160,48 +240,43 @@ class ChessComService:
             to_year: End year
             to_month: End month (1-12)
         """
+        return list(self.iter_parsed_games(
+            username,
+            from_year=from_year,
+            from_month=from_month,
+            to_year=to_year,
+            to_month=to_month
+        ))
+    
+    def iter_parsed_games(
+        self,
+        username: str,
+        from_year: Optional[int] = None,
+        from_month: Optional[int] = None,
+        to_year: Optional[int] = None,
+        to_month: Optional[int] = None
+    ) -> Iterator[Dict]:
+        """
+        Stream parsed games with optional date filtering
+        
+        Takes the same arguments as fetch_and_parse_games. Archives are
+        downloaded ARCHIVE_FETCH_CONCURRENCY at a time and their games yielded
+        before the next group is fetched, so callers can persist them without
+        holding the whole import in memory.
+        """
         # Get all archive URLs
         archives = self.get_archive_urls(username)
         
         # Filter archives by date if specified
         if from_year or to_year:
-            filtered_archives = []
-            for archive_url in archives:
-                # Extract year and month from URL (format: .../YYYY/MM)
-                parts = archive_url.rstrip('/').split('/')
-                if len(parts) >= 2:
-                    try:
-                        year = int(parts[-2])
-                        month = int(parts[-1])
-                        
-                        # Check if within date range
-                        if from_year and (year < from_year or (year == from_year and month < (from_month or 1))):
-                            continue
-                        if to_year and (year > to_year or (year == to_year and month > (to_month or 12))):
-                            continue
-                        
-                        filtered_archives.append(archive_url)
-                    except ValueError:
-                        # If parsing fails, include the archive
-                        filtered_archives.append(archive_url)
-            archives = filtered_archives
-        
-        # Fetch games from selected archives
-        raw_games = []
-        for archive_url in archives:
-            try:
-                games = self.get_games_from_archive(archive_url)
-                raw_games.extend(games)
-            except Exception as e:
-                print(f"Error fetching {archive_url}: {e}")
-                continue
+            archives = self._filter_archives_by_month(archives, from_year, from_month, to_year, to_month)
         
-        # Parse games
-        parsed_games = []
-        for game_data in raw_games:
-            parsed = self.parse_game_data(game_data, username)
-            if parsed:
-                parsed_games.append(parsed)
-        
-        return parsed_games
+        for start in range(0, len(archives), ARCHIVE_FETCH_CONCURRENCY):
+            raw_games = self._fetch_archives(archives[start:start + ARCHIVE_FETCH_CONCURRENCY], username)
+            yield from self._parse_games(raw_games, username)
+    
+    def _parse_games(self, raw_games: List[Dict], username: str) -> List[Dict]:
+        """Parse raw games, dropping the ones that can't be parsed"""
+        parsed_games = (parse_game_data(game_data, username) for game_data in raw_games)
+        return [parsed for parsed in parsed_games if parsed]
 
@@ -1,12 +1,42 @@
-from typing import Optional, Dict
-import requests
-from openai import OpenAI
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import AsyncIterator, Optional, Dict, List
+import httpx
+import orjson
+from openai import AsyncOpenAI
+from sqlalchemy.exc import IntegrityError
 from ..config import settings
+from ..database import SessionLocal
+from ..models import CoachCommentaryCache
+
+# System prompts are kept byte-identical across calls and sent ahead of the
+# per-move content so provider-side prefix caches (OpenAI prompt caching,
+# Ollama's KV cache) can reuse the prefill
+MOVE_COMMENTARY_SYSTEM_PROMPT = "You are an experienced chess coach providing constructive feedback. Be concise, educational, and encouraging. Write in plain text without any markdown formatting, bold, or special characters. Keep responses to 2-3 clear sentences."
+GAME_SUMMARY_SYSTEM_PROMPT = "You are a supportive chess coach providing game summaries. Be constructive, specific, and encouraging."
+
+# Routes coach requests to the same OpenAI prompt cache shard; bump when the prompts change
+OPENAI_PROMPT_CACHE_KEY = "coach_v1"
+
+# Entries kept in the in-process LRU in front of the coach_commentary_cache table
+COMMENTARY_CACHE_SIZE = 4096
+
+
+class CommentaryStreamError(Exception):
+    """A streamed commentary failed or ended before the provider finished it"""
 
 
 class CoachService:
     """Service for generating AI-powered chess coaching commentary"""
     
+    # Shared by every instance so keep-alive connections outlive a single analysis
+    _http: Optional[httpx.AsyncClient] = None
+    _http_loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    # Commentary LRU shared by every instance (key hash -> commentary)
+    _memory_cache: "OrderedDict[str, str]" = OrderedDict()
+    
     def __init__(self):
         self.provider = settings.COACH_PROVIDER.lower()
         
@@ -18,8 +48,9 @@ class CoachService:
         # Initialize based on provider
         if self.provider == "openai":
             if settings.OPENAI_API_KEY:
-                self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
+                self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
                 self.model = settings.OPENAI_MODEL
+                self.small_model = settings.OPENAI_MODEL_SMALL or self.model
                 self.enabled = True
             else:
                 print("OpenAI API key not found. Coach disabled.")
@@ -30,6 +61,7 @@ class CoachService:
             # Ollama runs locally, no API key needed
             self.ollama_url = settings.OLLAMA_BASE_URL
             self.model = settings.OLLAMA_MODEL
+            self.small_model = settings.OLLAMA_MODEL_SMALL or self.model
             self.enabled = True
             self.client = None
             print(f"Using Ollama with model: {self.model} at {self.ollama_url}")
@@ -43,6 +75,99 @@ class CoachService:
         """Check if coach service is enabled and configured"""
         return self.enabled
     
+    @classmethod
+    def _get_http_client(cls) -> httpx.AsyncClient:
+        """Lazily create the shared async HTTP client for the running event loop"""
+        loop = asyncio.get_running_loop()
+        if cls._http is None or cls._http_loop is not loop:
+            # Pooled connections can't be shared across event loops
+            cls._http = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+            )
+            cls._http_loop = loop
+        return cls._http
+    
+    @classmethod
+    async def aclose(cls) -> None:
+        """Close the shared async HTTP client"""
+        if cls._http is not None:
+            await cls._http.aclose()
+            cls._http = None
+            cls._http_loop = None
+    
+    def _cache_key(self, model: str, *parts) -> str:
+        """Hash the inputs that determine a commentary, including the model"""
+        raw = "|".join(str(part) for part in (*parts, self.provider, model))
+        return hashlib.sha1(raw.encode()).hexdigest()
+    
+    def _select_model(self, classification: str, centipawn_loss: float, game_phase: str) -> str:
+        """
+        Pick the smallest model that can handle the move
+        
+        Large blunders and endgame positions need more careful explanation and
+        go to the configured model; everything else uses the small model.
+        """
+        if game_phase == "endgame":
+            return self.model
+        if classification == "blunder" and abs(centipawn_loss or 0) > settings.COACH_LARGE_MODEL_MIN_CP_LOSS:
+            return self.model
+        return self.small_model
+    
+    def _load_cached_commentary(self, key: str) -> Optional[str]:
+        """Look a commentary up in the coach_commentary_cache table"""
+        db = SessionLocal()
+        try:
+            row = db.query(CoachCommentaryCache.commentary).filter(
+                CoachCommentaryCache.key_hash == key
+            ).first()
+            return row[0] if row else None
+        finally:
+            db.close()
+    
+    def _save_cached_commentary(self, key: str, model: str, commentary: str) -> None:
+        """Persist a commentary to the coach_commentary_cache table"""
+        db = SessionLocal()
+        try:
+            db.add(CoachCommentaryCache(key_hash=key, model=model, commentary=commentary))
+            db.commit()
+        except IntegrityError:
+            # Another worker cached the same key first
+            db.rollback()
+        finally:
+            db.close()
+    
+    def _remember(self, key: str, commentary: str) -> None:
+        cache = CoachService._memory_cache
+        cache[key] = commentary
+        cache.move_to_end(key)
+        if len(cache) > COMMENTARY_CACHE_SIZE:
+            cache.popitem(last=False)
+    
+    async def _get_cached(self, key: str) -> Optional[str]:
+        """Check the in-memory LRU, then the database"""
+        cache = CoachService._memory_cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        
+        try:
+            commentary = await asyncio.to_thread(self._load_cached_commentary, key)
+        except Exception as e:
+            print(f"Coach cache lookup failed: {e}")
+            return None
+        
+        if commentary:
+            self._remember(key, commentary)
+        return commentary
+    
+    async def _store_cached(self, key: str, model: str, commentary: str) -> None:
+        """Write a fresh commentary through to both cache tiers"""
+        self._remember(key, commentary)
+        try:
+            await asyncio.to_thread(self._save_cached_commentary, key, model, commentary)
+        except Exception as e:
+            print(f"Coach cache write failed: {e}")
+    
     async def generate_move_commentary(
         self,
         move_san: str,
@@ -77,6 +202,12 @@ class CoachService:
         if classification not in ["blunder", "mistake"]:
             return None
         
+        model = self._select_model(classification, centipawn_loss, game_phase)
+        cache_key = self._cache_key(model, fen_before, move_san, best_move_san, classification)
+        cached = await self._get_cached(cache_key)
+        if cached:
+            return cached
+        
         try:
             # Build the prompt
             prompt = self._build_coaching_prompt(
@@ -89,55 +220,198 @@ class CoachService:
                 user_color=user_color
             )
             
-            system_prompt = "You are an experienced chess coach providing constructive feedback. Be concise, educational, and encouraging. Write in plain text without any markdown formatting, bold, or special characters. Keep responses to 2-3 clear sentences."
-            
             # Generate commentary based on provider
             if self.provider == "openai":
-                commentary = self._generate_with_openai(system_prompt, prompt)
+                commentary = await self._generate_with_openai(
+                    MOVE_COMMENTARY_SYSTEM_PROMPT,
+                    prompt,
+                    model,
+                    prediction=self._build_commentary_draft(model, move_san, classification, centipawn_loss, best_move_san)
+                )
             elif self.provider == "ollama":
-                commentary = self._generate_with_ollama(system_prompt, prompt)
+                commentary = await self._generate_with_ollama(MOVE_COMMENTARY_SYSTEM_PROMPT, prompt, model)
             else:
                 return None
             
+            if commentary:
+                await self._store_cached(cache_key, model, commentary)
             return commentary
             
         except Exception as e:
             print(f"Error generating coach commentary: {e}")
             return None
     
-    def _generate_with_openai(self, system_prompt: str, user_prompt: str) -> Optional[str]:
+    async def stream_move_commentary(
+        self,
+        move_san: str,
+        classification: str,
+        centipawn_loss: float,
+        fen_before: str,
+        best_move_san: Optional[str],
+        game_phase: str,
+        user_color: str
+    ) -> AsyncIterator[str]:
+        """
+        Stream coaching commentary for a move token by token
+        
+        Takes the same arguments as generate_move_commentary (minus fen_after,
+        which the prompt doesn't use). A cached commentary is yielded whole.
+        The text is cached only if the provider finished the stream; otherwise
+        CommentaryStreamError is raised after the tokens received so far.
+        """
+        if not self.is_enabled() or classification not in ["blunder", "mistake"]:
+            return
+        
+        model = self._select_model(classification, centipawn_loss, game_phase)
+        cache_key = self._cache_key(model, fen_before, move_san, best_move_san, classification)
+        cached = await self._get_cached(cache_key)
+        if cached:
+            yield cached
+            return
+        
+        prompt = self._build_coaching_prompt(
+            move_san=move_san,
+            classification=classification,
+            centipawn_loss=centipawn_loss,
+            fen_before=fen_before,
+            best_move_san=best_move_san,
+            game_phase=game_phase,
+            user_color=user_color
+        )
+        
+        if self.provider == "openai":
+            tokens = self._stream_with_openai(
+                MOVE_COMMENTARY_SYSTEM_PROMPT,
+                prompt,
+                model,
+                prediction=self._build_commentary_draft(model, move_san, classification, centipawn_loss, best_move_san)
+            )
+        elif self.provider == "ollama":
+            tokens = self._stream_with_ollama(MOVE_COMMENTARY_SYSTEM_PROMPT, prompt, model)
+        else:
+            return
+        
+        parts = []
+        async for token in tokens:
+            parts.append(token)
+            yield token
+        
+        commentary = "".join(parts).strip()
+        if commentary:
+            await self._store_cached(cache_key, model, commentary)
+    
+    async def generate_move_commentaries_batch(
+        self,
+        moves: List[Dict],
+        timeout: Optional[float] = None
+    ) -> List[Optional[str]]:
+        """
+        Generate coaching commentary for several moves concurrently
+        
+        Args:
+            moves: Keyword arguments for generate_move_commentary, one dict per move
+            timeout: Per-move timeout in seconds (None for no timeout)
+            
+        Returns:
+            Commentary for each move in the same order (None where generation failed)
+        """
+        if not self.is_enabled():
+            return [None] * len(moves)
+        
+        # Cap in-flight LLM requests; Ollama serializes generation internally
+        semaphore = asyncio.Semaphore(settings.COACH_CONCURRENCY)
+        
+        async def generate(move: Dict) -> Optional[str]:
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(self.generate_move_commentary(**move), timeout=timeout)
+                except asyncio.TimeoutError:
+                    print(f"Coach commentary timed out for move {move.get('move_san')}. Skipping.")
+                    return None
+        
+        return await asyncio.gather(*(generate(move) for move in moves))
+    
+    def _build_commentary_draft(
+        self,
+        model: str,
+        move_san: str,
+        classification: str,
+        centipawn_loss: float,
+        best_move_san: Optional[str]
+    ) -> Optional[str]:
+        """
+        Deterministic draft of a move commentary, used as an OpenAI Predicted Output
+        
+        None when predictions are off or the model doesn't accept them, since the
+        API rejects the whole request for such models.
+        """
+        if not settings.COACH_OPENAI_PREDICTION:
+            return None
+        if not model.startswith(tuple(settings.COACH_OPENAI_PREDICTION_MODELS)):
+            return None
+        draft = f"Playing {move_san} was a {classification} because it loses roughly {int(abs(centipawn_loss or 0))} centipawns."
+        if best_move_san:
+            draft += f" A stronger choice was {best_move_san}."
+        return draft
+    
+    def _openai_sampling(self, prediction: Optional[str]) -> Dict:
+        """
+        Extra request arguments for OpenAI
+        
+        Newer request fields go through extra_body since the pinned SDK predates
+        them. A low temperature lets the server accept more of a predicted draft.
+        """
+        extra_body = {"prompt_cache_key": OPENAI_PROMPT_CACHE_KEY}
+        if not prediction:
+            return {"temperature": 0.7, "extra_body": extra_body}
+        extra_body["prediction"] = {"type": "content", "content": prediction}
+        return {"temperature": 0.3, "extra_body": extra_body}
+    
+    async def _generate_with_openai(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        model: Optional[str] = None,
+        prediction: Optional[str] = None
+    ) -> Optional[str]:
         """Generate commentary using OpenAI API"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = await self.client.chat.completions.create(
+                model=model or self.model,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
                 ],
-                max_tokens=150,
-                temperature=0.7
+                max_tokens=settings.COACH_MAX_TOKENS,
+                **self._openai_sampling(prediction)
             )
             return response.choices[0].message.content.strip()
         except Exception as e:
             print(f"OpenAI API error: {e}")
             return None
     
-    def _generate_with_ollama(self, system_prompt: str, user_prompt: str) -> Optional[str]:
+    def _ollama_options(self) -> Dict:
+        """Generation options for Ollama, sized for 1-2 sentence answers"""
+        return {
+            "temperature": 0.7,
+            "num_predict": settings.COACH_MAX_TOKENS,
+            "num_ctx": 1024,  # Prompts are a few hundred tokens; a small context is cheaper
+            "top_p": 0.9,
+            "repeat_penalty": 1.1
+        }
+    
+    async def _generate_with_ollama(self, system_prompt: str, user_prompt: str, model: Optional[str] = None) -> Optional[str]:
         """Generate commentary using Ollama (local LLM)"""
         try:
-            # Combine system and user prompts for Ollama
-            full_prompt = f"{system_prompt}\n\n{user_prompt}"
-            
-            response = requests.post(
+            # The system prompt goes in its own field so the fixed prefix hits Ollama's KV cache
+            response = await self._get_http_client().post(
                 f"{self.ollama_url}/api/generate",
                 json={
-                    "model": self.model,
-                    "prompt": full_prompt,
+                    "model": model or self.model,
+                    "system": system_prompt,
+                    "prompt": user_prompt,
                     "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "num_predict": 100  # Reduced from 150 for faster responses
-                    }
+                    "options": self._ollama_options()
                 },
                 timeout=20  # Reduced from 30s to 20s
             )
@@ -149,16 +423,89 @@ class CoachService:
                 print(f"Ollama error: {response.status_code} - {response.text}")
                 return None
                 
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             print("Ollama request timed out after 20 seconds. Skipping coach commentary for this move.")
             return None
-        except requests.exceptions.ConnectionError:
+        except httpx.ConnectError:
             print("Cannot connect to Ollama. Make sure it's running: ollama serve")
             return None
         except Exception as e:
             print(f"Ollama error: {e}")
             return None
     
+    async def _stream_with_openai(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        model: Optional[str] = None,
+        prediction: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Stream commentary tokens from the OpenAI API"""
+        try:
+            stream = await self.client.chat.completions.create(
+                model=model or self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                max_tokens=settings.COACH_MAX_TOKENS,
+                stream=True,
+                **self._openai_sampling(prediction)
+            )
+            finish_reason = None
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                if chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+        except Exception as e:
+            print(f"OpenAI API error: {e}")
+            raise CommentaryStreamError(f"OpenAI stream failed: {e}") from e
+        if finish_reason is None:
+            raise CommentaryStreamError("OpenAI stream ended without a finish reason")
+    
+    async def _stream_with_ollama(self, system_prompt: str, user_prompt: str, model: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream commentary tokens from Ollama's NDJSON generate endpoint"""
+        try:
+            async with self._get_http_client().stream(
+                "POST",
+                f"{self.ollama_url}/api/generate",
+                json={
+                    "model": model or self.model,
+                    "system": system_prompt,
+                    "prompt": user_prompt,
+                    "stream": True,
+                    "options": self._ollama_options()
+                },
+                timeout=20
+            ) as response:
+                if response.status_code != 200:
+                    print(f"Ollama error: {response.status_code}")
+                    raise CommentaryStreamError(f"Ollama returned {response.status_code}")
+                
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = orjson.loads(line)
+                    if chunk.get("response"):
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        return
+                        
+        except CommentaryStreamError:
+            raise
+        except httpx.TimeoutException as e:
+            print("Ollama stream timed out after 20 seconds.")
+            raise CommentaryStreamError("Ollama stream timed out") from e
+        except httpx.ConnectError as e:
+            print("Cannot connect to Ollama. Make sure it's running: ollama serve")
+            raise CommentaryStreamError("Cannot connect to Ollama") from e
+        except Exception as e:
+            print(f"Ollama error: {e}")
+            raise CommentaryStreamError(f"Ollama stream failed: {e}") from e
+        raise CommentaryStreamError("Ollama stream ended before it was done")
+    
     def _build_coaching_prompt(
         self,
         move_san: str,
@@ -184,11 +531,12 @@ Game phase: {game_phase}
 
 Provide brief, educational coaching feedback in plain text (no markdown, no bold, no formatting).
 Write 2-3 clear sentences explaining why this was a {classification} and what would have been better.
-Be constructive, specific, and focus on the key chess principles violated."""
+Be constructive, specific, and focus on the key chess principles violated.
+Reply in 40 words or fewer."""
         
         return prompt
     
-    def generate_game_summary(
+    async def generate_game_summary(
         self,
         total_moves: int,
         blunders: int,
@@ -216,6 +564,11 @@ Be constructive, specific, and focus on the key chess principles violated."""
         if not self.is_enabled():
             return None
         
+        cache_key = self._cache_key(self.model, "summary", total_moves, blunders, mistakes, inaccuracies, accuracy, result, opening_name)
+        cached = await self._get_cached(cache_key)
+        if cached:
+            return cached
+        
         try:
             accuracy_str = f"{accuracy:.1f}%" if accuracy else "N/A"
             
@@ -232,18 +585,20 @@ Give 2-3 sentences of constructive feedback focusing on:
 2. Key areas for improvement
 3. Positive aspects (if any)
 
-Be encouraging and specific."""
-            
-            system_prompt = "You are a supportive chess coach providing game summaries. Be constructive, specific, and encouraging."
+Be encouraging and specific. Reply in 60 words or fewer."""
             
             # Generate summary based on provider
             if self.provider == "openai":
-                return self._generate_with_openai(system_prompt, prompt)
+                summary = await self._generate_with_openai(GAME_SUMMARY_SYSTEM_PROMPT, prompt)
             elif self.provider == "ollama":
-                return self._generate_with_ollama(system_prompt, prompt)
+                summary = await self._generate_with_ollama(GAME_SUMMARY_SYSTEM_PROMPT, prompt)
             else:
                 return None
             
+            if summary:
+                await self._store_cached(cache_key, self.model, summary)
+            return summary
+            
         except Exception as e:
             print(f"Error generating game summary: {e}")
             return None
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Tuple
+
+import chess.engine
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _is_alive(engine: chess.engine.UciProtocol) -> bool:
+    """Check whether the engine process is still running"""
+    returncode = getattr(engine, "returncode", None)
+    return returncode is None or not returncode.done()
+
+
+class EnginePool:
+    """
+    Pool of persistent Stockfish processes shared across requests
+
+    Engine transports belong to the event loop that spawned them, so the pool
+    binds itself to the running loop on first use. If it is later used from a
+    different loop (e.g. a new asyncio.run() in a worker task), processes from
+    the old loop are killed and the pool starts over.
+    """
+
+    def __init__(self, stockfish_path: str, size: int, hash_mb: Optional[int] = None):
+        self.stockfish_path = stockfish_path
+        self.size = max(1, size)
+        self.hash_mb = hash_mb
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Idle engines, plus None entries that wake a waiter when a slot frees up
+        self._idle: Optional[asyncio.Queue] = None
+        self._engines: List[Tuple[asyncio.SubprocessTransport, chess.engine.UciProtocol]] = []
+        self._starting = 0
+
+    def _bind_to_running_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+
+        # Engines from a previous loop cannot be awaited anymore; kill them directly
+        for transport, _ in self._engines:
+            try:
+                transport.kill()
+            except Exception:
+                pass
+
+        self._loop = loop
+        self._idle = asyncio.Queue()
+        self._engines = []
+        self._starting = 0
+
+    async def _spawn(self) -> Tuple[asyncio.SubprocessTransport, chess.engine.UciProtocol]:
+        transport, engine = await chess.engine.popen_uci(self.stockfish_path)
+        if self.hash_mb:
+            await engine.configure({"Hash": self.hash_mb})
+        return transport, engine
+    
+    async def _checkout(self) -> Tuple[asyncio.SubprocessTransport, chess.engine.UciProtocol]:
+        while True:
+            if self._idle.empty() and len(self._engines) + self._starting < self.size:
+                logger.debug(f"Starting pooled Stockfish engine at {self.stockfish_path}")
+                self._starting += 1
+                try:
+                    entry = await self._spawn()
+                except BaseException:
+                    # The slot is free again; let a waiting caller try to start one
+                    self._wake_waiter()
+                    raise
+                finally:
+                    self._starting -= 1
+                self._engines.append(entry)
+                return entry
+
+            entry = await self._idle.get()
+            if entry is None:
+                # A slot was freed (see _wake_waiter); check capacity again
+                continue
+            if not _is_alive(entry[1]):
+                # Process died while idle; drop it and try again
+                self._discard(entry)
+                continue
+            return entry
+
+    def _wake_waiter(self) -> None:
+        """
+        Wake one caller blocked on the idle queue after a slot was freed
+
+        Callers wait for an idle engine once the pool is full, so when an engine is
+        dropped instead of returned, one of them must be told it may start a new one.
+        """
+        self._idle.put_nowait(None)
+
+    def _discard(self, entry: Tuple[asyncio.SubprocessTransport, chess.engine.UciProtocol]) -> None:
+        if entry in self._engines:
+            self._engines.remove(entry)
+        try:
+            entry[0].kill()
+        except Exception:
+            pass
+        self._wake_waiter()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[chess.engine.UciProtocol]:
+        """Borrow an engine; it is returned to the pool unless the caller fails"""
+        self._bind_to_running_loop()
+        entry = await self._checkout()
+        healthy = False
+        try:
+            yield entry[1]
+            healthy = _is_alive(entry[1])
+        finally:
+            if healthy:
+                self._idle.put_nowait(entry)
+            else:
+                self._discard(entry)
+
+    async def prewarm(self) -> None:
+        """Start engines up to the pool size so the first requests skip process startup"""
+        self._bind_to_running_loop()
+        while len(self._engines) + self._starting < self.size:
+            self._starting += 1
+            try:
+                entry = await self._spawn()
+            finally:
+                self._starting -= 1
+            self._engines.append(entry)
+            self._idle.put_nowait(entry)
+
+    async def close(self) -> None:
+        """Quit all engines owned by the current loop"""
+        if self._loop is not asyncio.get_running_loop():
+            self._bind_to_running_loop()
+            return
+
+        engines, self._engines = self._engines, []
+        # Drop the idle entries but keep the queue, so callers already waiting on it
+        # are woken below instead of being stranded on a replaced queue
+        while not self._idle.empty():
+            self._idle.get_nowait()
+        for transport, engine in engines:
+            try:
+                await engine.quit()
+            except Exception:
+                transport.kill()
+        for _ in range(self.size):
+            self._wake_waiter()
+
+
+engine_pool = EnginePool(settings.STOCKFISH_PATH, settings.STOCKFISH_POOL_SIZE, settings.STOCKFISH_HASH_MB)
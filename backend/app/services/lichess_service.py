@@ -1,11 +1,38 @@
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util import Retry
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional
+from bisect import bisect_right
 from datetime import datetime, timedelta
-import chess.pgn
-from io import StringIO
-import json
+import orjson
+import re
+
+# PGN tag pairs such as [ECO "C50"]; only the header block is scanned
+_HEADER_RE = re.compile(r'^\[(\w+)\s+"([^"]*)"\]', re.M)
+
+# Lichess game status -> our termination label
+_STATUS_MAP = {
+    "mate": "checkmate",
+    "checkmate": "checkmate",
+    "resign": "resignation",
+    "timeout": "timeout",
+    "outoftime": "timeout",
+    "stalemate": "stalemate",
+    "draw": "draw",
+}
+# Substring fallback for statuses not in the map, checked in order
+# ("stalemate" must never fall through to a "mate" match)
+_STATUS_SUBSTRINGS = (
+    ("checkmate", "checkmate"),
+    ("resign", "resignation"),
+    ("time", "timeout"),
+    ("stalemate", "stalemate"),
+    ("draw", "draw"),
+)
+
+# Estimated game duration (seconds) upper bounds for each time class
+_TIME_CLASS_CUTOFFS = [180, 600, 1800]
+_TIME_CLASS_LABELS = ["bullet", "blitz", "rapid", "classical"]
 
 
 class LichessService:
@@ -27,7 +54,11 @@ class LichessService:
             status_forcelist=[429, 500, 502, 503, 504],
             allowed_methods=["GET"]
         )
-        session.mount("https://", HTTPAdapter(max_retries=retries))
+        session.mount("https://", HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=retries
+        ))
         return session
     
     def get_user_games(
@@ -49,6 +80,20 @@ class LichessService:
         Returns:
             List of game dictionaries
         """
+        return list(self.iter_user_games(username, max_games=max_games, since=since, until=until))
+    
+    def iter_user_games(
+        self,
+        username: str,
+        max_games: int = 200,
+        since: Optional[int] = None,
+        until: Optional[int] = None
+    ) -> Iterator[Dict]:
+        """
+        Stream games for a Lichess user, yielding each one as its NDJSON line arrives
+        
+        Takes the same arguments as get_user_games.
+        """
         username = username.strip()
         url = f"{self.base_url}/games/user/{username}"
         
@@ -72,20 +117,14 @@ class LichessService:
             elif response.status_code != 200:
                 raise Exception(f"Failed to fetch games from Lichess.org: HTTP {response.status_code}. Please try again later.")
             
-            # Lichess returns NDJSON (newline-delimited JSON)
-            games = []
-            for line in response.iter_lines(decode_unicode=True):
-                if line:
-                    try:
-                        game_data = json.loads(line)
-                        games.append(game_data)
-                    except json.JSONDecodeError:
-                        continue
-                    except Exception as e:
-                        print(f"Error parsing game line: {e}")
-                        continue
-            
-            return games
+            # Lichess returns NDJSON (newline-delimited JSON); orjson takes the raw bytes
+            with response:
+                for line in response.iter_lines():
+                    if line:
+                        try:
+                            yield orjson.loads(line)
+                        except orjson.JSONDecodeError:
+                            continue
             
         except requests.exceptions.RequestException as e:
             raise Exception(f"Error connecting to Lichess.org: {str(e)}")
@@ -126,17 +165,10 @@ class LichessService:
         
         # Get termination reason
         status = game_data.get("status", "")
-        termination = None
-        if "checkmate" in status.lower():
-            termination = "checkmate"
-        elif "resign" in status.lower():
-            termination = "resignation"
-        elif "timeout" in status.lower() or "time" in status.lower():
-            termination = "timeout"
-        elif "stalemate" in status.lower():
-            termination = "stalemate"
-        elif "draw" in status.lower():
-            termination = "draw"
+        status = status.lower()
+        termination = _STATUS_MAP.get(status)
+        if termination is None:
+            termination = next((label for key, label in _STATUS_SUBSTRINGS if key in status), None)
         
         # Get PGN
         pgn = game_data.get("pgn", "")
@@ -146,18 +178,10 @@ class LichessService:
             if moves:
                 pgn = moves
         
-        # Extract opening from PGN headers if available
-        opening_eco = None
-        opening_name = None
-        try:
-            if pgn:
-                pgn_io = StringIO(pgn)
-                game = chess.pgn.read_game(pgn_io)
-                if game:
-                    opening_eco = game.headers.get("ECO")
-                    opening_name = game.headers.get("Opening")
-        except:
-            pass
+        # Extract opening from PGN headers if available (no need to parse the moves)
+        headers = dict(_HEADER_RE.findall(pgn[:2048])) if pgn else {}
+        opening_eco = headers.get("ECO")
+        opening_name = headers.get("Opening")
         
         # Get time control
         time_control = game_data.get("clock", {}).get("initial", None)
@@ -173,14 +197,7 @@ class LichessService:
             try:
                 initial, increment = map(int, time_control_str.split("+"))
                 total_seconds = initial + (increment * 40)  # Rough estimate
-                if total_seconds < 180:
-                    time_class = "bullet"
-                elif total_seconds < 600:
-                    time_class = "blitz"
-                elif total_seconds < 1800:
-                    time_class = "rapid"
-                else:
-                    time_class = "classical"
+                time_class = _TIME_CLASS_LABELS[bisect_right(_TIME_CLASS_CUTOFFS, total_seconds)]
             except:
                 time_class = "rapid"  # Default
         
@@ -233,6 +250,29 @@ class LichessService:
             to_year: End year
             to_month: End month (1-12)
         """
+        return list(self.iter_parsed_games(
+            username,
+            from_year=from_year,
+            from_month=from_month,
+            to_year=to_year,
+            to_month=to_month
+        ))
+    
+    def iter_parsed_games(
+        self,
+        username: str,
+        from_year: Optional[int] = None,
+        from_month: Optional[int] = None,
+        to_year: Optional[int] = None,
+        to_month: Optional[int] = None
+    ) -> Iterator[Dict]:
+        """
+        Stream parsed games with optional date filtering
+        
+        Takes the same arguments as fetch_and_parse_games. Games are parsed
+        as they arrive, so callers can persist them without holding the
+        whole import in memory.
+        """
         # Convert date range to timestamps
         since = None
         until = None
@@ -251,45 +291,40 @@ class LichessService:
                 until_dt = datetime(to_year, to_month + 1, 1) - timedelta(seconds=1)
             until = int(until_dt.timestamp() * 1000)  # Convert to milliseconds
         
-        # Fetch games in batches (Lichess max is 200 per request)
-        all_games = []
+        # Fetch games in batches (Lichess max is 200 per request), parsing each
+        # game as it streams in so raw game dicts are never accumulated
         max_per_request = 200
-        offset = 0
         
         while True:
             try:
-                # Calculate 'since' for pagination (fetch older games)
-                # For simplicity, we'll fetch all games and filter by date
-                games = self.get_user_games(
+                # Lichess returns newest games first; each batch pages backwards
+                # by moving 'until' to just before the oldest game seen so far
+                batch_count = 0
+                oldest = None
+                for game_data in self.iter_user_games(
                     username,
                     max_games=max_per_request,
                     since=since,
                     until=until
-                )
-                
-                if not games:
-                    break
-                
-                all_games.extend(games)
+                ):
+                    batch_count += 1
+                    created_at = game_data.get("createdAt")
+                    if created_at and (oldest is None or created_at < oldest):
+                        oldest = created_at
+                    parsed = self.parse_game_data(game_data, username)
+                    if parsed:
+                        yield parsed
                 
                 # If we got fewer than max, we've reached the end
-                if len(games) < max_per_request:
+                if batch_count < max_per_request or oldest is None or oldest <= (since or 0):
                     break
                 
-                # For pagination, we'd need to use the oldest game's timestamp
-                # But Lichess API doesn't support offset, so we'll fetch all at once
-                # and filter client-side if needed
-                break
+                until = int(oldest) - 1
                 
             except Exception as e:
                 print(f"Error fetching games batch: {e}")
                 break
-        
-        # Parse games
-        parsed_games = []
-        for game_data in all_games:
-            parsed = self.parse_game_data(game_data, username)
-            if parsed:
-                parsed_games.append(parsed)
-        
-        return parsed_games
+
+
+# Module-level instance so the keep-alive connection pool is reused across imports
+lichess_service = LichessService()
@@ -0,0 +1,109 @@
+"""
+Redis cache of Stockfish evaluations keyed by position.
+
+Positions recur across a user's games (openings, repertoire lines, re-analysis),
+so game analysis looks every position up by its Polyglot Zobrist hash before
+running the engine. Entries are keyed by the engine limits too, so changing
+STOCKFISH_DEPTH, STOCKFISH_TIME_LIMIT or STOCKFISH_NODES never serves evaluations
+from the old limits.
+
+Each worker process also keeps the most recently used evaluations in memory, so
+the opening positions that nearly every game passes through are served without
+a Redis round-trip.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import chess
+import chess.polyglot
+
+from ..config import settings
+from .redis_pubsub import redis_pubsub
+
+logger = logging.getLogger(__name__)
+
+# (centipawns from the side to move's perspective, best move)
+Evaluation = Tuple[Optional[float], Optional[chess.Move]]
+
+# Per-process LRU in front of Redis; get_many/set_many run in worker threads
+_local: "OrderedDict[str, Evaluation]" = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def position_key(board: chess.Board, depth: int, time_limit: float, nodes: Optional[int] = None) -> str:
+    """Cache key for the engine's evaluation of this position at these limits"""
+    position = f"{chess.polyglot.zobrist_hash(board):016x}"
+    if nodes:
+        return f"engine_eval:{position}:n{nodes}"
+    return f"engine_eval:{position}:d{depth}:t{time_limit:g}"
+
+
+def _encode(evaluation: Evaluation) -> str:
+    cp, best_move = evaluation
+    return f"{'' if cp is None else f'{cp:g}'}|{best_move.uci() if best_move else ''}"
+
+
+def _decode(value: str) -> Evaluation:
+    cp, _, best_move = value.partition("|")
+    return (
+        float(cp) if cp else None,
+        chess.Move.from_uci(best_move) if best_move else None,
+    )
+
+
+def _remember(evaluations: Dict[str, Evaluation]) -> None:
+    if settings.STOCKFISH_LOCAL_EVAL_CACHE_SIZE <= 0:
+        return
+    with _local_lock:
+        _local.update(evaluations)
+        for key in evaluations:
+            _local.move_to_end(key)
+        while len(_local) > settings.STOCKFISH_LOCAL_EVAL_CACHE_SIZE:
+            _local.popitem(last=False)
+
+
+def clear_local() -> None:
+    """Drop this process's in-memory evaluations (Redis is left alone)"""
+    with _local_lock:
+        _local.clear()
+
+
+def get_many(keys: List[str]) -> Dict[str, Evaluation]:
+    """Fetch cached evaluations, from memory first and the rest in one Redis round-trip;
+    a Redis failure is treated as all misses"""
+    if settings.STOCKFISH_EVAL_CACHE_TTL_SECONDS <= 0 or not keys:
+        return {}
+    found = {}
+    with _local_lock:
+        for key in keys:
+            if key in _local:
+                _local.move_to_end(key)
+                found[key] = _local[key]
+    missing = [key for key in keys if key not in found]
+    if not missing:
+        return found
+    try:
+        values = redis_pubsub.redis_client.mget(missing)
+    except Exception as e:
+        logger.warning(f"Position cache lookup failed, analyzing without it: {e}")
+        return found
+    from_redis = {key: _decode(value) for key, value in zip(missing, values) if value is not None}
+    _remember(from_redis)
+    found.update(from_redis)
+    return found
+
+
+def set_many(evaluations: Dict[str, Evaluation]) -> None:
+    """Store fresh evaluations in one pipelined round-trip"""
+    if settings.STOCKFISH_EVAL_CACHE_TTL_SECONDS <= 0 or not evaluations:
+        return
+    _remember(evaluations)
+    try:
+        with redis_pubsub.redis_client.pipeline(transaction=False) as pipe:
+            for key, evaluation in evaluations.items():
+                pipe.setex(key, settings.STOCKFISH_EVAL_CACHE_TTL_SECONDS, _encode(evaluation))
+            pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to store {len(evaluations)} position evaluations: {e}")
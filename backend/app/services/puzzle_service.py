@@ -1,24 +1,113 @@
 """
 Puzzle service: derives puzzle positions from analyzed game moves.
 Each puzzle is a position where the user made a mistake; the solution comes from deep engine analysis.
-Uses on-demand deep analysis with multipv to find one or more valid solutions.
+Uses deep analysis with multipv to find one or more valid solutions; results are
+pre-computed in the background after game analysis, with on-demand analysis as a fallback.
 """
 import asyncio
 import chess
-import chess.pgn
 import chess.engine
-import json
 import logging
-from io import StringIO
+import re
+import threading
+from collections import OrderedDict
 from typing import Optional, List, Dict, Any
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import or_, and_, func, insert, select
+from sqlalchemy.exc import IntegrityError
 
-from ..models import Game, Move, PuzzleAnalysisCache
+from ..models import Game, Move, PuzzleAnalysisCache, PuzzleCandidate
 from ..config import settings
+from .engine_pool import engine_pool
 
 logger = logging.getLogger(__name__)
 
+# PGN movetext scanning (see fen_from_pgn_at_half_move)
+_PGN_FEN_HEADER_RE = re.compile(r'^\[FEN\s+"([^"]*)"\]', re.M)
+_PGN_HEADER_LINE_RE = re.compile(r'^\s*\[[^\n]*\]\s*$', re.M)
+_PGN_COMMENT_RE = re.compile(r'\{[^}]*\}|;[^\n]*')
+_PGN_VARIATION_RE = re.compile(r'\([^()]*\)')
+# Move numbers, NAGs and results are matched so they're skipped; group 1 is a SAN move
+_PGN_TOKEN_RE = re.compile(
+    r'\$\d+|\d+\.(?:\.\.)?|1-0|0-1|1/2-1/2|\*'
+    r'|([NBRQK]?[a-h]?[1-8]?x?[a-h][1-8](?:=?[NBRQ])?[+#]?|[O0]-[O0](?:-[O0])?[+#]?)'
+)
+
+# A single SAN move: piece, disambiguation file/rank, target square, promotion piece
+_SAN_MOVE_RE = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?[+#]?$')
+_SAN_PIECE_TYPES = {"N": chess.KNIGHT, "B": chess.BISHOP, "R": chess.ROOK, "Q": chess.QUEEN, "K": chess.KING}
+
+# Positions derived by replaying a game, keyed by (game_id, half_move). A game's moves
+# never change once imported, so entries stay valid and are only evicted for space.
+_FEN_CACHE_MAX_SIZE = 4096
+_fen_cache: OrderedDict = OrderedDict()
+_fen_cache_lock = threading.Lock()
+
+
+def _push_san_fast(board: chess.Board, san: str) -> None:
+    """
+    Push a SAN move, finding its source square from the attack tables instead of
+    generating every legal move. Castling, ambiguous matches and anything that
+    doesn't resolve to exactly one piece fall back to board.push_san.
+    """
+    match = _SAN_MOVE_RE.match(san)
+    if match:
+        piece, from_file, from_rank, target, promotion = match.groups()
+        to_square = chess.parse_square(target)
+        if piece:
+            candidates = board.attackers_mask(board.turn, to_square) & board.pieces_mask(
+                _SAN_PIECE_TYPES[piece], board.turn
+            )
+            if from_file:
+                candidates &= chess.BB_FILES[chess.FILE_NAMES.index(from_file)]
+            if from_rank:
+                candidates &= chess.BB_RANKS[int(from_rank) - 1]
+            # Exactly one candidate; with several, one may be pinned, so let push_san decide
+            if candidates and not candidates & (candidates - 1):
+                board.push(chess.Move(chess.msb(candidates), to_square))
+                return
+        elif not from_rank:
+            step = -8 if board.turn == chess.WHITE else 8
+            if from_file:
+                # Pawn capture: one rank back on the given file
+                from_square = chess.square(chess.FILE_NAMES.index(from_file), chess.square_rank(to_square + step))
+            else:
+                from_square = to_square + step
+                if 0 <= from_square < 64 and board.piece_type_at(from_square) is None:
+                    # Double push from the starting rank
+                    from_square += step
+            if 0 <= from_square < 64 and board.pieces_mask(chess.PAWN, board.turn) & chess.BB_SQUARES[from_square]:
+                promotion_type = _SAN_PIECE_TYPES[promotion] if promotion else None
+                board.push(chess.Move(from_square, to_square, promotion=promotion_type))
+                return
+
+    board.push_san(san)
+
+
+def fen_from_moves_table(db: Session, game_id: int, half_move: int) -> Optional[str]:
+    """
+    Replay a game's analyzed Move rows (stored UCI) from the standard starting position.
+    Returns the position BEFORE the move at half_move, or None if any earlier
+    move row is missing or invalid. Only valid for games without a custom start position.
+    """
+    rows = (
+        db.query(Move.move_uci)
+        .filter(Move.game_id == game_id, Move.half_move < half_move)
+        .order_by(Move.half_move)
+        .all()
+    )
+    if half_move < 0 or len(rows) != half_move:
+        return None
+    try:
+        board = chess.Board()
+        # These moves were legal when analysis recorded them, so skip push_uci's legality check
+        for (uci,) in rows:
+            board.push(chess.Move.from_uci(uci))
+        return board.fen()
+    except ValueError as e:
+        logger.warning(f"Failed to replay moves of game {game_id} to half_move {half_move}: {e}")
+        return None
 
 
 def fen_from_pgn_at_half_move(pgn_string: str, half_move: int) -> Optional[str]:
@@ -34,19 +123,29 @@ def fen_from_pgn_at_half_move(pgn_string: str, half_move: int) -> Optional[str]:
         FEN string, or None if PGN is invalid or half_move is out of range
     """
     try:
-        pgn_io = StringIO(pgn_string)
-        game = chess.pgn.read_game(pgn_io)
-        if not game:
-            return None
+        # Scan the movetext directly instead of building a chess.pgn game tree
+        fen_header = _PGN_FEN_HEADER_RE.search(pgn_string)
+        board = chess.Board(fen_header.group(1)) if fen_header else chess.Board()
+
+        movetext = _PGN_HEADER_LINE_RE.sub(" ", pgn_string)
+        movetext = _PGN_COMMENT_RE.sub(" ", movetext)
+        # Variations can nest; strip innermost first until none remain
+        while "(" in movetext:
+            stripped = _PGN_VARIATION_RE.sub(" ", movetext)
+            if stripped == movetext:
+                return None
+            movetext = stripped
 
-        board = game.board()
         ply = 0
-
-        for node in game.mainline():
-            if ply >= half_move:
-                break
-            board.push(node.move)
-            ply += 1
+        if half_move > 0:
+            for token in _PGN_TOKEN_RE.finditer(movetext):
+                san = token.group(1)
+                if not san:
+                    continue
+                _push_san_fast(board, san)
+                ply += 1
+                if ply == half_move:
+                    break
 
         if ply != half_move:
             # half_move was beyond the game length
@@ -58,19 +157,6 @@ def fen_from_pgn_at_half_move(pgn_string: str, half_move: int) -> Optional[str]:
         return None
 
 
-def _get_evaluation_cp(score) -> Optional[float]:
-    """Extract centipawn evaluation from engine score (side to move perspective)."""
-    if not score:
-        return None
-    if score.is_mate():
-        mate_in = score.relative.mate()
-        if mate_in > 0:
-            return 10000 - mate_in * 100
-        return -10000 - mate_in * 100
-    cp = score.relative.cp
-    return float(cp) if cp is not None else None
-
-
 async def _deep_analyze_position(fen: str) -> Optional[List[str]]:
     """
     Run deep multipv analysis on a position. Returns list of valid solution UCI moves.
@@ -83,15 +169,11 @@ async def _deep_analyze_position(fen: str) -> Optional[List[str]]:
         return None
 
     try:
-        transport, engine = await chess.engine.popen_uci(settings.STOCKFISH_PATH)
-        limit = chess.engine.Limit(
-            depth=settings.PUZZLE_ANALYSIS_DEPTH,
-            time=settings.PUZZLE_ANALYSIS_TIME,
-        )
+        limit = chess.engine.Limit(nodes=settings.PUZZLE_ANALYSIS_NODES)
 
-        # multipv=5: engine returns list of InfoDict (one per line) in python-chess
-        result = await engine.analyse(board, limit, multipv=5)
-        await engine.quit()
+        # multipv>1: engine returns list of InfoDict (one per line) in python-chess
+        async with engine_pool.acquire() as engine:
+            result = await engine.analyse(board, limit, multipv=settings.PUZZLE_MULTIPV)
 
         # Handle both list (multipv>1) and single dict (fallback)
         if isinstance(result, list):
@@ -104,54 +186,68 @@ async def _deep_analyze_position(fen: str) -> Optional[List[str]]:
         if not infos:
             return None
 
-        lines = []
+        # Single pass over the lines (best first): dedupe by move, score from the side
+        # to move, and stop at the first line that falls outside the threshold
+        threshold = settings.PUZZLE_MULTIPV_SOLUTION_THRESHOLD_CP
+        seen = set()
+        solutions = []
+        best_eval = None
         for info in infos:
-            pv = info.get("pv", [])
-            score = info.get("score")
+            pv = info.get("pv")
             if not pv:
                 continue
             move_uci = pv[0].uci()
-            eval_cp = _get_evaluation_cp(score)
-            lines.append({"move": move_uci, "eval": eval_cp})
-
-        if not lines:
-            return None
-
-        # Dedupe by move (keep first occurrence = best)
-        seen = set()
-        unique_lines = []
-        for line in lines:
-            if line["move"] not in seen:
-                seen.add(line["move"])
-                unique_lines.append(line)
+            if move_uci in seen:
+                continue
+            seen.add(move_uci)
 
-        best_eval = unique_lines[0]["eval"]
-        solutions = []
-        for line in unique_lines:
-            line_eval = line["eval"]
-            if best_eval is None or line_eval is None:
-                solutions.append(line["move"])
-            elif abs(best_eval - line_eval) <= settings.PUZZLE_MULTIPV_SOLUTION_THRESHOLD_CP:
-                solutions.append(line["move"])
-            else:
+            eval_cp = None
+            score = info.get("score")
+            if score:
+                relative = score.relative
+                if score.is_mate():
+                    mate_in = relative.mate()
+                    eval_cp = (10000 if mate_in > 0 else -10000) - mate_in * 100
+                elif relative.cp is not None:
+                    eval_cp = float(relative.cp)
+
+            if not solutions:
+                best_eval = eval_cp
+            elif best_eval is not None and eval_cp is not None and abs(best_eval - eval_cp) > threshold:
                 break
+            solutions.append(move_uci)
 
-        return solutions if solutions else [unique_lines[0]["move"]]
+        return solutions or None
     except Exception as e:
         logger.exception(f"Deep puzzle analysis failed: {e}")
         return None
 
 
-def get_puzzle_candidates(db: Session, user_id: int) -> List[Dict[str, Any]]:
+def refresh_puzzle_candidates(db: Session, game_id: int) -> int:
     """
-    Get moves that qualify as puzzle positions: user mistakes/blunders with a clear best move.
-    Only includes positions where it is the user's turn (the highlighted previous move is the opponent's).
+    Rebuild the puzzle_candidates rows for one game from its analyzed moves.
+    Qualifying moves are user mistakes/blunders with a clear best move, played on
+    the user's turn (so the highlighted previous move is the opponent's).
+    Call after the game's move analysis has been flushed; commits it with the candidates.
+
+    Returns:
+        Number of candidate rows written
     """
-    candidates = (
-        db.query(Move, Game)
+    db.query(PuzzleCandidate).filter(PuzzleCandidate.game_id == game_id).delete(synchronize_session=False)
+    qualifying = (
+        select(
+            Game.user_id,
+            Move.id,
+            Move.game_id,
+            Move.half_move,
+            Move.fen_before,
+            Move.best_move_uci,
+            Move.classification,
+            Game.user_color,
+        )
         .join(Game, Move.game_id == Game.id)
-        .filter(
-            Game.user_id == user_id,
+        .where(
+            Game.id == game_id,
             Game.analysis_state == "analyzed",
             Move.best_move_uci.isnot(None),
             Move.classification.in_(["mistake", "blunder"]),
@@ -161,68 +257,226 @@ def get_puzzle_candidates(db: Session, user_id: int) -> List[Dict[str, Any]]:
                 and_(Game.user_color == "black", Move.is_white == False),
             ),
         )
-        .all()
     )
+    result = db.execute(
+        insert(PuzzleCandidate).from_select(
+            [
+                "user_id",
+                "move_id",
+                "game_id",
+                "half_move",
+                "fen_before",
+                "best_move_uci",
+                "classification",
+                "user_color",
+            ],
+            qualifying,
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+def get_puzzle_candidates(
+    db: Session,
+    user_id: int,
+    game_id: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> List[Row]:
+    """
+    Get positions that qualify as puzzles from the puzzle_candidates table.
+    Cached deep-analysis solutions are joined in so no per-candidate cache lookup is needed.
+    Pass game_id to restrict candidates to a single game.
+    Pass limit to get a random sample picked by the database, cached candidates first.
 
-    result = []
-    for move, game in candidates:
-        result.append(
-            {
-                "move_id": move.id,
-                "game_id": game.id,
-                "half_move": move.half_move,
-                "pgn": game.pgn,
-                "best_move_uci": move.best_move_uci,
-                "classification": move.classification,
-                "user_color": game.user_color,
-                "date_played": game.date_played,
-                "white_player": game.white_player,
-                "black_player": game.black_player,
-                "white_elo": game.white_elo,
-                "black_elo": game.black_elo,
-            }
+    The previous move's UCI is joined in for highlighting. Game details and the PGN
+    are not selected; get_next_puzzle fetches them for the chosen candidate only.
+    """
+    prev_move = aliased(Move)
+    query = (
+        db.query(
+            PuzzleCandidate.move_id,
+            PuzzleCandidate.game_id,
+            PuzzleCandidate.half_move,
+            PuzzleCandidate.fen_before,
+            PuzzleCandidate.best_move_uci,
+            PuzzleCandidate.classification,
+            PuzzleCandidate.user_color,
+            PuzzleAnalysisCache.solution_uci_list.label("cached_solution_uci_list"),
+            prev_move.move_uci.label("prev_move_uci"),
+        )
+        .outerjoin(
+            prev_move,
+            and_(
+                prev_move.game_id == PuzzleCandidate.game_id,
+                prev_move.half_move == PuzzleCandidate.half_move - 1,
+            ),
+        )
+        .outerjoin(
+            PuzzleAnalysisCache,
+            and_(
+                PuzzleAnalysisCache.game_id == PuzzleCandidate.game_id,
+                PuzzleAnalysisCache.move_id == PuzzleCandidate.move_id,
+                # Solutions from a different node budget count as uncached
+                PuzzleAnalysisCache.analysis_nodes == settings.PUZZLE_ANALYSIS_NODES,
+            ),
         )
-    return result
+        .filter(PuzzleCandidate.user_id == user_id)
+    )
+    if game_id is not None:
+        query = query.filter(PuzzleCandidate.game_id == game_id)
+    if limit is not None:
+        query = query.order_by(PuzzleAnalysisCache.id.is_(None), func.random()).limit(limit)
+    return query.all()
+
+
+def _candidate_fen(db: Session, candidate: Row) -> Optional[str]:
+    """Position for a candidate; moves analyzed before fen_before was stored fall back to replaying the game"""
+    if candidate.fen_before:
+        return candidate.fen_before
+
+    key = (candidate.game_id, candidate.half_move)
+    with _fen_cache_lock:
+        fen = _fen_cache.get(key)
+        if fen:
+            _fen_cache.move_to_end(key)
+            return fen
+
+    game = db.query(Game.pgn).filter(Game.id == candidate.game_id).first()
+    if not game:
+        return None
+    fen = None
+    if not _PGN_FEN_HEADER_RE.search(game.pgn or ""):
+        # From the standard start, the analyzed move rows hold every earlier UCI move
+        fen = fen_from_moves_table(db, candidate.game_id, candidate.half_move)
+    if not fen:
+        fen = fen_from_pgn_at_half_move(game.pgn, candidate.half_move)
+    if fen:
+        with _fen_cache_lock:
+            _fen_cache[key] = fen
+            if len(_fen_cache) > _FEN_CACHE_MAX_SIZE:
+                _fen_cache.popitem(last=False)
+    return fen
+
+
+def _save_puzzle_solutions(db: Session, game_id: int, move_id: int, solution_list: List[str]) -> None:
+    """Write deep-analysis solutions to the cache; a concurrent writer winning the race is fine"""
+    try:
+        # Rows from an older node budget are overwritten in place
+        entry = (
+            db.query(PuzzleAnalysisCache)
+            .filter(
+                PuzzleAnalysisCache.game_id == game_id,
+                PuzzleAnalysisCache.move_id == move_id,
+            )
+            .first()
+        )
+        if entry is None:
+            entry = PuzzleAnalysisCache(game_id=game_id, move_id=move_id)
+            db.add(entry)
+        entry.solution_uci_list = solution_list
+        entry.analysis_nodes = settings.PUZZLE_ANALYSIS_NODES
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to cache puzzle analysis: {e}")
 
 
-def get_next_puzzle(db: Session, user_id: int) -> Optional[Dict[str, Any]]:
+async def warm_puzzle_cache(db: Session, user_id: int, game_id: Optional[int] = None) -> int:
     """
-    Pick a random puzzle candidate, run deep analysis (or use cache), return puzzle data.
+    Run deep analysis for every uncached puzzle candidate and store the solutions,
+    so get_next_puzzle can serve puzzles without waiting on Stockfish.
+
+    Args:
+        db: Database session
+        user_id: User whose candidates to warm
+        game_id: Only warm candidates from this game (e.g. right after it was analyzed)
+
+    Returns:
+        Number of cache rows written
     """
-    import random
+    pending = []
+    for candidate in get_puzzle_candidates(db, user_id, game_id=game_id):
+        if candidate.cached_solution_uci_list:
+            continue
+        fen = _candidate_fen(db, candidate)
+        if fen:
+            pending.append((candidate, fen))
+
+    if not pending:
+        return 0
+
+    # Analyses queue on the engine pool; results are written afterwards on this session
+    results = await asyncio.gather(*(_deep_analyze_position(fen) for _, fen in pending))
 
-    candidates = get_puzzle_candidates(db, user_id)
+    written = 0
+    for (candidate, _), solution_list in zip(pending, results):
+        if solution_list:
+            _save_puzzle_solutions(db, candidate.game_id, candidate.move_id, solution_list)
+            written += 1
+
+    logger.info(f"Warmed {written}/{len(pending)} puzzle positions for user {user_id}")
+    return written
+
+
+def _last_move_squares(move_uci: Optional[str]) -> Optional[Dict[str, str]]:
+    """Squares of the move played just before the puzzle, for highlighting"""
+    if move_uci and len(move_uci) >= 4:
+        return {
+            "from_square": move_uci[:2],
+            "to_square": move_uci[2:4],
+        }
+    return None
+
+
+def _get_game_details(db: Session, game_id: int) -> Optional[Row]:
+    """Date and players of a game, for display alongside its puzzle"""
+    return (
+        db.query(
+            Game.date_played,
+            Game.white_player,
+            Game.black_player,
+            Game.white_elo,
+            Game.black_elo,
+        )
+        .filter(Game.id == game_id)
+        .first()
+    )
+
+
+async def get_next_puzzle(db: Session, user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Pick a random puzzle candidate and return puzzle data.
+    The database samples a small batch with cached candidates first, so live deep
+    analysis only runs when the batch has no usable cached puzzle.
+    The session is synchronous, so DB work runs in a thread to keep the event loop free.
+    """
+    candidates = await asyncio.to_thread(
+        get_puzzle_candidates, db, user_id, limit=settings.PUZZLE_CANDIDATE_BATCH_SIZE
+    )
     if not candidates:
         return None
 
-    random.shuffle(candidates)
     for candidate in candidates:
-        fen = fen_from_pgn_at_half_move(candidate["pgn"], candidate["half_move"])
+        fen = await asyncio.to_thread(_candidate_fen, db, candidate)
         if not fen:
             logger.debug(
-                f"Skipping candidate game {candidate['game_id']} move {candidate['move_id']}: "
+                f"Skipping candidate game {candidate.game_id} move {candidate.move_id}: "
                 "FEN derivation failed"
             )
             continue
 
-        game_id = candidate["game_id"]
-        move_id = candidate["move_id"]
+        game_id = candidate.game_id
+        move_id = candidate.move_id
 
-        # Check cache first
-        cached = (
-            db.query(PuzzleAnalysisCache)
-            .filter(
-                PuzzleAnalysisCache.game_id == game_id,
-                PuzzleAnalysisCache.move_id == move_id,
-            )
-            .first()
-        )
-
-        if cached:
-            solution_list = json.loads(cached.solution_uci_list)
+        # Check cache first (loaded with the candidates)
+        if candidate.cached_solution_uci_list:
+            solution_list = candidate.cached_solution_uci_list
         else:
-            # Run deep analysis (blocking call from sync context)
-            solution_list = asyncio.run(_deep_analyze_position(fen))
+            # Run deep analysis on a pooled engine
+            solution_list = await _deep_analyze_position(fen)
             if not solution_list:
                 logger.debug(
                     f"Deep analysis returned no solutions for game {game_id} move {move_id}"
@@ -230,34 +484,11 @@ def get_next_puzzle(db: Session, user_id: int) -> Optional[Dict[str, Any]]:
                 continue
 
             # Cache the result
-            try:
-                cache_entry = PuzzleAnalysisCache(
-                    game_id=game_id,
-                    move_id=move_id,
-                    solution_uci_list=json.dumps(solution_list),
-                )
-                db.add(cache_entry)
-                db.commit()
-            except Exception as e:
-                db.rollback()
-                logger.warning(f"Failed to cache puzzle analysis: {e}")
-
-        # Get the previous move for highlighting
-        last_move = None
-        if candidate["half_move"] > 0:
-            prev_move = (
-                db.query(Move)
-                .filter(
-                    Move.game_id == game_id,
-                    Move.half_move == candidate["half_move"] - 1,
-                )
-                .first()
-            )
-            if prev_move and prev_move.move_uci and len(prev_move.move_uci) >= 4:
-                last_move = {
-                    "from_square": prev_move.move_uci[:2],
-                    "to_square": prev_move.move_uci[2:4],
-                }
+            await asyncio.to_thread(_save_puzzle_solutions, db, game_id, move_id, solution_list)
+
+        game = await asyncio.to_thread(_get_game_details, db, game_id)
+        if not game:
+            continue
 
         return {
             "puzzle_id": f"{game_id}_{move_id}",
@@ -266,13 +497,13 @@ def get_next_puzzle(db: Session, user_id: int) -> Optional[Dict[str, Any]]:
             "solution_uci_list": solution_list,
             "game_id": game_id,
             "move_id": move_id,
-            "user_color": candidate["user_color"],
-            "last_move": last_move,
-            "date_played": candidate["date_played"].isoformat() if candidate["date_played"] else None,
-            "white_player": candidate["white_player"],
-            "black_player": candidate["black_player"],
-            "white_elo": candidate["white_elo"],
-            "black_elo": candidate["black_elo"],
+            "user_color": candidate.user_color,
+            "last_move": _last_move_squares(candidate.prev_move_uci),
+            "date_played": game.date_played.isoformat() if game.date_played else None,
+            "white_player": game.white_player,
+            "black_player": game.black_player,
+            "white_elo": game.white_elo,
+            "black_elo": game.black_elo,
         }
 
     return None
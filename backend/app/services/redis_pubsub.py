@@ -1,88 +1,164 @@
 """
-Redis Pub/Sub service for real-time game analysis event notifications.
-This service allows Celery workers to publish events when game analysis completes,
-and FastAPI SSE endpoints to subscribe and stream these events to the frontend.
+Redis service for real-time game analysis event notifications.
+Celery workers append an event to the user's Redis Stream when game analysis
+completes, and FastAPI SSE endpoints read the stream and forward the events to
+the frontend. Unlike pub/sub, events added while no SSE client is connected are
+kept, so a reconnecting client resumes from the last event it received.
 """
 import redis
-import json
+import redis.asyncio
+import orjson
 import logging
-from typing import Optional
+import re
+import socket
+import threading
+from typing import List, Optional, Tuple
 from datetime import datetime
 from ..config import settings
 
 logger = logging.getLogger(__name__)
 
 
+# Events kept per user stream; older ones are trimmed (approximately) on append
+EVENTS_STREAM_MAXLEN = 1000
+
+
+# Stream entry IDs are "<milliseconds>-<sequence>"
+_EVENT_ID_RE = re.compile(r"\d+-\d+")
+
+
+def is_event_id(value: str) -> bool:
+    """True if value is a stream entry ID that XREAD accepts as a starting point"""
+    return _EVENT_ID_RE.fullmatch(value) is not None
+
+
+def _events_stream(user_id: int) -> str:
+    """Stream carrying a user's game analysis completion events"""
+    return f"game_analysis:events:user_{user_id}"
+
+
+def _encode_completed(user_id: int, game_id: int, timestamp: datetime) -> bytes:
+    # orjson writes naive datetimes in the same ISO format as isoformat()
+    return orjson.dumps({
+        "type": "game_analysis_completed",
+        "user_id": user_id,
+        "game_id": game_id,
+        "timestamp": timestamp
+    })
+
+
 class RedisPubSub:
     """Helper class for Redis pub/sub operations for game analysis events"""
     
     def __init__(self):
-        """Initialize Redis client connection"""
-        try:
-            self.redis_client = redis.from_url(
-                settings.REDIS_URL, 
-                decode_responses=True,
-                socket_connect_timeout=5,
-                socket_timeout=5
+        """
+        Set up lazy Redis client creation.
+        
+        Nothing connects at import time, so API and worker processes still start
+        when Redis is briefly unavailable; the pool connects on first use.
+        """
+        self._redis_client: Optional[redis.Redis] = None
+        self._async_redis_client: Optional[redis.asyncio.Redis] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def redis_client(self) -> redis.Redis:
+        """Shared client, created on first access"""
+        if self._redis_client is None:
+            with self._lock:
+                if self._redis_client is None:
+                    self._redis_client = self._make_client()
+        return self._redis_client
+    
+    @property
+    def async_redis_client(self) -> redis.asyncio.Redis:
+        """Shared asyncio client for SSE handlers, created on first access"""
+        if self._async_redis_client is None:
+            # Every SSE client holds a connection for the whole XREAD BLOCK, so this pool
+            # is not capped at REDIS_MAX_CONNECTIONS (a full pool raises instead of
+            # waiting) and has no read timeout
+            options = self._pool_options()
+            del options["max_connections"]
+            connection_pool = redis.asyncio.ConnectionPool.from_url(
+                settings.REDIS_URL, socket_timeout=None, **options
             )
-            # Test connection
-            self.redis_client.ping()
-            logger.info(f"Redis pub/sub client initialized successfully (URL: {settings.REDIS_URL})")
-        except Exception as e:
-            logger.error(f"Failed to initialize Redis pub/sub client: {e}")
-            raise
+            self._async_redis_client = redis.asyncio.Redis(connection_pool=connection_pool)
+        return self._async_redis_client
+    
+    @staticmethod
+    def _pool_options() -> dict:
+        keepalive_options = {}
+        # TCP_KEEP* constants are platform-specific (present on Linux)
+        for option, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3)):
+            if hasattr(socket, option):
+                keepalive_options[getattr(socket, option)] = value
+        
+        return dict(
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            decode_responses=True,
+            socket_connect_timeout=5,
+            # Keep long-lived worker connections from being dropped silently
+            socket_keepalive=True,
+            socket_keepalive_options=keepalive_options,
+            health_check_interval=30
+        )
+    
+    @classmethod
+    def _make_client(cls) -> redis.Redis:
+        connection_pool = redis.ConnectionPool.from_url(
+            settings.REDIS_URL, socket_timeout=5, **cls._pool_options()
+        )
+        logger.info(f"Redis pub/sub client initialized (URL: {settings.REDIS_URL})")
+        return redis.Redis(connection_pool=connection_pool)
     
     def publish_game_completed(self, user_id: int, game_id: int):
         """
-        Publish a game analysis completion event to Redis.
+        Append a game analysis completion event to the user's event stream.
         
         Args:
             user_id: ID of the user who owns the game
             game_id: ID of the game that completed analysis
         """
-        channel = f"game_analysis:completed:user_{user_id}"
-        message = {
-            "type": "game_analysis_completed",
-            "user_id": user_id,
-            "game_id": game_id,
-            "timestamp": datetime.utcnow().isoformat()
-        }
+        stream = _events_stream(user_id)
+        message = _encode_completed(user_id, game_id, datetime.utcnow())
         try:
-            subscribers = self.redis_client.publish(channel, json.dumps(message))
-            logger.info(
-                f"Published game completion event: user={user_id}, game={game_id}, "
-                f"subscribers={subscribers}, channel={channel}"
+            event_id = self.redis_client.xadd(
+                stream, {"data": message}, maxlen=EVENTS_STREAM_MAXLEN, approximate=True
             )
+            logger.info(f"Published game completion event: user={user_id}, game={game_id}, id={event_id}")
             return True
         except Exception as e:
             logger.error(f"Error publishing game completion event to Redis: {e}", exc_info=True)
             return False
     
-    def get_subscriber(self, user_id: int):
+    async def latest_event_id(self, user_id: int) -> str:
+        """ID of the newest event in the user's stream, or "0-0" if it is empty"""
+        entries = await self.async_redis_client.xrevrange(_events_stream(user_id), count=1)
+        return entries[0][0] if entries else "0-0"
+    
+    async def read_events(self, user_id: int, last_id: str, block_ms: int) -> List[Tuple[str, str]]:
         """
-        Get a Redis pubsub subscriber for a specific user's game analysis events.
+        Wait up to block_ms for events newer than last_id.
         
-        Args:
-            user_id: ID of the user to subscribe to events for
-            
         Returns:
-            redis.client.PubSub: PubSub object subscribed to the user's channel
+            (event id, JSON payload) pairs, oldest first
         """
-        try:
-            pubsub = self.redis_client.pubsub()
-            channel = f"game_analysis:completed:user_{user_id}"
-            pubsub.subscribe(channel)
-            logger.info(f"Subscribed to Redis channel: {channel} for user {user_id}")
-            return pubsub
-        except Exception as e:
-            logger.error(f"Error creating Redis subscriber for user {user_id}: {e}", exc_info=True)
-            raise
+        response = await self.async_redis_client.xread(
+            {_events_stream(user_id): last_id}, block=block_ms
+        )
+        return [
+            (event_id, fields["data"])
+            for _, entries in response
+            for event_id, fields in entries
+        ]
     
     def close(self):
         """Close the Redis connection"""
         try:
-            if hasattr(self, 'redis_client'):
-                self.redis_client.close()
+            if self._redis_client is not None:
+                self._redis_client.close()
+                self._redis_client.connection_pool.disconnect()
+                self._redis_client = None
                 logger.info("Redis pub/sub client closed")
         except Exception as e:
             logger.warning(f"Error closing Redis pub/sub client: {e}")
@@ -1,402 +1,477 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, extract, case
-from typing import List, Dict
-from datetime import datetime
+from sqlalchemy import func, extract, case, and_, cast, Float, Integer, Numeric, text, select, bindparam, update
+from typing import List, Dict, Optional
+from datetime import datetime, timedelta
+from ..config import settings
 from ..models import Game, User, UserStats, Move
 
 
+def _round2(value):
+    """SQL expression rounding value to 2 decimal places (NULL stays NULL)"""
+    return cast(func.round(cast(value, Numeric), 2), Float)
+
+
+def _percentage(part, whole):
+    """SQL expression for part as a percentage of whole, 0 when whole is 0"""
+    return _round2(func.coalesce(100.0 * part / func.nullif(whole, 0), 0))
+
+
+def _win_rate(wins, games):
+    """SQL expression for wins as a percentage of games, 0 when there are no games"""
+    return _percentage(wins, games)
+
+
+_games = func.count(Game.id)
+_wins = func.sum(case((Game.result == "win", 1), else_=0))
+_losses = func.sum(case((Game.result == "loss", 1), else_=0))
+_draws = func.sum(case((Game.result == "draw", 1), else_=0))
+
+# Hot stats queries are built once at import and bound per call, so each request
+# reuses the same statement (and its cached compilation) instead of rebuilding it
+
+# All of calculate_user_stats' tallies in one aggregate over the user's games
+_analyzed = Game.is_analyzed == True
+_USER_TOTALS_QUERY = select(
+    _games,
+    _wins,
+    _losses,
+    _draws,
+    # By color
+    func.sum(case((Game.user_color == "white", 1), else_=0)),
+    func.sum(case((and_(Game.user_color == "white", Game.result == "win"), 1), else_=0)),
+    func.sum(case((Game.user_color == "black", 1), else_=0)),
+    func.sum(case((and_(Game.user_color == "black", Game.result == "win"), 1), else_=0)),
+    # Analysis stats (only for analyzed games; AVG/SUM skip the NULLs)
+    func.avg(case((_analyzed, Game.accuracy))),
+    func.avg(case((_analyzed, Game.average_centipawn_loss))),
+    func.sum(case((_analyzed, Game.num_blunders))),
+    func.sum(case((_analyzed, Game.num_mistakes))),
+    func.sum(case((_analyzed, Game.num_inaccuracies))),
+    func.count(case((_analyzed, Game.accuracy))),
+).where(Game.user_id == bindparam("user_id"))
+
+_RECENT_GAMES_QUERY = select(Game).where(
+    Game.user_id == bindparam("user_id")
+).order_by(
+    Game.date_played.desc()
+).limit(10)
+
+# Every month in the last :months calendar months (UTC), with the user's games in that
+# month aggregated on the range-filtered (user_id, date_played) index
+_current_month = func.date_trunc("month", func.timezone("UTC", func.now()))
+_first_month = _current_month - func.make_interval(0, bindparam("months", type_=Integer) - 1)
+_month_series = select(
+    func.generate_series(_first_month, _current_month, text("interval '1 month'")).label("month")
+).subquery()
+
+_game_month = func.date_trunc("month", Game.date_played)
+_played_by_month = select(
+    _game_month.label("month"),
+    _games.label("games"),
+    _wins.label("wins"),
+    _losses.label("losses"),
+    _draws.label("draws"),
+    func.avg(Game.accuracy).label("avg_accuracy"),
+).where(
+    Game.user_id == bindparam("user_id"),
+    Game.date_played >= _first_month
+).group_by(
+    _game_month
+).subquery()
+
+_PERFORMANCE_OVER_TIME_QUERY = select(
+    _month_series.c.month.label("date"),
+    func.coalesce(_played_by_month.c.games, 0).label("games"),
+    func.coalesce(_played_by_month.c.wins, 0).label("wins"),
+    func.coalesce(_played_by_month.c.losses, 0).label("losses"),
+    func.coalesce(_played_by_month.c.draws, 0).label("draws"),
+    _win_rate(_played_by_month.c.wins, _played_by_month.c.games).label("win_rate"),
+    _round2(_played_by_month.c.avg_accuracy).label("avg_accuracy"),
+).select_from(
+    _month_series
+).outerjoin(
+    _played_by_month, _played_by_month.c.month == _month_series.c.month
+).order_by(
+    _month_series.c.month
+)
+
+# Only columns in ix_games_user_rating_date, so Postgres can answer from the index
+_RATING_HISTORY_QUERY = select(
+    Game.date_played,
+    Game.user_rating,
+    Game.result
+).where(
+    Game.user_id == bindparam("user_id"),
+    Game.user_rating.isnot(None)
+).order_by(
+    Game.date_played.asc()
+).limit(bindparam("limit"))
+
+_OPENING_STATS_QUERY = select(
+    Game.opening_eco,
+    func.coalesce(Game.opening_name, "Unknown").label("opening_name"),
+    _games.label("games_played"),
+    _wins.label("wins"),
+    _losses.label("losses"),
+    _draws.label("draws"),
+    _win_rate(_wins, _games).label("win_rate"),
+    _round2(func.avg(Game.accuracy)).label("avg_accuracy"),
+).where(
+    Game.user_id == bindparam("user_id"),
+    Game.opening_eco.isnot(None)
+).group_by(
+    Game.opening_eco, Game.opening_name
+).order_by(
+    _games.desc()
+).limit(bindparam("limit"))
+
+_TIME_CONTROL_STATS_QUERY = select(
+    Game.time_class,
+    _games.label("games_played"),
+    _wins.label("wins"),
+    _losses.label("losses"),
+    _draws.label("draws"),
+    _win_rate(_wins, _games).label("win_rate"),
+).where(
+    Game.user_id == bindparam("user_id"),
+    Game.time_class.isnot(None)
+).group_by(
+    Game.time_class
+).order_by(
+    _games.desc()
+)
+
+
+# First key of the per-user Postgres advisory lock taken while user stats are written
+_STATS_LOCK_NAMESPACE = 1
+
+# UserStats columns filled by calculate_user_stats
+STATS_FIELDS = (
+    "total_games", "total_wins", "total_losses", "total_draws",
+    "white_games", "white_wins", "black_games", "black_wins",
+    "avg_accuracy", "avg_centipawn_loss",
+    "total_blunders", "total_mistakes", "total_inaccuracies",
+    "analyzed_games", "updated_at",
+)
+
+
 class StatsService:
     """Service for calculating user statistics"""
     
     @staticmethod
-    def calculate_user_stats(db: Session, user_id: int) -> Dict:
-        """Calculate and update user statistics"""
-        
-        # Total game counts
-        total_games = db.query(Game).filter(Game.user_id == user_id).count()
-        total_wins = db.query(Game).filter(
-            Game.user_id == user_id, Game.result == "win"
-        ).count()
-        total_losses = db.query(Game).filter(
-            Game.user_id == user_id, Game.result == "loss"
-        ).count()
-        total_draws = db.query(Game).filter(
-            Game.user_id == user_id, Game.result == "draw"
-        ).count()
-        
-        # By color
-        white_games = db.query(Game).filter(
-            Game.user_id == user_id, Game.user_color == "white"
-        ).count()
-        white_wins = db.query(Game).filter(
-            Game.user_id == user_id, Game.user_color == "white", Game.result == "win"
-        ).count()
-        
-        black_games = db.query(Game).filter(
-            Game.user_id == user_id, Game.user_color == "black"
-        ).count()
-        black_wins = db.query(Game).filter(
-            Game.user_id == user_id, Game.user_color == "black", Game.result == "win"
-        ).count()
-        
-        # Analysis stats (only for analyzed games)
-        analyzed_games = db.query(Game).filter(
-            Game.user_id == user_id, Game.is_analyzed == True
-        )
-        
-        avg_accuracy = analyzed_games.with_entities(
-            func.avg(Game.accuracy)
-        ).scalar()
+    def calculate_user_stats(db: Session, user_id: int, force: bool = True) -> Dict:
+        """
+        Calculate and update user statistics
         
-        avg_cp_loss = analyzed_games.with_entities(
-            func.avg(Game.average_centipawn_loss)
-        ).scalar()
+        Args:
+            db: Database session
+            user_id: User to calculate stats for
+            force: Recompute even if no game was imported, analyzed or deleted since
+                the last calculation. Callers that just changed games must leave this on.
+        """
         
-        total_blunders = analyzed_games.with_entities(
-            func.sum(Game.num_blunders)
-        ).scalar() or 0
+        # One recompute per user at a time; a concurrent caller waits here,
+        # then finds the row the first one committed already current
+        StatsService._lock_user_stats(db, user_id)
         
-        total_mistakes = analyzed_games.with_entities(
-            func.sum(Game.num_mistakes)
-        ).scalar() or 0
+        user_stats = db.query(UserStats).filter(UserStats.user_id == user_id).first()
+        if not force and user_stats and StatsService._stats_are_current(db, user_id, user_stats):
+            stats_data = {key: getattr(user_stats, key) for key in STATS_FIELDS}
+            db.commit()  # releases the lock
+            return stats_data
         
-        total_inaccuracies = analyzed_games.with_entities(
-            func.sum(Game.num_inaccuracies)
-        ).scalar() or 0
+        totals = db.execute(_USER_TOTALS_QUERY, {"user_id": user_id}).one()
         
-        # Update or create UserStats
-        user_stats = db.query(UserStats).filter(UserStats.user_id == user_id).first()
+        (
+            total_games, total_wins, total_losses, total_draws,
+            white_games, white_wins, black_games, black_wins,
+            avg_accuracy, avg_cp_loss,
+            total_blunders, total_mistakes, total_inaccuracies,
+            analyzed_games,
+        ) = totals
         
         stats_data = {
             "total_games": total_games,
-            "total_wins": total_wins,
-            "total_losses": total_losses,
-            "total_draws": total_draws,
-            "white_games": white_games,
-            "white_wins": white_wins,
-            "black_games": black_games,
-            "black_wins": black_wins,
-            "avg_accuracy": float(avg_accuracy) if avg_accuracy else None,
-            "avg_centipawn_loss": float(avg_cp_loss) if avg_cp_loss else None,
-            "total_blunders": int(total_blunders),
-            "total_mistakes": int(total_mistakes),
-            "total_inaccuracies": int(total_inaccuracies),
+            "total_wins": int(total_wins or 0),
+            "total_losses": int(total_losses or 0),
+            "total_draws": int(total_draws or 0),
+            "white_games": int(white_games or 0),
+            "white_wins": int(white_wins or 0),
+            "black_games": int(black_games or 0),
+            "black_wins": int(black_wins or 0),
+            "avg_accuracy": float(avg_accuracy) if avg_accuracy is not None else None,
+            "avg_centipawn_loss": float(avg_cp_loss) if avg_cp_loss is not None else None,
+            "total_blunders": int(total_blunders or 0),
+            "total_mistakes": int(total_mistakes or 0),
+            "total_inaccuracies": int(total_inaccuracies or 0),
+            "analyzed_games": analyzed_games,
             "updated_at": datetime.utcnow(),
         }
         
+        # Update or create UserStats
         if user_stats:
             for key, value in stats_data.items():
                 setattr(user_stats, key, value)
+            # Games or analyses changed, so the stored dashboard is stale
+            user_stats.dashboard_cache = None
+            user_stats.dashboard_cache_updated_at = None
         else:
             user_stats = UserStats(user_id=user_id, **stats_data)
             db.add(user_stats)
         
         db.commit()
-        db.refresh(user_stats)
         
         return stats_data
     
+    @staticmethod
+    def add_analyzed_game(db: Session, game: Game) -> None:
+        """
+        Fold a newly analyzed game into the user's stats without rescanning their games
+        
+        Falls back to calculate_user_stats when there is no roll-up to update yet.
+        """
+        if not StatsService._apply_game_analysis(db, game, 1):
+            StatsService.calculate_user_stats(db, game.user_id)
+    
+    @staticmethod
+    def remove_analyzed_game(db: Session, game: Game) -> bool:
+        """
+        Take a game's current analysis back out of the user's stats, e.g. before re-analysis
+        
+        Returns False if the stats were left as they are; the caller must then run
+        calculate_user_stats once the game's analysis has been cleared.
+        """
+        return StatsService._apply_game_analysis(db, game, -1)
+    
+    @staticmethod
+    def _apply_game_analysis(db: Session, game: Game, sign: int) -> bool:
+        """
+        Add (sign=1) or subtract (sign=-1) one game's analysis in a single UPDATE
+        
+        Returns False if nothing was updated: the game has no analysis to count, it has
+        an average centipawn loss, or the user has no stats row with a known
+        analyzed_games count.
+        """
+        if not game.is_analyzed or game.accuracy is None:
+            return False
+        if game.average_centipawn_loss is not None:
+            # avg_centipawn_loss averages only the games that have one (analysis stores
+            # None), so it can't be rolled forward with the analyzed_games count
+            return False
+        
+        StatsService._lock_user_stats(db, game.user_id)
+        count = UserStats.analyzed_games + sign
+        
+        def running_avg(column, value):
+            total = func.coalesce(column, 0) * UserStats.analyzed_games + sign * value
+            return case((count > 0, total / count), else_=None)
+        
+        def running_sum(column, value):
+            return func.coalesce(column, 0) + sign * (value or 0)
+        
+        result = db.execute(
+            update(UserStats).where(
+                UserStats.user_id == game.user_id,
+                UserStats.analyzed_games.isnot(None),
+                count >= 0
+            ).values(
+                analyzed_games=count,
+                avg_accuracy=running_avg(UserStats.avg_accuracy, game.accuracy),
+                total_blunders=running_sum(UserStats.total_blunders, game.num_blunders),
+                total_mistakes=running_sum(UserStats.total_mistakes, game.num_mistakes),
+                total_inaccuracies=running_sum(UserStats.total_inaccuracies, game.num_inaccuracies),
+                updated_at=datetime.utcnow(),
+                # The stored dashboard includes these stats
+                dashboard_cache=None,
+                dashboard_cache_updated_at=None,
+            ).execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return result.rowcount > 0
+    
+    @staticmethod
+    def _lock_user_stats(db: Session, user_id: int) -> None:
+        """Hold a per-user advisory lock on Postgres until the current transaction ends"""
+        if db.get_bind().dialect.name == "postgresql":
+            db.execute(select(func.pg_advisory_xact_lock(_STATS_LOCK_NAMESPACE, user_id)))
+    
+    @staticmethod
+    def _stats_are_current(db: Session, user_id: int, user_stats: UserStats) -> bool:
+        """True if no game was added, analyzed or removed since user_stats was computed"""
+        if user_stats.updated_at is None:
+            return False
+        game_count, last_created, last_analyzed = db.query(
+            func.count(Game.id),
+            func.max(Game.created_at),
+            func.max(Game.analyzed_at)
+        ).filter(Game.user_id == user_id).one()
+        if game_count != user_stats.total_games:
+            return False
+        return all(
+            changed_at is None or changed_at <= user_stats.updated_at
+            for changed_at in (last_created, last_analyzed)
+        )
+    
     @staticmethod
     def get_opening_stats(db: Session, user_id: int, limit: int = 10) -> List[Dict]:
         """Get statistics by opening"""
         
-        results = db.query(
-            Game.opening_eco,
-            Game.opening_name,
-            func.count(Game.id).label("games_played"),
-            func.sum(case((Game.result == "win", 1), else_=0)).label("wins"),
-            func.sum(case((Game.result == "loss", 1), else_=0)).label("losses"),
-            func.sum(case((Game.result == "draw", 1), else_=0)).label("draws"),
-            func.avg(Game.accuracy).label("avg_accuracy"),
-        ).filter(
-            Game.user_id == user_id,
-            Game.opening_eco.isnot(None)
-        ).group_by(
-            Game.opening_eco, Game.opening_name
-        ).order_by(
-            func.count(Game.id).desc()
-        ).limit(limit).all()
-        
-        opening_stats = []
-        for row in results:
-            games = row.games_played
-            wins = row.wins or 0
-            win_rate = (wins / games * 100) if games > 0 else 0
-            
-            opening_stats.append({
-                "opening_eco": row.opening_eco,
-                "opening_name": row.opening_name or "Unknown",
-                "games_played": games,
-                "wins": wins,
-                "losses": row.losses or 0,
-                "draws": row.draws or 0,
-                "win_rate": round(win_rate, 2),
-                "avg_accuracy": round(row.avg_accuracy, 2) if row.avg_accuracy else None,
-            })
-        
-        return opening_stats
+        results = db.execute(_OPENING_STATS_QUERY, {"user_id": user_id, "limit": limit}).all()
+        
+        return [row._asdict() for row in results]
     
     @staticmethod
     def get_time_control_stats(db: Session, user_id: int) -> List[Dict]:
         """Get statistics by time control"""
         
-        results = db.query(
-            Game.time_class,
-            func.count(Game.id).label("games_played"),
-            func.sum(case((Game.result == "win", 1), else_=0)).label("wins"),
-            func.sum(case((Game.result == "loss", 1), else_=0)).label("losses"),
-            func.sum(case((Game.result == "draw", 1), else_=0)).label("draws"),
-        ).filter(
-            Game.user_id == user_id,
-            Game.time_class.isnot(None)
-        ).group_by(
-            Game.time_class
-        ).order_by(
-            func.count(Game.id).desc()
-        ).all()
-        
-        time_control_stats = []
-        for row in results:
-            games = row.games_played
-            wins = row.wins or 0
-            win_rate = (wins / games * 100) if games > 0 else 0
-            
-            time_control_stats.append({
-                "time_class": row.time_class,
-                "games_played": games,
-                "wins": wins,
-                "losses": row.losses or 0,
-                "draws": row.draws or 0,
-                "win_rate": round(win_rate, 2),
-            })
-        
-        return time_control_stats
+        results = db.execute(_TIME_CONTROL_STATS_QUERY, {"user_id": user_id}).all()
+        
+        return [row._asdict() for row in results]
     
     @staticmethod
     def get_performance_over_time(db: Session, user_id: int, months: int = 12) -> List[Dict]:
-        """Get performance statistics over time (monthly)"""
+        """
+        Get monthly performance statistics for the last `months` calendar months
         
-        results = db.query(
-            func.to_char(Game.date_played, 'YYYY-MM').label("month"),
-            func.count(Game.id).label("games"),
-            func.sum(case((Game.result == "win", 1), else_=0)).label("wins"),
-            func.sum(case((Game.result == "loss", 1), else_=0)).label("losses"),
-            func.sum(case((Game.result == "draw", 1), else_=0)).label("draws"),
-            func.avg(Game.accuracy).label("avg_accuracy"),
-        ).filter(
-            Game.user_id == user_id
-        ).group_by(
-            "month"
-        ).order_by(
-            "month"
-        ).limit(months).all()
-        
-        performance = []
-        for row in results:
-            games = row.games
-            wins = row.wins or 0
-            win_rate = (wins / games * 100) if games > 0 else 0
-            
-            performance.append({
-                "date": row.month,
-                "games": games,
-                "wins": wins,
-                "losses": row.losses or 0,
-                "draws": row.draws or 0,
-                "win_rate": round(win_rate, 2),
-                "avg_accuracy": round(row.avg_accuracy, 2) if row.avg_accuracy else None,
-            })
-        
-        return performance
+        Months without games are included with zero counts so the series has no gaps.
+        """
+        
+        results = db.execute(_PERFORMANCE_OVER_TIME_QUERY, {"user_id": user_id, "months": months}).all()
+        
+        # Months come back as timestamps; format them here rather than per row in SQL
+        return [
+            {**row._asdict(), "date": row.date.strftime("%Y-%m")}
+            for row in results
+        ]
     
     @staticmethod
     def get_rating_over_time(db: Session, user_id: int, limit: int = 50) -> List[Dict]:
         """Get rating progression over time"""
         
-        games = db.query(Game).filter(
-            Game.user_id == user_id,
-            Game.user_rating.isnot(None)
-        ).order_by(
-            Game.date_played.asc()
-        ).limit(limit).all()
-        
-        rating_data = []
-        for game in games:
-            rating_data.append({
-                "date": game.date_played.strftime("%Y-%m-%d"),
-                "rating": game.user_rating,
-                "result": game.result,
-            })
-        
-        return rating_data
+        rows = db.execute(_RATING_HISTORY_QUERY, {"user_id": user_id, "limit": limit}).all()
+        
+        return [
+            {
+                "date": row.date_played.strftime("%Y-%m-%d"),
+                "rating": row.user_rating,
+                "result": row.result,
+            }
+            for row in rows
+        ]
     
     @staticmethod
     def get_error_analysis_by_phase(db: Session, user_id: int) -> List[Dict]:
         """Get error distribution by game phase (opening/middlegame/endgame)"""
         
-        # Get all analyzed games for the user
-        games = db.query(Game).filter(
+        # Number each analyzed game's moves, then bucket and count them by phase in one query
+        numbered = db.query(
+            (func.row_number().over(partition_by=Move.game_id, order_by=Move.half_move) - 1).label("ply"),
+            func.count(Move.id).over(partition_by=Move.game_id).label("game_moves"),
+            Move.classification
+        ).join(
+            Game, Move.game_id == Game.id
+        ).filter(
             Game.user_id == user_id,
             Game.is_analyzed == True
-        ).all()
+        ).subquery()
         
-        phase_stats = {
-            'opening': {'blunders': 0, 'mistakes': 0, 'inaccuracies': 0, 'total_moves': 0},
-            'middlegame': {'blunders': 0, 'mistakes': 0, 'inaccuracies': 0, 'total_moves': 0},
-            'endgame': {'blunders': 0, 'mistakes': 0, 'inaccuracies': 0, 'total_moves': 0}
-        }
-        
-        for game in games:
-            moves = db.query(Move).filter(Move.game_id == game.id).all()
-            total_moves = len(moves)
-            
-            for i, move in enumerate(moves):
-                # Determine phase
-                if i < 20:  # First 10 full moves (20 ply)
-                    phase = 'opening'
-                elif i < total_moves * 0.7:
-                    phase = 'middlegame'
-                else:
-                    phase = 'endgame'
-                
-                phase_stats[phase]['total_moves'] += 1
-                
-                if move.classification == 'blunder':
-                    phase_stats[phase]['blunders'] += 1
-                elif move.classification == 'mistake':
-                    phase_stats[phase]['mistakes'] += 1
-                elif move.classification == 'inaccuracy':
-                    phase_stats[phase]['inaccuracies'] += 1
-        
-        # Convert to list format
-        result = []
-        for phase, stats in phase_stats.items():
-            total_errors = stats['blunders'] + stats['mistakes'] + stats['inaccuracies']
-            error_rate = (total_errors / stats['total_moves'] * 100) if stats['total_moves'] > 0 else 0
-            
-            result.append({
-                'phase': phase.capitalize(),
-                'blunders': stats['blunders'],
-                'mistakes': stats['mistakes'],
-                'inaccuracies': stats['inaccuracies'],
-                'total_errors': total_errors,
-                'total_moves': stats['total_moves'],
-                'error_rate': round(error_rate, 2)
-            })
-        
-        return result
+        phase = case(
+            (numbered.c.ply < 20, "opening"),  # First 10 full moves (20 ply)
+            (numbered.c.ply < numbered.c.game_moves * 0.7, "middlegame"),
+            else_="endgame"
+        )
+        classification = numbered.c.classification
+        total_moves = func.count()
+        total_errors = func.count().filter(classification.in_(["blunder", "mistake", "inaccuracy"]))
+        rows = db.query(
+            phase.label("phase"),
+            func.count().filter(classification == "blunder").label("blunders"),
+            func.count().filter(classification == "mistake").label("mistakes"),
+            func.count().filter(classification == "inaccuracy").label("inaccuracies"),
+            total_errors.label("total_errors"),
+            total_moves.label("total_moves"),
+            _percentage(total_errors, total_moves).label("error_rate"),
+        ).group_by(phase).all()
+        by_phase = {row.phase: row._asdict() for row in rows}
+        
+        empty = {'phase': None, 'blunders': 0, 'mistakes': 0, 'inaccuracies': 0, 'total_errors': 0, 'total_moves': 0, 'error_rate': 0}
+        return [
+            {**by_phase.get(phase, empty), 'phase': phase.capitalize()}
+            for phase in ('opening', 'middlegame', 'endgame')
+        ]
     
     @staticmethod
     def get_win_loss_error_correlation(db: Session, user_id: int) -> Dict:
         """Analyze correlation between errors and game outcomes"""
         
-        win_games = db.query(Game).filter(
-            Game.user_id == user_id,
-            Game.is_analyzed == True,
-            Game.result == "win"
-        ).all()
-        
-        loss_games = db.query(Game).filter(
+        # Per-result averages in one grouped query; games with 0 accuracy stay out of its average
+        rows = db.query(
+            Game.result,
+            _games.label("games"),
+            _round2(func.avg(Game.num_blunders)).label("blunders"),
+            _round2(func.avg(Game.num_mistakes)).label("mistakes"),
+            _round2(func.avg(Game.num_inaccuracies)).label("inaccuracies"),
+            _round2(func.coalesce(func.avg(case((Game.accuracy != 0, Game.accuracy))), 0)).label("accuracy"),
+        ).filter(
             Game.user_id == user_id,
             Game.is_analyzed == True,
-            Game.result == "loss"
-        ).all()
-        
-        def calc_avg_errors(games):
-            if not games:
-                return {'blunders': 0, 'mistakes': 0, 'inaccuracies': 0, 'accuracy': 0}
-            
-            total_blunders = sum(g.num_blunders for g in games)
-            total_mistakes = sum(g.num_mistakes for g in games)
-            total_inaccuracies = sum(g.num_inaccuracies for g in games)
-            avg_accuracy = sum(g.accuracy for g in games if g.accuracy) / len([g for g in games if g.accuracy]) if any(g.accuracy for g in games) else 0
-            
-            return {
-                'blunders': round(total_blunders / len(games), 2),
-                'mistakes': round(total_mistakes / len(games), 2),
-                'inaccuracies': round(total_inaccuracies / len(games), 2),
-                'accuracy': round(avg_accuracy, 2)
-            }
+            Game.result.in_(["win", "loss"])
+        ).group_by(Game.result).all()
+        by_result = {row.result: row._asdict() for row in rows}
         
+        empty = {'games': 0, 'blunders': 0, 'mistakes': 0, 'inaccuracies': 0, 'accuracy': 0}
+        wins, losses = by_result.get("win", empty), by_result.get("loss", empty)
         return {
-            'wins': calc_avg_errors(win_games),
-            'losses': calc_avg_errors(loss_games),
-            'win_game_count': len(win_games),
-            'loss_game_count': len(loss_games)
+            'wins': {key: wins[key] for key in ('blunders', 'mistakes', 'inaccuracies', 'accuracy')},
+            'losses': {key: losses[key] for key in ('blunders', 'mistakes', 'inaccuracies', 'accuracy')},
+            'win_game_count': wins['games'],
+            'loss_game_count': losses['games']
         }
     
     @staticmethod
     def get_performance_by_phase(db: Session, user_id: int) -> List[Dict]:
         """Get win rate and accuracy by game phase"""
         
-        games = db.query(Game).filter(
+        # Tally games by the phase they ended in, from each game's move count, in one query
+        moves = select(func.count(Move.id)).where(Move.game_id == Game.id).scalar_subquery()
+        phase = case(
+            (moves < 20, "opening"),
+            (moves < 40, "middlegame"),
+            else_="endgame"
+        )
+        # Games with 0 accuracy are left out of the average, as before
+        scored_accuracy = case((Game.accuracy != 0, Game.accuracy))
+        wins = func.sum(case((Game.result == "win", 1), else_=0))
+        rows = db.query(
+            phase.label("phase"),
+            wins.label("wins"),
+            func.sum(case((Game.result == "loss", 1), else_=0)).label("losses"),
+            func.sum(case((Game.result.in_(["win", "loss"]), 0), else_=1)).label("draws"),
+            _games.label("total_games"),
+            _win_rate(wins, _games).label("win_rate"),
+            _round2(func.coalesce(func.avg(scored_accuracy), 0)).label("avg_accuracy"),
+        ).filter(
             Game.user_id == user_id,
             Game.is_analyzed == True
-        ).all()
-        
-        phase_performance = {
-            'opening': {'wins': 0, 'losses': 0, 'draws': 0, 'accuracy_sum': 0, 'accuracy_count': 0},
-            'middlegame': {'wins': 0, 'losses': 0, 'draws': 0, 'accuracy_sum': 0, 'accuracy_count': 0},
-            'endgame': {'wins': 0, 'losses': 0, 'draws': 0, 'accuracy_sum': 0, 'accuracy_count': 0}
-        }
-        
-        # Classify games by where they ended
-        for game in games:
-            moves = db.query(Move).filter(Move.game_id == game.id).count()
-            
-            # Determine which phase the game ended in
-            if moves < 20:
-                phase = 'opening'
-            elif moves < 40:
-                phase = 'middlegame'
-            else:
-                phase = 'endgame'
-            
-            if game.result == 'win':
-                phase_performance[phase]['wins'] += 1
-            elif game.result == 'loss':
-                phase_performance[phase]['losses'] += 1
-            else:
-                phase_performance[phase]['draws'] += 1
-            
-            if game.accuracy:
-                phase_performance[phase]['accuracy_sum'] += game.accuracy
-                phase_performance[phase]['accuracy_count'] += 1
-        
-        result = []
-        for phase, stats in phase_performance.items():
-            total_games = stats['wins'] + stats['losses'] + stats['draws']
-            win_rate = (stats['wins'] / total_games * 100) if total_games > 0 else 0
-            avg_accuracy = (stats['accuracy_sum'] / stats['accuracy_count']) if stats['accuracy_count'] > 0 else 0
-            
-            result.append({
-                'phase': phase.capitalize(),
-                'wins': stats['wins'],
-                'losses': stats['losses'],
-                'draws': stats['draws'],
-                'total_games': total_games,
-                'win_rate': round(win_rate, 2),
-                'avg_accuracy': round(avg_accuracy, 2)
-            })
-        
-        return result
+        ).group_by(phase).all()
+        by_phase = {row.phase: row._asdict() for row in rows}
+        
+        empty = {'phase': None, 'wins': 0, 'losses': 0, 'draws': 0, 'total_games': 0, 'win_rate': 0, 'avg_accuracy': 0}
+        return [
+            {**by_phase.get(phase, empty), 'phase': phase.capitalize()}
+            for phase in ('opening', 'middlegame', 'endgame')
+        ]
     
     @staticmethod
     def get_dashboard_data(db: Session, user_id: int) -> Dict:
         """Get all data needed for the dashboard"""
         
-        # Get or calculate user stats
+        # Bring user stats up to date; a no-op unless games changed since the last calculation
+        StatsService.calculate_user_stats(db, user_id, force=False)
         user_stats = db.query(UserStats).filter(UserStats.user_id == user_id).first()
-        if not user_stats:
-            StatsService.calculate_user_stats(db, user_id)
-            user_stats = db.query(UserStats).filter(UserStats.user_id == user_id).first()
         
         # Recent games
-        recent_games = db.query(Game).filter(
-            Game.user_id == user_id
-        ).order_by(
-            Game.date_played.desc()
-        ).limit(10).all()
+        recent_games = db.execute(_RECENT_GAMES_QUERY, {"user_id": user_id}).scalars().all()
         
         # Opening stats
         opening_stats = StatsService.get_opening_stats(db, user_id, limit=5)
@@ -414,4 +489,45 @@ class StatsService:
             "time_control_stats": time_control_stats,
             "performance_over_time": performance,
         }
-
+    
+    @staticmethod
+    def get_cached_dashboard(db: Session, user_id: int) -> Optional[Dict]:
+        """Return the stored dashboard response if it is younger than DASHBOARD_CACHE_TTL_SECONDS"""
+        row = db.query(
+            UserStats.dashboard_cache,
+            UserStats.dashboard_cache_updated_at
+        ).filter(UserStats.user_id == user_id).first()
+        if not row or row.dashboard_cache is None or row.dashboard_cache_updated_at is None:
+            return None
+        
+        max_age = timedelta(seconds=settings.DASHBOARD_CACHE_TTL_SECONDS)
+        if datetime.utcnow() - row.dashboard_cache_updated_at > max_age:
+            return None
+        return row.dashboard_cache
+    
+    @staticmethod
+    def save_dashboard_cache(db: Session, user_id: int, dashboard: Dict) -> None:
+        """Store a serialized dashboard response for get_cached_dashboard"""
+        db.query(UserStats).filter(UserStats.user_id == user_id).update(
+            {
+                "dashboard_cache": dashboard,
+                "dashboard_cache_updated_at": datetime.utcnow(),
+                # Caching the dashboard is not a stats update; keep updated_at as is
+                "updated_at": UserStats.updated_at,
+            },
+            synchronize_session=False
+        )
+        db.commit()
+    
+    @staticmethod
+    def clear_dashboard_cache(db: Session, user_id: int) -> None:
+        """Drop the stored dashboard response, e.g. when a game changes without a stats update"""
+        db.query(UserStats).filter(UserStats.user_id == user_id).update(
+            {
+                "dashboard_cache": None,
+                "dashboard_cache_updated_at": None,
+                "updated_at": UserStats.updated_at,
+            },
+            synchronize_session=False
+        )
+        db.commit()
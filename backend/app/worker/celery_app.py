@@ -1,6 +1,8 @@
 # app/worker/celery_app.py
 from celery import Celery
+from celery.signals import worker_process_init
 from app.config import settings
+from app.database import engine
 from app.logging_config import setup_logging
 
 # Set up logging with datetime before initializing Celery
@@ -12,8 +14,8 @@ celery_app = Celery(
     backend=settings.REDIS_URL
 )
 
-# Tell Celery to find tasks in the new directory
-celery_app.autodiscover_tasks(['app.worker'])
+# Tell Celery to find tasks in app/worker/tasks.py
+celery_app.autodiscover_tasks(['app.worker'], related_name='tasks')
 
 # Optional: Celery configurations
 celery_app.conf.update(
@@ -22,14 +24,21 @@ celery_app.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
+    # Analysis tasks run for seconds each; reserve one task per worker process at a
+    # time so a batch drains evenly across all workers instead of queueing behind busy ones
+    worker_prefetch_multiplier=1,
     # Task routing: send import tasks to imports queue, analysis tasks to celery (default) queue
     task_routes={
         'import_games_task': {'queue': 'imports'},
         'import_lichess_games_task': {'queue': 'imports'},
         'analyze_game_task': {'queue': 'celery'},
         'batch_analyze_games_task': {'queue': 'celery'},
+        'warm_puzzle_cache_task': {'queue': 'celery'},
     },
 )
 
-# Tell Celery to look for tasks in app/tasks.py
-celery_app.autodiscover_tasks(['app'])
\ No newline at end of file
+
+@worker_process_init.connect
+def reset_db_pool(**kwargs):
+    """Give each forked worker process its own connections instead of the parent's"""
+    engine.dispose(close=False)
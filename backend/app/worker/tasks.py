@@ -1,14 +1,18 @@
 import asyncio
 import logging
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 from typing import Optional
-from sqlalchemy import desc
+from celery import group
+from sqlalchemy import desc, func, insert, or_, select
+from sqlalchemy.orm import undefer
 from app.worker.celery_app import celery_app
 from app.services.analysis_service import AnalysisService
 from app.services.stats_service import StatsService
 from app.services.chess_com_service import ChessComService
-from app.services.lichess_service import LichessService
+from app.services.lichess_service import lichess_service
 from app.services.redis_pubsub import redis_pubsub
+from app.services.puzzle_service import refresh_puzzle_candidates, warm_puzzle_cache
 from app.database import SessionLocal
 from app.models import Game, Move, AnalysisJob, ImportJob, User
 from app.logging_config import setup_logging
@@ -17,56 +21,154 @@ from app.logging_config import setup_logging
 setup_logging()
 logger = logging.getLogger(__name__)
 
+# Lichess games are committed in batches of this size while the import streams
+LICHESS_IMPORT_BATCH_SIZE = 500
+# Chess.com games are inserted, committed and reported in batches of this size
+CHESS_COM_IMPORT_BATCH_SIZE = 500
+# A game claimed for analysis longer ago than this is assumed to belong to a worker
+# that died mid-analysis, and may be claimed again
+ANALYSIS_CLAIM_TIMEOUT = timedelta(minutes=30)
+
+# One event loop per worker process, kept running in a background thread so the
+# pooled Stockfish processes and HTTP clients bound to it survive between tasks
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+_worker_loop_lock = threading.Lock()
+_analyzer: Optional[AnalysisService] = None
+
+
+def _run_on_worker_loop(coro):
+    """Run a coroutine on this process's long-lived event loop and wait for its result"""
+    global _worker_loop
+    if _worker_loop is None:
+        with _worker_loop_lock:
+            # Created on first use, i.e. after the worker process has been forked
+            if _worker_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="worker-event-loop", daemon=True).start()
+                _worker_loop = loop
+    return asyncio.run_coroutine_threadsafe(coro, _worker_loop).result()
+
+
+def _get_analyzer() -> AnalysisService:
+    """AnalysisService shared by every task in this worker process"""
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = AnalysisService()
+    return _analyzer
+
+
+def _advance_analysis_jobs(db, user_id: int) -> None:
+    """
+    Count one more finished game toward the user's running analysis jobs.
+
+    Done with two UPDATEs instead of re-counting the user's analyzed games per job.
+    """
+    analyzed_games = func.least(func.coalesce(AnalysisJob.analyzed_games, 0) + 1, AnalysisJob.total_games)
+    running = db.query(AnalysisJob).filter(
+        AnalysisJob.user_id == user_id,
+        AnalysisJob.status == "processing",
+        AnalysisJob.started_at.isnot(None),
+        AnalysisJob.total_games > 0
+    )
+    running.update(
+        {
+            "analyzed_games": analyzed_games,
+            "progress": analyzed_games * 100 // AnalysisJob.total_games,
+        },
+        synchronize_session=False
+    )
+    completed = running.filter(
+        AnalysisJob.analyzed_games >= AnalysisJob.total_games
+    ).update(
+        {
+            "status": "completed",
+            "completed_at": datetime.utcnow(),
+            "progress": 100,
+        },
+        synchronize_session=False
+    )
+    db.commit()
+    if completed:
+        logger.info("Completed %s analysis job(s) for user %s", completed, user_id)
+
+
 @celery_app.task(name="analyze_game_task")
 def analyze_game_task(game_id: int):
     """
     Celery task to analyze a single chess game.
     """
-    logger.info(f"Starting analysis task for game {game_id}")
+    logger.info("Starting analysis task for game %s", game_id)
     db = SessionLocal()
     start_time = datetime.utcnow()
     
     try:
-        # 1. Fetch game from DB
-        logger.debug(f"Fetching game {game_id} from database")
-        game = db.query(Game).filter(Game.id == game_id).first()
+        # 1-2. Claim the game: lock its row unless it is already analyzed or another
+        # task holds a live claim on it. SKIP LOCKED makes a concurrent copy of this
+        # task back off instead of queueing behind us; the claim stamp stored below
+        # keeps later copies away once our lock is released
+        logger.debug("Claiming game %s", game_id)
+        game = db.execute(
+            select(Game).options(undefer(Game.pgn)).where(
+                Game.id == game_id,
+                Game.analysis_state != "analyzed",
+                or_(
+                    Game.analysis_claimed_at.is_(None),
+                    Game.analysis_claimed_at < start_time - ANALYSIS_CLAIM_TIMEOUT
+                )
+            ).with_for_update(skip_locked=True)
+        ).scalar_one_or_none()
         if not game:
-            logger.warning(f"Game {game_id} not found in database")
-            return f"Game {game_id} not found"
+            logger.info("Game %s not found, already analyzed or claimed by another worker, skipping", game_id)
+            return f"Game {game_id} not found, already analyzed or claimed, skipping"
 
-        logger.info(f"Game {game_id} found: {game.white_player} vs {game.black_player}, user_color={game.user_color}")
-
-        # 2. Check if already analyzed
-        if game.analysis_state == "analyzed":
-            logger.info(f"Game {game_id} already analyzed, skipping")
-            return f"Game {game_id} already analyzed, skipping"
+        logger.info("Game %s found: %s vs %s, user_color=%s", game_id, game.white_player, game.black_player, game.user_color)
 
         # 3. Ensure state is in_progress
         if game.analysis_state != "in_progress":
-            logger.info(f"Setting game {game_id} analysis_state to 'in_progress' (was: {game.analysis_state})")
+            logger.info("Setting game %s analysis_state to 'in_progress' (was: %s)", game_id, game.analysis_state)
             game.analysis_state = "in_progress"
-            db.commit()
         else:
-            logger.debug(f"Game {game_id} already in 'in_progress' state")
+            logger.debug("Game %s already in 'in_progress' state", game_id)
+        game.analysis_claimed_at = start_time
+        
+        # End the transaction before the engine runs so the pooled connection goes
+        # back to the pool instead of sitting idle in transaction for the whole analysis
+        pgn, user_color = game.pgn, game.user_color
+        db.commit()
 
         # 4. Run Stockfish Analysis (async function)
-        logger.info(f"Starting Stockfish analysis for game {game_id} (depth={AnalysisService().depth}, time_limit={AnalysisService().time_limit}s)")
-        analyzer = AnalysisService()
-        result = asyncio.run(analyzer.analyze_game(game.pgn, game.user_color))
+        analyzer = _get_analyzer()
+        logger.info("Starting Stockfish analysis for game %s (depth=%s, time_limit=%ss)", game_id, analyzer.depth, analyzer.time_limit)
+        result = _run_on_worker_loop(analyzer.analyze_game(pgn, user_color))
         
         analysis_duration = (datetime.utcnow() - start_time).total_seconds()
-        logger.info(f"Stockfish analysis completed for game {game_id} in {analysis_duration:.2f}s")
+        logger.info("Stockfish analysis completed for game %s in %.2fs", game_id, analysis_duration)
+
+        # The row lock ended with the commit above, so re-lock the row and make sure
+        # the game is still ours: not deleted, not analyzed by a task that took over
+        # an expired claim, and not re-claimed by one
+        claim = db.execute(
+            select(Game.analysis_state, Game.analysis_claimed_at).where(Game.id == game_id).with_for_update()
+        ).one_or_none()
+        if claim is None or claim.analysis_state == "analyzed" or claim.analysis_claimed_at != start_time:
+            db.rollback()
+            logger.info("Game %s was analyzed, re-claimed or deleted by another task meanwhile, discarding result", game_id)
+            return f"Game {game_id} already analyzed, skipping"
 
         # 5. Handle errors
         if "error" in result:
             error_msg = result['error']
-            logger.error(f"Error analyzing game {game_id}: {error_msg}")
+            logger.error("Error analyzing game %s: %s", game_id, error_msg)
             # Mark as analyzed with 0 stats so we don't retry
             game.is_analyzed = True
             game.analysis_state = "analyzed"
+            game.analysis_claimed_at = None
             game.num_moves = 0
             game.analyzed_at = datetime.utcnow()
             db.commit()
+            _advance_analysis_jobs(db, game.user_id)
+            # No stats change, but the dashboard lists this game's analysis state
+            StatsService.clear_dashboard_cache(db, game.user_id)
             return f"Error analyzing game {game_id}: {error_msg}"
 
         # 6. Update game with analysis results
@@ -78,15 +180,18 @@ def analyze_game_task(game_id: int):
         mistakes = stats.get("num_mistakes", 0)
         inaccuracies = stats.get("num_inaccuracies", 0)
         
-        # Format values safely for logging (handle None values)
-        accuracy_str = f"{accuracy:.1f}%" if accuracy is not None else "N/A"
-        avg_cp_loss_str = f"{avg_cp_loss:.1f}" if avg_cp_loss is not None else "N/A"
-        
-        logger.info(f"Analysis results for game {game_id}: {num_moves} moves, accuracy={accuracy_str}, "
-                   f"avg_cp_loss={avg_cp_loss_str}, blunders={blunders}, mistakes={mistakes}, inaccuracies={inaccuracies}")
+        if logger.isEnabledFor(logging.INFO):
+            # Format values safely for logging (handle None values)
+            accuracy_str = f"{accuracy:.1f}%" if accuracy is not None else "N/A"
+            avg_cp_loss_str = f"{avg_cp_loss:.1f}" if avg_cp_loss is not None else "N/A"
+            logger.info(
+                "Analysis results for game %s: %s moves, accuracy=%s, avg_cp_loss=%s, blunders=%s, mistakes=%s, inaccuracies=%s",
+                game_id, num_moves, accuracy_str, avg_cp_loss_str, blunders, mistakes, inaccuracies
+            )
         
         game.is_analyzed = True
         game.analysis_state = "analyzed"
+        game.analysis_claimed_at = None
         game.num_moves = num_moves
         game.average_centipawn_loss = avg_cp_loss
         game.accuracy = accuracy
@@ -97,89 +202,89 @@ def analyze_game_task(game_id: int):
 
         # 7. Store move analysis
         moves_data = result.get("moves", [])
-        logger.debug(f"Saving {len(moves_data)} move analysis records for game {game_id}")
-        for move_data in moves_data:
-            move = Move(
-                game_id=game_id,
-                **move_data
-            )
-            db.add(move)
+        logger.debug("Saving %s move analysis records for game %s", len(moves_data), game_id)
+        if moves_data:
+            # One executemany INSERT instead of an ORM object per move
+            db.execute(insert(Move), [{"game_id": game_id, **move_data} for move_data in moves_data])
 
-        db.commit()
-        logger.info(f"Game {game_id} analysis completed successfully, state set to 'analyzed'")
+        # Flush rather than commit: the game, its moves and its puzzle candidates
+        # are written in one transaction by refresh_puzzle_candidates below
+        db.flush()
+        logger.info("Game %s analysis completed successfully, state set to 'analyzed'", game_id)
+
+        # Index this game's puzzle positions for puzzle selection
+        candidates = refresh_puzzle_candidates(db, game_id)
+        logger.debug("Stored %s puzzle candidates for game %s", candidates, game_id)
 
         # 8. Update user stats after analysis
-        logger.debug(f"Updating user stats for user {game.user_id}")
-        StatsService.calculate_user_stats(db, game.user_id)
-        logger.debug(f"User stats updated for user {game.user_id}")
+        logger.debug("Updating user stats for user %s", game.user_id)
+        StatsService.add_analyzed_game(db, game)
+        logger.debug("User stats updated for user %s", game.user_id)
         
         # 9. Update any active analysis jobs for this user
-        # Only update jobs that started before this game was analyzed
-        active_jobs = db.query(AnalysisJob).filter(
-            AnalysisJob.user_id == game.user_id,
-            AnalysisJob.status == "processing",
-            AnalysisJob.started_at.isnot(None)
-        ).all()
-        
-        for job in active_jobs:
-            # Count games that were analyzed after the job started
-            # This ensures we only count games that are part of this batch
-            analyzed_count = db.query(Game).filter(
-                Game.user_id == game.user_id,
-                Game.analysis_state == "analyzed",
-                Game.analyzed_at >= job.started_at
-            ).count()
-            
-            # Update job progress
-            if job.total_games > 0:
-                job.analyzed_games = min(analyzed_count, job.total_games)  # Cap at total_games
-                job.progress = int((job.analyzed_games / job.total_games) * 100)
-                
-                # Check if all games are done
-                if job.analyzed_games >= job.total_games:
-                    job.status = "completed"
-                    job.completed_at = datetime.utcnow()
-                    job.progress = 100
-                    logger.info(f"Analysis job {job.id} completed: {job.analyzed_games}/{job.total_games} games analyzed")
-                
-                db.commit()
-                logger.debug(f"Updated job {job.id} progress: {job.progress}% ({job.analyzed_games}/{job.total_games})")
+        _advance_analysis_jobs(db, game.user_id)
         
         total_duration = (datetime.utcnow() - start_time).total_seconds()
-        logger.info(f"Analysis task completed for game {game_id} in {total_duration:.2f}s total")
+        logger.info("Analysis task completed for game %s in %.2fs total", game_id, total_duration)
         
         # Publish completion event to Redis for SSE
         try:
             success = redis_pubsub.publish_game_completed(game.user_id, game_id)
             if success:
-                logger.debug(f"SSE event published successfully for game {game_id} (user {game.user_id})")
+                logger.debug("SSE event published successfully for game %s (user %s)", game_id, game.user_id)
             else:
-                logger.warning(f"Failed to publish SSE event for game {game_id}, but analysis completed successfully")
+                logger.warning("Failed to publish SSE event for game %s, but analysis completed successfully", game_id)
         except Exception as e:
-            logger.warning(f"Exception while publishing SSE event for game {game_id}: {e}", exc_info=True)
+            logger.warning("Exception while publishing SSE event for game %s: %s", game_id, e, exc_info=True)
             # Don't fail the task if SSE publishing fails
         
+        # Pre-compute puzzle solutions for this game's mistakes in the background
+        try:
+            warm_puzzle_cache_task.delay(game.user_id, game_id)
+        except Exception as e:
+            logger.warning("Failed to queue puzzle warm-up for game %s: %s", game_id, e)
+        
         return f"Game {game_id} analysis complete"
     
     except Exception as e:
         db.rollback()
-        logger.exception(f"Exception occurred while analyzing game {game_id}: {e}")
+        logger.exception("Exception occurred while analyzing game %s: %s", game_id, e)
         # Mark as analyzed to prevent infinite retries
         try:
             game = db.query(Game).filter(Game.id == game_id).first()
             if game and game.analysis_state != "analyzed":
-                logger.warning(f"Marking game {game_id} as analyzed due to error to prevent retries")
+                logger.warning("Marking game %s as analyzed due to error to prevent retries", game_id)
                 game.is_analyzed = True
                 game.analysis_state = "analyzed"
+                game.analysis_claimed_at = None
                 game.num_moves = 0
                 game.analyzed_at = datetime.utcnow()
                 db.commit()
+                _advance_analysis_jobs(db, game.user_id)
+                StatsService.clear_dashboard_cache(db, game.user_id)
         except Exception as e2:
-            logger.error(f"Error marking game {game_id} as analyzed: {e2}")
+            logger.error("Error marking game %s as analyzed: %s", game_id, e2)
         return f"Error analyzing game {game_id}: {str(e)}"
     finally:
         db.close()
-        logger.debug(f"Database session closed for game {game_id}")
+        logger.debug("Database session closed for game %s", game_id)
+
+
+@celery_app.task(name="warm_puzzle_cache_task")
+def warm_puzzle_cache_task(user_id: int, game_id: Optional[int] = None):
+    """
+    Celery task to deep-analyze uncached puzzle positions so puzzle requests are a DB read.
+    """
+    db = SessionLocal()
+    try:
+        written = _run_on_worker_loop(warm_puzzle_cache(db, user_id, game_id=game_id))
+        return f"Warmed {written} puzzle positions for user {user_id}"
+    except Exception as e:
+        db.rollback()
+        logger.exception(f"Puzzle warm-up failed for user {user_id}: {e}")
+        return f"Puzzle warm-up failed for user {user_id}: {e}"
+    finally:
+        db.close()
 
 
 @celery_app.task(name="batch_analyze_games_task")
@@ -198,23 +303,20 @@ def batch_analyze_games_task(user_id: int, job_id: int):
             logger.error(f"Analysis job {job_id} not found")
             return f"Analysis job {job_id} not found"
         
-        # 2. Update job status
+        # 2. Get all unanalyzed games for this user, ordered by date (newest first)
+        game_ids = [
+            game_id for (game_id,) in db.query(Game.id).filter(
+                Game.user_id == user_id,
+                Game.analysis_state != "analyzed"
+            ).order_by(desc(Game.date_played)).all()
+        ]
+        logger.info(f"Found {len(game_ids)} unanalyzed games for user {user_id} (ordered newest first)")
+        
         job.status = "processing"
         job.started_at = datetime.utcnow()
-        db.commit()
-        logger.info(f"Analysis job {job_id} marked as processing")
-        
-        # 3. Get all unanalyzed games for this user, ordered by date (newest first)
-        games = db.query(Game).filter(
-            Game.user_id == user_id,
-            Game.analysis_state != "analyzed"
-        ).order_by(desc(Game.date_played)).all()
-        
-        job.total_games = len(games)
-        db.commit()
-        logger.info(f"Found {len(games)} unanalyzed games for user {user_id} (ordered newest first)")
+        job.total_games = len(game_ids)
         
-        if len(games) == 0:
+        if len(game_ids) == 0:
             logger.info(f"No games to analyze for user {user_id}")
             job.status = "completed"
             job.completed_at = datetime.utcnow()
@@ -222,18 +324,19 @@ def batch_analyze_games_task(user_id: int, job_id: int):
             db.commit()
             return {"job_id": job_id, "analyzed": 0}
         
-        # 4. Dispatch each game to the analysis queue
-        logger.info(f"Dispatching {len(games)} games to analysis queue")
-        for i, game in enumerate(games):
-            # Set state to in_progress
-            game.analysis_state = "in_progress"
-            db.commit()
-            
-            # Dispatch to Celery queue
-            analyze_game_task.delay(game.id)
-            logger.debug(f"Dispatched game {game.id} to analysis queue ({i+1}/{len(games)})")
+        # 3. Mark every game in_progress with one UPDATE and commit it together with
+        # the job, then dispatch them all in one group
+        logger.info(f"Dispatching {len(game_ids)} games to analysis queue")
+        db.query(Game).filter(Game.id.in_(game_ids)).update(
+            {"analysis_state": "in_progress"},
+            synchronize_session=False
+        )
+        db.commit()
+        logger.info(f"Analysis job {job_id} marked as processing")
+        
+        group(analyze_game_task.s(game_id) for game_id in game_ids).apply_async()
         
-        logger.info(f"All {len(games)} games dispatched to analysis queue for job {job_id}")
+        logger.info(f"All {len(game_ids)} games dispatched to analysis queue for job {job_id}")
         
         # Note: Individual analyze_game_task will update job progress via a callback
         # For now, we'll mark the job as processing and let it be updated by individual tasks
@@ -241,7 +344,7 @@ def batch_analyze_games_task(user_id: int, job_id: int):
         
         return {
             "job_id": job_id,
-            "total_games": len(games),
+            "total_games": len(game_ids),
             "status": "dispatched"
         }
         
@@ -300,55 +403,52 @@ def import_games_task(
         job.progress = 10
         db.commit()
         
-        parsed_games = chess_com_service.fetch_and_parse_games(
-            chess_com_username,
-            from_year=from_year,
-            from_month=from_month,
-            to_year=to_year,
-            to_month=to_month
-        )
-        
-        job.total_games = len(parsed_games)
-        job.progress = 30
-        db.commit()
-        logger.info(f"Fetched {len(parsed_games)} games from Chess.com for job {job_id}")
-        
         # 4. Get existing game IDs to avoid duplicates
-        existing_ids = {
-            game.chess_com_id 
-            for game in db.query(Game.chess_com_id).filter(Game.user_id == user_id).all()
-            if game.chess_com_id
-        }
+        existing_ids = set(db.scalars(
+            select(Game.chess_com_id).where(Game.user_id == user_id, Game.chess_com_id.isnot(None))
+        ))
         logger.debug(f"Found {len(existing_ids)} existing games for user {user_id}")
         
-        # 5. Import new games
+        # 5. Import new games as the archives are downloaded, one multi-row INSERT
+        # and commit per batch so the full import is never held in memory. The
+        # total isn't known up front, so progress advances 5% per batch up to 80%.
+        fetched_count = 0
         new_games_count = 0
         skipped_count = 0
-        for idx, game_data in enumerate(parsed_games):
+        pending = []
+        for game_data in chess_com_service.iter_parsed_games(
+            chess_com_username,
+            from_year=from_year,
+            from_month=from_month,
+            to_year=to_year,
+            to_month=to_month
+        ):
+            fetched_count += 1
             chess_com_id = game_data.get("chess_com_id")
             
             # Skip if already imported
             if chess_com_id and chess_com_id in existing_ids:
                 skipped_count += 1
-                continue
-            
-            # Create game record
-            new_game = Game(
-                user_id=user_id,
-                **game_data
-            )
-            db.add(new_game)
-            new_games_count += 1
-            existing_ids.add(chess_com_id)  # Add to set to prevent duplicates in same batch
+            else:
+                pending.append({"user_id": user_id, **game_data})
+                existing_ids.add(chess_com_id)  # Add to set to prevent duplicates in same batch
             
-            # Update progress periodically
-            if idx % 10 == 0 or idx == len(parsed_games) - 1:
+            if fetched_count % CHESS_COM_IMPORT_BATCH_SIZE == 0:
+                if pending:
+                    db.execute(insert(Game), pending)
+                new_games_count += len(pending)
+                pending = []
+                job.total_games = fetched_count
                 job.imported_games = new_games_count
-                job.progress = 30 + int((idx / len(parsed_games)) * 50)
+                job.progress = min(80, 10 + fetched_count // CHESS_COM_IMPORT_BATCH_SIZE * 5)
                 db.commit()
                 logger.debug(f"Import progress: {new_games_count} new games imported, {skipped_count} skipped ({job.progress}%)")
         
-        db.commit()
+        if pending:
+            db.execute(insert(Game), pending)
+        new_games_count += len(pending)
+        job.total_games = fetched_count
+        logger.info(f"Fetched {fetched_count} games from Chess.com for job {job_id}")
         
         job.imported_games = new_games_count
         job.progress = 85
@@ -360,12 +460,12 @@ def import_games_task(
         if user:
             user.last_import_at = datetime.utcnow()
             # Get most recent game rating
-            latest_game = db.query(Game).filter(
+            latest_rating = db.query(Game.user_rating).filter(
                 Game.user_id == user_id,
                 Game.user_rating.isnot(None)
-            ).order_by(Game.date_played.desc()).first()
-            if latest_game:
-                user.current_rating = latest_game.user_rating
+            ).order_by(Game.date_played.desc()).limit(1).scalar()
+            if latest_rating is not None:
+                user.current_rating = latest_rating
             db.commit()
             logger.debug(f"Updated user {user_id} last_import_at and current_rating")
         
@@ -437,59 +537,55 @@ def import_lichess_games_task(
         
         # 3. Fetch games from Lichess
         logger.info(f"Fetching games from Lichess.org for user {lichess_username}")
-        lichess_service = LichessService()
         job.progress = 10
         db.commit()
         
-        parsed_games = lichess_service.fetch_and_parse_games(
-            lichess_username,
-            from_year=from_year,
-            from_month=from_month,
-            to_year=to_year,
-            to_month=to_month
-        )
-        
-        job.total_games = len(parsed_games)
-        job.progress = 30
-        db.commit()
-        logger.info(f"Fetched {len(parsed_games)} games from Lichess.org for job {job_id}")
-        
         # 4. Get existing game IDs to avoid duplicates
-        existing_ids = {
-            game.lichess_id 
-            for game in db.query(Game.lichess_id).filter(Game.user_id == user_id).all()
-            if game.lichess_id
-        }
+        existing_ids = set(db.scalars(
+            select(Game.lichess_id).where(Game.user_id == user_id, Game.lichess_id.isnot(None))
+        ))
         logger.debug(f"Found {len(existing_ids)} existing Lichess games for user {user_id}")
         
-        # 5. Import new games
+        # 5. Import new games as they stream in from Lichess, inserting and committing
+        # in batches so the full import is never held in memory. The total isn't
+        # known up front, so progress advances 5% per batch up to 80%.
+        fetched_count = 0
         new_games_count = 0
         skipped_count = 0
-        for idx, game_data in enumerate(parsed_games):
+        pending = []
+        for game_data in lichess_service.iter_parsed_games(
+            lichess_username,
+            from_year=from_year,
+            from_month=from_month,
+            to_year=to_year,
+            to_month=to_month
+        ):
+            fetched_count += 1
             lichess_id = game_data.get("lichess_id")
             
             # Skip if already imported
             if lichess_id and lichess_id in existing_ids:
                 skipped_count += 1
-                continue
-            
-            # Create game record
-            new_game = Game(
-                user_id=user_id,
-                **game_data
-            )
-            db.add(new_game)
-            new_games_count += 1
-            existing_ids.add(lichess_id)  # Add to set to prevent duplicates in same batch
+            else:
+                pending.append({"user_id": user_id, **game_data})
+                existing_ids.add(lichess_id)  # Add to set to prevent duplicates in same batch
             
-            # Update progress periodically
-            if idx % 10 == 0 or idx == len(parsed_games) - 1:
+            if fetched_count % LICHESS_IMPORT_BATCH_SIZE == 0:
+                if pending:
+                    db.execute(insert(Game), pending)
+                new_games_count += len(pending)
+                pending = []
+                job.total_games = fetched_count
                 job.imported_games = new_games_count
-                job.progress = 30 + int((idx / len(parsed_games)) * 50) if parsed_games else 30
+                job.progress = min(80, 10 + fetched_count // LICHESS_IMPORT_BATCH_SIZE * 5)
                 db.commit()
                 logger.debug(f"Lichess import progress: {new_games_count} new games imported, {skipped_count} skipped ({job.progress}%)")
         
-        db.commit()
+        if pending:
+            db.execute(insert(Game), pending)
+        new_games_count += len(pending)
+        job.total_games = fetched_count
+        logger.info(f"Fetched {fetched_count} games from Lichess.org for job {job_id}")
         
         job.imported_games = new_games_count
         job.progress = 85
@@ -501,12 +597,12 @@ def import_lichess_games_task(
         if user:
             user.last_import_at = datetime.utcnow()
             # Get most recent game rating
-            latest_game = db.query(Game).filter(
+            latest_rating = db.query(Game.user_rating).filter(
                 Game.user_id == user_id,
                 Game.user_rating.isnot(None)
-            ).order_by(Game.date_played.desc()).first()
-            if latest_game:
-                user.current_rating = latest_game.user_rating
+            ).order_by(Game.date_played.desc()).limit(1).scalar()
+            if latest_rating is not None:
+                user.current_rating = latest_rating
             db.commit()
             logger.debug(f"Updated user {user_id} last_import_at and current_rating")
         
@@ -0,0 +1,12 @@
+-- Migration: Add coach commentary cache table
+-- Stores generated coach commentary keyed by a hash of (position, move, classification, model)
+
+CREATE TABLE IF NOT EXISTS coach_commentary_cache (
+    id SERIAL PRIMARY KEY,
+    key_hash VARCHAR(40) NOT NULL,
+    model VARCHAR NOT NULL,
+    commentary TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_coach_cache_key_hash ON coach_commentary_cache(key_hash);
@@ -0,0 +1,5 @@
+-- Add fen_before column to moves table
+-- Stores the position before the move so puzzles don't need to replay the PGN
+-- Existing rows stay NULL and fall back to deriving the FEN from the game PGN
+
+ALTER TABLE moves ADD COLUMN IF NOT EXISTS fen_before VARCHAR(90);
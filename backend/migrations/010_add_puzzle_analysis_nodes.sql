@@ -0,0 +1,5 @@
+-- Add analysis_nodes column to puzzle_analysis_cache
+-- Puzzle analysis now uses a fixed node budget; rows computed with a different
+-- budget (or with the old depth/time limit, left NULL) are treated as uncached
+
+ALTER TABLE puzzle_analysis_cache ADD COLUMN IF NOT EXISTS analysis_nodes INTEGER;
@@ -0,0 +1,5 @@
+-- Store puzzle solutions as a native JSON array instead of JSON-encoded text
+-- Existing values are already valid JSON, so they cast directly
+
+ALTER TABLE puzzle_analysis_cache
+    ALTER COLUMN solution_uci_list TYPE JSON USING solution_uci_list::json;
@@ -0,0 +1,5 @@
+-- Add move_uci_list column to games table
+-- Stores the game's UCI moves at analysis time so puzzle positions can be
+-- rebuilt without parsing the PGN. NULL for custom start positions.
+
+ALTER TABLE games ADD COLUMN IF NOT EXISTS move_uci_list JSON;
@@ -0,0 +1,9 @@
+-- Composite indexes for the per-user filters used by stats and puzzles
+
+CREATE INDEX IF NOT EXISTS ix_games_user_result ON games(user_id, result);
+CREATE INDEX IF NOT EXISTS ix_games_user_color_result ON games(user_id, user_color, result);
+CREATE INDEX IF NOT EXISTS ix_games_user_analyzed ON games(user_id, is_analyzed);
+
+-- Partial index: puzzle candidates are the few moves that are mistakes/blunders with a best move
+CREATE INDEX IF NOT EXISTS ix_moves_puzzle_candidates ON moves(game_id)
+    WHERE classification IN ('mistake', 'blunder') AND best_move_uci IS NOT NULL;
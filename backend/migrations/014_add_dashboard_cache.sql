@@ -0,0 +1,6 @@
+-- Add dashboard cache columns to user_stats table
+-- Stores the serialized /stats/dashboard response so repeat requests within
+-- the TTL are a single row fetch. Cleared whenever user stats are recalculated.
+
+ALTER TABLE user_stats ADD COLUMN IF NOT EXISTS dashboard_cache JSON;
+ALTER TABLE user_stats ADD COLUMN IF NOT EXISTS dashboard_cache_updated_at TIMESTAMP;
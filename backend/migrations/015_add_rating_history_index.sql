@@ -0,0 +1,5 @@
+-- Covering index for rating history (user's rated games ordered by date)
+-- INCLUDE lets Postgres answer the query with an index-only scan
+
+CREATE INDEX IF NOT EXISTS ix_games_user_rating_date ON games(user_id, date_played)
+    INCLUDE (user_rating, result);
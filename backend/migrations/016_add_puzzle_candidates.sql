@@ -0,0 +1,30 @@
+-- Add puzzle_candidates table
+-- Narrow copy of the moves that qualify as puzzles (user mistakes/blunders with a
+-- best move, on the user's turn). Rows for a game are rebuilt when its analysis
+-- completes, so puzzle selection no longer joins moves and games.
+
+CREATE TABLE IF NOT EXISTS puzzle_candidates (
+    move_id INTEGER PRIMARY KEY REFERENCES moves(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    game_id INTEGER NOT NULL REFERENCES games(id) ON DELETE CASCADE,
+    half_move INTEGER NOT NULL,
+    fen_before VARCHAR(90),
+    best_move_uci VARCHAR NOT NULL,
+    classification VARCHAR NOT NULL,
+    user_color VARCHAR NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_puzzle_candidates_user ON puzzle_candidates(user_id);
+CREATE INDEX IF NOT EXISTS ix_puzzle_candidates_game ON puzzle_candidates(game_id);
+
+-- Backfill from games analyzed before this table existed
+INSERT INTO puzzle_candidates
+    (user_id, move_id, game_id, half_move, fen_before, best_move_uci, classification, user_color)
+SELECT g.user_id, m.id, m.game_id, m.half_move, m.fen_before, m.best_move_uci, m.classification, g.user_color
+FROM moves m
+JOIN games g ON g.id = m.game_id
+WHERE g.analysis_state = 'analyzed'
+  AND m.best_move_uci IS NOT NULL
+  AND m.classification IN ('mistake', 'blunder')
+  AND ((g.user_color = 'white' AND m.is_white) OR (g.user_color = 'black' AND NOT m.is_white))
+ON CONFLICT (move_id) DO NOTHING;
@@ -0,0 +1,6 @@
+-- Add analyzed_games to user_stats table
+-- Number of analyzed games behind avg_accuracy/avg_centipawn_loss, so a newly
+-- analyzed game can be folded into the averages without rescanning every game.
+-- Left NULL here; it is filled by the next full stats recalculation.
+
+ALTER TABLE user_stats ADD COLUMN IF NOT EXISTS analyzed_games INTEGER;
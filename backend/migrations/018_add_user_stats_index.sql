@@ -0,0 +1,7 @@
+-- Covering index for the user stats aggregate (every tally over a user's games)
+-- INCLUDE lets Postgres compute it with an index-only scan instead of reading
+-- each game row from the heap
+
+CREATE INDEX IF NOT EXISTS ix_games_user_stats ON games(user_id)
+    INCLUDE (result, user_color, is_analyzed, accuracy, average_centipawn_loss,
+             num_blunders, num_mistakes, num_inaccuracies);
@@ -0,0 +1,6 @@
+-- Partial index over running analysis jobs
+-- Each finished game updates the user's processing jobs, and starting or
+-- cancelling a job looks up the active one; completed jobs never match
+
+CREATE INDEX IF NOT EXISTS ix_analysis_jobs_user_active ON analysis_jobs(user_id)
+    WHERE status IN ('pending', 'processing');
@@ -0,0 +1,8 @@
+-- Partial indexes over each user's platform game ids
+-- Imports load the ids of a user's existing games to skip duplicates; these
+-- let Postgres answer that with an index-only scan
+
+CREATE INDEX IF NOT EXISTS ix_games_user_chess_com_id ON games(user_id, chess_com_id)
+    WHERE chess_com_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_games_user_lichess_id ON games(user_id, lichess_id)
+    WHERE lichess_id IS NOT NULL;
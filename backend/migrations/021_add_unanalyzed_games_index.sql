@@ -0,0 +1,6 @@
+-- Partial index for batch analysis: a user's games that still need analysis,
+-- newest first. Built CONCURRENTLY so imports keep writing to games meanwhile
+-- (run outside a transaction block).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_games_user_unanalyzed_date ON games(user_id, date_played)
+    WHERE analysis_state <> 'analyzed';
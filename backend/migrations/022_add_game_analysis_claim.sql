@@ -0,0 +1,6 @@
+-- Add analysis_claimed_at column to games table
+-- Set by the analysis task that is running Stockfish on the game and cleared when
+-- it finishes, so redelivered copies of the task skip a game that is already being
+-- analyzed. A claim older than the task's claim timeout is treated as abandoned.
+
+ALTER TABLE games ADD COLUMN IF NOT EXISTS analysis_claimed_at TIMESTAMP;
@@ -0,0 +1,5 @@
+-- Drop move_uci_list column from games table
+-- Positions are stored on each move (fen_before) at analysis time, so the
+-- game-level UCI list added in 012 was never needed to rebuild them.
+
+ALTER TABLE games DROP COLUMN IF EXISTS move_uci_list;
@@ -0,0 +1,8 @@
+-- Drop game indexes that others already cover
+-- ix_games_user_date has the same key as the covering ix_games_user_rating_date
+-- (015), and nothing filters on (user_id, user_color, result) that
+-- ix_games_user_stats (018) doesn't serve. Dropped CONCURRENTLY so imports keep
+-- writing to games meanwhile (run outside a transaction block).
+
+DROP INDEX CONCURRENTLY IF EXISTS ix_games_user_date;
+DROP INDEX CONCURRENTLY IF EXISTS ix_games_user_color_result;
@@ -21,6 +21,9 @@ if __name__ == "__main__":
             "-m",
             "pytest",
             "tests/test_analysis_service_performance.py",
+            # Include the slow long-game benchmark, skipped in regular test runs
+            "-m",
+            "slow or not slow",
             "-v",
             "-s",
             "--tb=short"
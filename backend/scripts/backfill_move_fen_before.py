@@ -0,0 +1,143 @@
+"""
+Script to backfill Move.fen_before for moves analyzed before the column existed.
+This will:
+- Find analyzed games that still have moves with no fen_before
+- Replay each game once (from stored UCI moves when available, else the PGN)
+- Store the position before each move on its Move row
+
+Usage:
+    cd backend
+    python -m scripts.backfill_move_fen_before
+    or
+    python scripts/backfill_move_fen_before.py
+    or from Docker:
+    docker compose exec api python scripts/backfill_move_fen_before.py
+"""
+
+import sys
+import os
+from io import StringIO
+from pathlib import Path
+
+# Add the backend directory to the path so we can import app modules
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+# Load environment variables from .env file if it exists
+from dotenv import load_dotenv
+env_path = Path(backend_dir) / ".env"
+if env_path.exists():
+    load_dotenv(env_path)
+else:
+    # Try loading from parent directory (for Docker)
+    parent_env = Path(backend_dir).parent / ".env"
+    if parent_env.exists():
+        load_dotenv(parent_env)
+
+import chess
+import chess.pgn
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.orm import sessionmaker
+from app.models import Game, Move
+
+# Get DATABASE_URL from environment (required)
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    print("❌ Error: DATABASE_URL environment variable is required")
+    print("   Make sure you have a .env file or environment variables set")
+    sys.exit(1)
+
+# Create database connection directly (bypassing app.config)
+engine = create_engine(DATABASE_URL, poolclass=NullPool)  # one-shot script, no pool to keep warm
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def replay_fens(game: Game):
+    """Return the FEN before every ply of the game, or None if it can't be replayed"""
+    parsed = chess.pgn.read_game(StringIO(game.pgn or ""))
+    if not parsed:
+        return None
+    board = parsed.board()
+    moves = list(parsed.mainline_moves())
+
+    fens = []
+    for move in moves:
+        fens.append(board.fen())
+        board.push(move)
+    return fens
+
+
+def backfill_fen_before(batch_size: int = 100):
+    """
+    Fill in fen_before for every move that is missing it.
+
+    Args:
+        batch_size: Number of games to update per commit
+    """
+    from sqlalchemy.orm import Session
+    db: Session = SessionLocal()
+
+    try:
+        game_ids = [
+            game_id for (game_id,) in db.query(Move.game_id).filter(
+                Move.fen_before.is_(None)
+            ).distinct().order_by(Move.game_id).all()
+        ]
+        print(f"Found {len(game_ids)} games with moves missing fen_before...")
+
+        updated_moves = 0
+        skipped_games = 0
+        for i, game_id in enumerate(game_ids, start=1):
+            game = db.query(Game).filter(Game.id == game_id).first()
+            try:
+                fens = replay_fens(game) if game else None
+            except ValueError:
+                fens = None
+            if fens is None:
+                skipped_games += 1
+                continue
+
+            moves = db.query(Move).filter(
+                Move.game_id == game_id,
+                Move.fen_before.is_(None)
+            ).all()
+            for move in moves:
+                if 0 <= move.half_move < len(fens):
+                    move.fen_before = fens[move.half_move]
+                    updated_moves += 1
+
+            if i % batch_size == 0:
+                db.commit()
+                print(f"  ...{i}/{len(game_ids)} games processed")
+
+        db.commit()
+
+        print("\n✅ Backfill completed successfully!")
+        print(f"   - Updated {updated_moves} move records")
+        if skipped_games:
+            print(f"   - Skipped {skipped_games} games whose moves could not be replayed")
+
+    except Exception as e:
+        db.rollback()
+        print(f"\n❌ Error during backfill: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Backfill fen_before on analyzed moves")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Number of games to update per commit (default: 100)"
+    )
+
+    args = parser.parse_args()
+
+    backfill_fen_before(batch_size=args.batch_size)
@@ -1,7 +1,7 @@
 """
 Script to clear all game analyses from the database.
 This will:
-- Delete all Move records (analysis data)
+- Delete all Move records (analysis data) and the puzzle data built from them
 - Reset all Game analysis fields to unanalyzed state
 - Optionally reset UserStats analysis fields
 - Optionally clear AnalysisJob records
@@ -34,9 +34,10 @@ else:
     if parent_env.exists():
         load_dotenv(parent_env)
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text, update
+from sqlalchemy.pool import NullPool
 from sqlalchemy.orm import sessionmaker
-from app.models import Game, Move, UserStats, AnalysisJob
+from app.models import Game, Move, UserStats, AnalysisJob, PuzzleAnalysisCache, PuzzleCandidate
 
 # Get DATABASE_URL from environment (required)
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -46,7 +47,7 @@ if not DATABASE_URL:
     sys.exit(1)
 
 # Create database connection directly (bypassing app.config)
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = create_engine(DATABASE_URL, poolclass=NullPool)  # one-shot script, no pool to keep warm
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def clear_all_analyses(reset_stats: bool = True, clear_jobs: bool = True):
@@ -66,24 +67,31 @@ def clear_all_analyses(reset_stats: bool = True, clear_jobs: bool = True):
         # 1. Delete all Move records (contains analysis data)
         moves_count = db.query(Move).count()
         print(f"Deleting {moves_count} move records...")
-        db.query(Move).delete()
+        if db.get_bind().dialect.name == "postgresql":
+            # Also empties the puzzle tables built from these moves
+            db.execute(text("TRUNCATE moves RESTART IDENTITY CASCADE"))
+        else:
+            db.query(PuzzleAnalysisCache).delete()
+            db.query(PuzzleCandidate).delete()
+            db.query(Move).delete()
         
-        # 2. Reset all Game analysis fields
-        games_to_reset = db.query(Game).filter(
-            Game.analysis_state.in_(["in_progress", "analyzed"])
-        ).all()
-        
-        print(f"Resetting {len(games_to_reset)} games...")
-        for game in games_to_reset:
-            game.analysis_state = "unanalyzed"
-            game.is_analyzed = False
-            game.average_centipawn_loss = None
-            game.accuracy = None
-            game.num_moves = None
-            game.num_blunders = 0
-            game.num_mistakes = 0
-            game.num_inaccuracies = 0
-            game.analyzed_at = None
+        # 2. Reset all Game analysis fields in one UPDATE
+        games_reset = db.execute(
+            update(Game)
+            .where(Game.analysis_state.in_(["in_progress", "analyzed"]))
+            .values(
+                analysis_state="unanalyzed",
+                is_analyzed=False,
+                average_centipawn_loss=None,
+                accuracy=None,
+                num_moves=None,
+                num_blunders=0,
+                num_mistakes=0,
+                num_inaccuracies=0,
+                analyzed_at=None,
+            )
+        ).rowcount
+        print(f"Reset {games_reset} games...")
         
         # 3. Reset UserStats analysis fields (optional)
         if reset_stats:
@@ -95,7 +103,11 @@ def clear_all_analyses(reset_stats: bool = True, clear_jobs: bool = True):
                 "total_blunders": 0,
                 "total_mistakes": 0,
                 "total_inaccuracies": 0,
+                "analyzed_games": 0,
             })
+        else:
+            # Stats now count analyses that are gone; make the next analysis recompute them
+            db.query(UserStats).update({"analyzed_games": None})
         
         # 4. Clear AnalysisJob records (optional)
         if clear_jobs:
@@ -108,7 +120,7 @@ def clear_all_analyses(reset_stats: bool = True, clear_jobs: bool = True):
         
         print("\n✅ Analysis cleanup completed successfully!")
         print(f"   - Deleted {moves_count} move records")
-        print(f"   - Reset {len(games_to_reset)} games to 'unanalyzed'")
+        print(f"   - Reset {games_reset} games to 'unanalyzed'")
         if reset_stats:
             print(f"   - Reset analysis stats for all users")
         if clear_jobs:
@@ -37,9 +37,10 @@ else:
     if parent_env.exists():
         load_dotenv(parent_env)
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
 from sqlalchemy.orm import sessionmaker
-from app.models import Game, Move, User, UserStats, ImportJob, AnalysisJob
+from app.models import Game, Move, User, UserStats, ImportJob, AnalysisJob, PuzzleAnalysisCache, PuzzleCandidate
 
 # Get DATABASE_URL from environment (required)
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -49,10 +50,66 @@ if not DATABASE_URL:
     sys.exit(1)
 
 # Create database connection directly (bypassing app.config)
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = create_engine(DATABASE_URL, poolclass=NullPool)  # one-shot script, no pool to keep warm
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+# Every row hanging off a user's games, deleted in one statement. Data-modifying
+# CTEs share one snapshot and foreign keys are checked at the end of the statement,
+# so the order of the CTEs does not matter.
+DELETE_USER_GAMES_SQL = text("""
+    WITH
+        deleted_puzzle_cache AS (
+            DELETE FROM puzzle_analysis_cache
+            WHERE game_id IN (SELECT id FROM games WHERE user_id = :user_id)
+        ),
+        deleted_puzzle_candidates AS (
+            DELETE FROM puzzle_candidates WHERE user_id = :user_id
+        ),
+        deleted_moves AS (
+            DELETE FROM moves USING games
+            WHERE moves.game_id = games.id AND games.user_id = :user_id
+            RETURNING 1
+        ),
+        deleted_games AS (
+            DELETE FROM games WHERE user_id = :user_id RETURNING 1
+        ),
+        deleted_import_jobs AS (
+            DELETE FROM import_jobs WHERE user_id = :user_id RETURNING 1
+        ),
+        deleted_analysis_jobs AS (
+            DELETE FROM analysis_jobs WHERE user_id = :user_id RETURNING 1
+        )
+    SELECT
+        (SELECT count(*) FROM deleted_moves),
+        (SELECT count(*) FROM deleted_games),
+        (SELECT count(*) FROM deleted_import_jobs),
+        (SELECT count(*) FROM deleted_analysis_jobs)
+""")
+
+
+def delete_user_rows(db, user_id: int):
+    """
+    Delete a user's games with their moves, puzzle data and jobs.
+    
+    Returns:
+        (moves, games, import jobs, analysis jobs) deleted
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return tuple(db.execute(DELETE_USER_GAMES_SQL, {"user_id": user_id}).one())
+    
+    game_ids = db.query(Game.id).filter(Game.user_id == user_id)
+    db.query(PuzzleAnalysisCache).filter(
+        PuzzleAnalysisCache.game_id.in_(game_ids)
+    ).delete(synchronize_session=False)
+    db.query(PuzzleCandidate).filter(PuzzleCandidate.user_id == user_id).delete(synchronize_session=False)
+    deleted_moves = db.query(Move).filter(Move.game_id.in_(game_ids)).delete(synchronize_session=False)
+    deleted_games = db.query(Game).filter(Game.user_id == user_id).delete(synchronize_session=False)
+    deleted_import_jobs = db.query(ImportJob).filter(ImportJob.user_id == user_id).delete(synchronize_session=False)
+    deleted_analysis_jobs = db.query(AnalysisJob).filter(AnalysisJob.user_id == user_id).delete(synchronize_session=False)
+    return deleted_moves, deleted_games, deleted_import_jobs, deleted_analysis_jobs
+
+
 def delete_user_games(user_identifier: str, confirm: bool = False):
     """
     Delete all games for a user by ID or username.
@@ -82,11 +139,8 @@ def delete_user_games(user_identifier: str, confirm: bool = False):
         
         # Count games to delete
         game_count = db.query(Game).filter(Game.user_id == user.id).count()
-        move_count = db.query(Move).join(Game).filter(Game.user_id == user.id).count()
         
-        print(f"\n📊 Games to delete:")
-        print(f"   - Games: {game_count}")
-        print(f"   - Moves (analysis data): {move_count}")
+        print(f"\n📊 Games to delete: {game_count}")
         
         if game_count == 0:
             print("✅ No games to delete!")
@@ -100,22 +154,10 @@ def delete_user_games(user_identifier: str, confirm: bool = False):
                 print("❌ Deletion cancelled.")
                 return False
         
-        # Delete moves first (to satisfy foreign key constraints)
-        print(f"\n🗑️  Deleting moves (analysis data)...")
-        # Delete moves for all games owned by this user using a subquery
-        deleted_moves = db.query(Move).filter(
-            Move.game_id.in_(db.query(Game.id).filter(Game.user_id == user.id))
-        ).delete(synchronize_session=False)
+        print(f"\n🗑️  Deleting games and their analysis data...")
+        deleted_moves, deleted_games, deleted_import_jobs, deleted_analysis_jobs = delete_user_rows(db, user.id)
         print(f"   ✅ Deleted {deleted_moves} move records")
-        
-        # Now delete games
-        print(f"🗑️  Deleting games...")
-        deleted_games = db.query(Game).filter(Game.user_id == user.id).delete()
         print(f"   ✅ Deleted {deleted_games} games")
-        
-        # Delete import and analysis jobs
-        deleted_import_jobs = db.query(ImportJob).filter(ImportJob.user_id == user.id).delete()
-        deleted_analysis_jobs = db.query(AnalysisJob).filter(AnalysisJob.user_id == user.id).delete()
         print(f"   ✅ Deleted {deleted_import_jobs} import jobs")
         print(f"   ✅ Deleted {deleted_analysis_jobs} analysis jobs")
         
@@ -132,7 +174,13 @@ def delete_user_games(user_identifier: str, confirm: bool = False):
             user_stats.black_games = 0
             user_stats.black_wins = 0
             user_stats.avg_accuracy = None
-            user_stats.total_analyzed_games = 0
+            user_stats.avg_centipawn_loss = None
+            user_stats.total_blunders = 0
+            user_stats.total_mistakes = 0
+            user_stats.total_inaccuracies = 0
+            user_stats.analyzed_games = 0
+            user_stats.dashboard_cache = None
+            user_stats.dashboard_cache_updated_at = None
             print(f"   ✅ Reset user stats")
         
         # Reset user import tracking
@@ -45,9 +45,8 @@ async def main():
     game = chess.pgn.read_game(pgn_io)
     board = game.board()
 
-    moves = list(game.mainline_moves())
     all_positions = [board.copy()]  # positions[i] = board state before move i
-    for move in moves:
+    for move in game.mainline_moves():
         board.push(move)
         all_positions.append(board.copy())
 
@@ -1,27 +1,96 @@
+import asyncio
 import os
 import pytest
+import pytest_asyncio
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 # Set test environment before importing app modules that load settings
 os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
 os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
 os.environ.setdefault("CHESS_COM_USER_AGENT", "ChessAnalyticsTest/1.0")
 os.environ.setdefault("STOCKFISH_PATH", "/usr/games/stockfish")
+# Engine processes per event loop; concurrent analysis tests run this many games at once
+os.environ.setdefault("STOCKFISH_POOL_SIZE", "3")
+# Don't read or write engine evaluations cached in a real Redis; tests of the
+# position cache opt back in
+os.environ.setdefault("STOCKFISH_EVAL_CACHE_TTL_SECONDS", "0")
 
 try:
     from app.database import Base
+    from app.services import position_cache
+    from app.services.analysis_service import AnalysisService
 except ImportError:
     from backend.app.database import Base
+    from backend.app.services import position_cache
+    from backend.app.services.analysis_service import AnalysisService
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: long-running benchmark, only run when selected with -m slow")
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip tests marked slow unless the -m expression asks for them"""
+    if "slow" in (config.getoption("-m") or ""):
+        return
+    skip_slow = pytest.mark.skip(reason="slow benchmark, run with -m slow")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
 
 
 @pytest.fixture(scope="session")
 def engine():
-    engine = create_engine("sqlite:///:memory:")
+    # One shared connection, so every session sees the same in-memory database and schema
+    engine = create_engine(
+        "sqlite:///:memory:",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False}
+    )
     Base.metadata.create_all(bind=engine)
     return engine
 
 
+@pytest.fixture(scope="session")
+def analysis_service():
+    """One AnalysisService shared by every test; it holds no per-game state"""
+    return AnalysisService()
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    """One event loop for the session, so pooled engines bound to it outlive a single test"""
+    try:
+        # libuv loop (installed with uvicorn[standard]) wakes up faster on engine pipe reads
+        import uvloop
+        loop = uvloop.new_event_loop()
+    except ImportError:
+        loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest_asyncio.fixture(scope="session")
+async def warm_engine_pool(analysis_service):
+    """Start the shared Stockfish processes once for every test that opts in"""
+    try:
+        await analysis_service.engine_pool.prewarm()
+    except OSError:
+        pass  # No engine binary; the tests report the analysis error themselves
+    yield analysis_service.engine_pool
+    await analysis_service.engine_pool.close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_local_eval_cache():
+    """Each test starts without evaluations remembered in memory by an earlier one"""
+    position_cache.clear_local()
+    yield
+    position_cache.clear_local()
+
+
 @pytest.fixture(scope="function")
 def db_session(engine):
     SessionLocal = sessionmaker(bind=engine)
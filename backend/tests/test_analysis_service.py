@@ -1,10 +1,15 @@
 import pytest
 import chess
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
 from backend.app.services.analysis_service import AnalysisService
 
+# Parsed once; fake engines return it as their principal variation
+E2E4 = chess.Move.from_uci("e2e4")
 
-def test_parse_pgn_and_detect_opening(sample_pgn):
-    svc = AnalysisService()
+
+def test_parse_pgn_and_detect_opening(sample_pgn, analysis_service):
+    svc = analysis_service
     game = svc.parse_pgn(sample_pgn)
     assert game is not None
     eco, opening, ply = svc.detect_opening(sample_pgn)
@@ -13,8 +18,8 @@ def test_parse_pgn_and_detect_opening(sample_pgn):
     assert ply > 0
 
 
-def test_classify_move_various_cases():
-    svc = AnalysisService()
+def test_classify_move_various_cases(analysis_service):
+    svc = analysis_service
     # Near-perfect move
     assert svc.classify_move(5) == "best"
     # accuracy style
@@ -27,13 +32,25 @@ def test_classify_move_various_cases():
     assert svc.classify_move(200, eval_before=2.6, eval_after=0.8) == "mistake"
 
 
-def test_get_evaluation_cp_cp_and_mate():
-    svc = AnalysisService()
+def test_classify_move_threshold_boundaries(analysis_service):
+    svc = analysis_service
+    # Each threshold is inclusive and applies to the absolute loss
+    assert svc.classify_move(10) == "best"
+    assert svc.classify_move(-10) == "best"
+    assert svc.classify_move(10.5) == "excellent"
+    assert svc.classify_move(25) == "excellent"
+    assert svc.classify_move(50) == "good"
+    assert svc.classify_move(150) == "mistake"
+    assert svc.classify_move(300) == "blunder"
+    assert svc.classify_move(None) == "book"
+
+
+def test_get_evaluation_cp_cp_and_mate(analysis_service):
+    svc = analysis_service
 
     class FakeScore:
         def __init__(self, cp=None, mate=None):
-            self.relative = type("R", (), {})()
-            self.relative.cp = cp
+            self.relative = SimpleNamespace(cp=cp, mate=lambda: mate)
             self._mate = mate
 
         def is_mate(self):
@@ -56,27 +73,20 @@ def test_get_evaluation_cp_cp_and_mate():
     assert eval_cp == 123.0
 
     # Test mate evaluation
-    fake_mate = type("X", (), {})()
-    fake_mate.relative = type("R", (), {})()
-    fake_mate.relative.mate = lambda: 2
     info_mate = {"score": FakeScore(cp=None, mate=2)}
     eval_mate = svc.get_evaluation_cp(info_mate)
     assert eval_mate is not None
 
 
-def test_analyze_position_monkeypatched(monkeypatch):
-    svc = AnalysisService()
+@pytest.mark.asyncio
+async def test_analyze_position_monkeypatched(monkeypatch, analysis_service):
+    svc = analysis_service
 
     # Fake engine that returns a cp and pv
     class FakeScore:
         def __init__(self, cp=None, mate=None):
-            self.relative = type("R", (), {})()
-            self.relative.cp = cp
+            self.relative = SimpleNamespace(cp=cp, mate=lambda: mate)
             self._mate = mate
-            def mate_func():
-                return self._mate
-            # add a mate method on the nested object if mate is present
-            self.relative.mate = mate_func
         def is_mate(self):
             return self._mate is not None
 
@@ -86,17 +96,18 @@ def test_analyze_position_monkeypatched(monkeypatch):
 
         async def analyse(self, board, limit):
             self._calls += 1
-            return {"score": FakeScore(cp=100), "pv": [chess.Move.from_uci("e2e4")]} 
+            return {"score": FakeScore(cp=100), "pv": [E2E4]}
 
-        async def quit(self):
-            return
+    engine = FakeEngine()
 
-    async def fake_popen_uci(path):
-        return (None, FakeEngine())
+    # Lend the fake instead of a pooled Stockfish process
+    @asynccontextmanager
+    async def fake_acquire_engine():
+        yield engine
 
-    monkeypatch.setattr("chess.engine.popen_uci", fake_popen_uci)
+    monkeypatch.setattr(svc, "_acquire_engine", fake_acquire_engine)
 
-    import asyncio
-+    result = asyncio.run(svc.analyze_position("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"))
-+    assert "evaluation" in result
-+    assert "best_move" in result
+    result = await svc.analyze_position("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+    assert result["evaluation"] == 100.0
+    assert result["best_move"] == "e2e4"
+    assert engine._calls == 1
@@ -2,20 +2,54 @@
 Performance tests for AnalysisService
 
 Run with: pytest tests/test_analysis_service_performance.py -v -s
+Add -m "slow or not slow" to include the long-game benchmark.
 
 These tests measure the performance of key functions to track improvements.
 """
 import pytest
+import io
+import os
+import shutil
+import statistics
+import sys
 import time
+import timeit
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
 import chess
+import chess.pgn
+import chess.polyglot
 
 try:
+    from app.config import settings
     from app.services.analysis_service import AnalysisService
 except ImportError:
     # Fallback for local development
+    from backend.app.config import settings
     from backend.app.services.analysis_service import AnalysisService
 
+# Checked once at import; without the binary every engine test would fail the same way
+requires_stockfish = pytest.mark.skipif(
+    shutil.which(settings.STOCKFISH_PATH) is None,
+    reason=f"Stockfish not found at {settings.STOCKFISH_PATH}",
+)
+
+# Engine startup is paid once per session instead of inside the first timed call
+pytestmark = pytest.mark.usefixtures("warm_engine_pool")
+
+# Fixed work per position, so the engine timings measure throughput instead of a time cap
+BENCH_NODES = int(os.environ.get("STOCKFISH_BENCH_NODES", "200000"))
+
+
+@pytest.fixture(scope="module", autouse=True)
+def fixed_node_budget(analysis_service):
+    """Search BENCH_NODES per position for this module's tests"""
+    previous = analysis_service.nodes
+    analysis_service.nodes = BENCH_NODES
+    yield
+    analysis_service.nodes = previous
+
 
 # Sample PGN games of different lengths for testing
 SHORT_GAME_PGN = """[Event "Test"]
@@ -31,7 +65,10 @@ SHORT_GAME_PGN = """[Event "Test"]
 1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. Ba4 Nf6 5. O-O Be7 6. Re1 b5 7. Bb3 d6 8. c3 O-O 9. h3 Nb8 10. d4 Nbd7 1-0
 """
 
-MEDIUM_GAME_PGN = """[Event "Test"]
+# Moves shared by the medium and long games
+MIDDLEGAME_MOVES = "1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. Ba4 Nf6 5. O-O Be7 6. Re1 b5 7. Bb3 d6 8. c3 O-O 9. h3 Nb8 10. d4 Nbd7 11. c4 c6 12. cxb5 axb5 13. Nc3 Bb7 14. Bg5 b4 15. Nb1 h6 16. Bh4 c5 17. dxe5 Nxe4 18. Bxe7 Qxe7 19. exd6 Qf6 20. Nbd2 Nxd6 21. Nc4 Nxc4 22. Bxc4 Nb6 23. Ne5 Rae8 24. Bxf7+ Rxf7 25. Nxf7 Rxe1+ 26. Qxe1 Kxf7 27. Qe3 Qg5 28. Qxg5 hxg5 29. b3 Ke6 30. a3 Kd6 31. axb4 cxb4 32. Ra5 Nd5 33. f3 Bc8 34. Kf2 Bf5 35. Ra7 g6 36. Ra6+ Kc5 37. Ke1 Nf4 38. g3 Nxh3 39. Kd2 Kb5 40. Rd6 Kc5 41. Ra6 Nf2 42. g4 Bd3 43. Re6"
+
+MEDIUM_GAME_PGN = f"""[Event "Test"]
 [Site "Local"]
 [Date "2025.12.13"]
 [Round "1"]
@@ -40,10 +77,12 @@ MEDIUM_GAME_PGN = """[Event "Test"]
 [Result "1-0"]
 [ECO "C50"]
 
-1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. Ba4 Nf6 5. O-O Be7 6. Re1 b5 7. Bb3 d6 8. c3 O-O 9. h3 Nb8 10. d4 Nbd7 11. c4 c6 12. cxb5 axb5 13. Nc3 Bb7 14. Bg5 b4 15. Nb1 h6 16. Bh4 c5 17. dxe5 Nxe4 18. Bxe7 Qxe7 19. exd6 Qf6 20. Nbd2 Nxd6 21. Nc4 Nxc4 22. Bxc4 Nb6 23. Ne5 Rae8 24. Bxf7+ Rxf7 25. Nxf7 Rxe1+ 26. Qxe1 Kxf7 27. Qe3 Qg5 28. Qxg5 hxg5 29. b3 Ke6 30. a3 Kd6 31. axb4 cxb4 32. Ra5 Nd5 33. f3 Bc8 34. Kf2 Bf5 35. Ra7 g6 36. Ra6+ Kc5 37. Ke1 Nf4 38. g3 Nxh3 39. Kd2 Kb5 40. Rd6 Kc5 41. Ra6 Nf2 42. g4 Bd3 43. Re6 1-0
+{MIDDLEGAME_MOVES} 1-0
 """
 
-LONG_GAME_PGN = """[Event "Test"]
+# The medium game followed by a rook/king shuffle, so the same positions repeat
+# every four plies up to move 60
+LONG_GAME_PGN = f"""[Event "Test"]
 [Site "Local"]
 [Date "2025.12.13"]
 [Round "1"]
@@ -52,9 +91,14 @@ LONG_GAME_PGN = """[Event "Test"]
 [Result "1/2-1/2"]
 [ECO "C50"]
 
-1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. Ba4 Nf6 5. O-O Be7 6. Re1 b5 7. Bb3 d6 8. c3 O-O 9. h3 Nb8 10. d4 Nbd7 11. c4 c6 12. cxb5 axb5 13. Nc3 Bb7 14. Bg5 b4 15. Nb1 h6 16. Bh4 c5 17. dxe5 Nxe4 18. Bxe7 Qxe7 19. exd6 Qf6 20. Nbd2 Nxd6 21. Nc4 Nxc4 22. Bxc4 Nb6 23. Ne5 Rae8 24. Bxf7+ Rxf7 25. Nxf7 Rxe1+ 26. Qxe1 Kxf7 27. Qe3 Qg5 28. Qxg5 hxg5 29. b3 Ke6 30. a3 Kd6 31. axb4 cxb4 32. Ra5 Nd5 33. f3 Bc8 34. Kf2 Bf5 35. Ra7 g6 36. Ra6+ Kc5 37. Ke1 Nf4 38. g3 Nxh3 39. Kd2 Kb5 40. Rd6 Kc5 41. Ra6 Nf2 42. g4 Bd3 43. Re6 Kd5 44. Rb6 Kc5 45. Ra6 Kd5 46. Rb6 Kc5 47. Ra6 Kd5 48. Rb6 Kc5 49. Ra6 Kd5 50. Rb6 Kc5 51. Ra6 Kd5 52. Rb6 Kc5 53. Ra6 Kd5 54. Rb6 Kc5 55. Ra6 Kd5 56. Rb6 Kc5 57. Ra6 Kd5 58. Rb6 Kc5 59. Ra6 Kd5 60. Rb6 Kc5 1/2-1/2
+{MIDDLEGAME_MOVES} Kd5 {" ".join(f"{m}. Rb6 Kc5 {m + 1}. Ra6 Kd5" for m in range(44, 60, 2))} 60. Rb6 Kc5 1/2-1/2
 """
 
+# Parsed once at import for the tests that only need the moves; analyze_game still takes the PGN text
+SHORT_GAME = chess.pgn.read_game(io.StringIO(SHORT_GAME_PGN))
+MEDIUM_GAME = chess.pgn.read_game(io.StringIO(MEDIUM_GAME_PGN))
+LONG_GAME = chess.pgn.read_game(io.StringIO(LONG_GAME_PGN))
+
 
 class PerformanceTimer:
     """Helper class to measure and report performance metrics"""
@@ -77,20 +121,62 @@ class PerformanceTimer:
         return self.elapsed if self.elapsed else time.perf_counter() - self.start_time
 
 
-def count_moves(pgn: str) -> int:
-    """Count the number of moves in a PGN"""
-    service = AnalysisService()
-    game = service.parse_pgn(pgn)
-    if not game:
-        return 0
-    return len(list(game.mainline()))
+def mainline_length(game: chess.pgn.Game) -> int:
+    """Count mainline moves by following first variations, without building a list"""
+    count = 0
+    node = game.next()
+    while node is not None:
+        count += 1
+        node = node.next()
+    return count
+
+
+def benchmark(name: str, fn, *args, rounds: int = 5) -> List[float]:
+    """
+    Time fn(*args) like pytest-benchmark would: a calibration run warms it up and picks
+    how many calls make a round, then each round is timed with GC off
+
+    Returns:
+        Seconds per call for each round
+    """
+    timer = timeit.Timer(lambda: fn(*args))
+    number, _ = timer.autorange()
+    per_call = [elapsed / number for elapsed in timer.repeat(repeat=rounds, number=number)]
+    print(
+        f"⏱️  {name}: min {min(per_call)*1000000:.2f} / median {statistics.median(per_call)*1000000:.2f} "
+        f"/ stdev {statistics.stdev(per_call)*1000000:.2f} microseconds ({rounds} rounds of {number} calls)"
+    )
+    return per_call
+
 
+def print_node_rate(service: AnalysisService, positions: int, elapsed: float) -> None:
+    """Report engine throughput, assuming every position was searched (no cache hits)"""
+    if service.nodes and elapsed > 0:
+        print(f"🔢 Nodes/second: {positions * service.nodes / elapsed:,.0f} ({service.nodes:,} nodes x {positions} positions)")
 
+
+def distinct_positions(game: chess.pgn.Game) -> int:
+    """Number of different positions (by Zobrist hash) reached in the game, including the start"""
+    board = game.board()
+    seen = {chess.polyglot.zobrist_hash(board)}
+    for move in game.mainline_moves():
+        board.push(move)
+        seen.add(chess.polyglot.zobrist_hash(board))
+    return len(seen)
+
+
+def count_mainline_moves(pgn: str) -> int:
+    """Parse a PGN and count its moves (module level so worker processes can run it)"""
+    game = chess.pgn.read_game(io.StringIO(pgn))
+    return mainline_length(game) if game else 0
+
+
+@requires_stockfish
 @pytest.mark.asyncio
-async def test_analyze_game_short_performance():
+async def test_analyze_game_short_performance(analysis_service):
     """Test performance of analyze_game on a short game (~10 moves)"""
-    service = AnalysisService()
-    moves = count_moves(SHORT_GAME_PGN)
+    service = analysis_service
+    moves = mainline_length(SHORT_GAME)
     
     print(f"\n{'='*60}")
     print(f"Testing SHORT GAME ({moves} moves)")
@@ -105,6 +191,7 @@ async def test_analyze_game_short_performance():
     print(f"⏱️  Total time: {elapsed:.2f} seconds")
     print(f"📊 Moves analyzed: {moves_analyzed}")
     print(f"⚡ Time per move: {elapsed/moves_analyzed:.3f} seconds" if moves_analyzed > 0 else "N/A")
+    print_node_rate(service, moves + 1, elapsed)
     print(f"✅ Success: {result.get('error') is None}")
     
     assert result.get("error") is None
@@ -112,16 +199,31 @@ async def test_analyze_game_short_performance():
     assert moves_analyzed > 0
 
 
+@requires_stockfish
 @pytest.mark.asyncio
-async def test_analyze_game_medium_performance():
+async def test_analyze_game_medium_performance(analysis_service, monkeypatch):
     """Test performance of analyze_game on a medium game (~40 moves)"""
-    service = AnalysisService()
-    moves = count_moves(MEDIUM_GAME_PGN)
+    service = analysis_service
+    moves = mainline_length(MEDIUM_GAME)
     
     print(f"\n{'='*60}")
     print(f"Testing MEDIUM GAME ({moves} moves)")
     print(f"{'='*60}")
     
+    # Count engine searches, with the Redis evaluation cache out of the picture
+    engine_calls = 0
+    original_analyse = chess.engine.UciProtocol.analyse
+    
+    async def counting_analyse(self, *args, **kwargs):
+        nonlocal engine_calls
+        engine_calls += 1
+        return await original_analyse(self, *args, **kwargs)
+    
+    position_cache = sys.modules[type(service).__module__].position_cache
+    monkeypatch.setattr(chess.engine.UciProtocol, "analyse", counting_analyse)
+    monkeypatch.setattr(position_cache, "get_many", lambda keys: {})
+    monkeypatch.setattr(position_cache, "set_many", lambda evaluations: None)
+    
     with PerformanceTimer("analyze_game (medium)") as timer:
         result = await service.analyze_game(MEDIUM_GAME_PGN, "white")
     
@@ -131,21 +233,26 @@ async def test_analyze_game_medium_performance():
     print(f"⏱️  Total time: {elapsed:.2f} seconds")
     print(f"📊 Moves analyzed: {moves_analyzed}")
     print(f"⚡ Time per move: {elapsed/moves_analyzed:.3f} seconds" if moves_analyzed > 0 else "N/A")
+    print_node_rate(service, moves + 1, elapsed)
     print(f"✅ Success: {result.get('error') is None}")
     
-    # Calculate expected engine calls (2 per move: before + after)
-    expected_calls = moves_analyzed * 2
-    print(f"🔍 Expected engine calls: ~{expected_calls} (2 per move)")
+    # One search per distinct position: evaluations are shared between consecutive
+    # moves and repeated positions are not searched again
+    expected_calls = distinct_positions(MEDIUM_GAME)
+    print(f"🔍 Engine calls: {engine_calls} (expected {expected_calls}, {moves + 1} positions)")
     
     assert result.get("error") is None
     assert moves_analyzed > 0
+    assert engine_calls == expected_calls
 
 
+@requires_stockfish
+@pytest.mark.slow
 @pytest.mark.asyncio
-async def test_analyze_game_long_performance():
+async def test_analyze_game_long_performance(analysis_service):
     """Test performance of analyze_game on a long game (~60 moves)"""
-    service = AnalysisService()
-    moves = count_moves(LONG_GAME_PGN)
+    service = analysis_service
+    moves = mainline_length(LONG_GAME)
     
     print(f"\n{'='*60}")
     print(f"Testing LONG GAME ({moves} moves)")
@@ -160,15 +267,45 @@ async def test_analyze_game_long_performance():
     print(f"⏱️  Total time: {elapsed:.2f} seconds")
     print(f"📊 Moves analyzed: {moves_analyzed}")
     print(f"⚡ Time per move: {elapsed/moves_analyzed:.3f} seconds" if moves_analyzed > 0 else "N/A")
+    print_node_rate(service, moves + 1, elapsed)
     print(f"✅ Success: {result.get('error') is None}")
     
     assert result.get("error") is None
     assert moves_analyzed > 0
 
 
-def test_classify_move_performance():
+@requires_stockfish
+@pytest.mark.asyncio
+async def test_analyze_games_concurrent(analysis_service):
+    """Analyze the short, medium and long games at once on the shared engine pool"""
+    service = analysis_service
+    games = [SHORT_GAME_PGN, MEDIUM_GAME_PGN, LONG_GAME_PGN]
+    move_counts = [mainline_length(game) for game in (SHORT_GAME, MEDIUM_GAME, LONG_GAME)]
+    
+    print(f"\n{'='*60}")
+    print(f"Testing {len(games)} games concurrently ({service.engine_pool.size} pooled engines)")
+    print(f"{'='*60}")
+    
+    # Each game holds one pooled engine while it runs; the pool size caps concurrency
+    with PerformanceTimer("analyze_game (concurrent)") as timer:
+        results = await asyncio.gather(*(service.analyze_game(pgn, "white") for pgn in games))
+    
+    elapsed = timer.get_elapsed()
+    moves_analyzed = sum(len(result.get("moves", [])) for result in results)
+    
+    print(f"⏱️  Total time: {elapsed:.2f} seconds")
+    print(f"📊 Moves analyzed: {moves_analyzed}")
+    print(f"⚡ Time per move: {elapsed/moves_analyzed:.3f} seconds" if moves_analyzed > 0 else "N/A")
+    print_node_rate(service, sum(count + 1 for count in move_counts), elapsed)
+    
+    for count, result in zip(move_counts, results):
+        assert result.get("error") is None
+        assert len(result.get("moves", [])) == count
+
+
+def test_classify_move_performance(analysis_service):
     """Test performance of classify_move function (should be very fast)"""
-    service = AnalysisService()
+    service = analysis_service
     
     print(f"\n{'='*60}")
     print(f"Testing classify_move performance")
@@ -181,47 +318,73 @@ def test_classify_move_performance():
         (200, 2.6, 0.8, "mistake"),
         (350, 0.0, -3.5, "blunder"),
     ]
-    
-    with PerformanceTimer("classify_move (1000 calls)") as timer:
-        for _ in range(1000):
-            for cp_loss, eval_before, eval_after, expected in test_cases:
-                result = service.classify_move(cp_loss, eval_before, eval_after)
-                assert result == expected
-    
-    elapsed = timer.get_elapsed()
-    calls = len(test_cases) * 1000
-    
-    print(f"⏱️  Total time: {elapsed:.4f} seconds")
-    print(f"📊 Total calls: {calls}")
-    print(f"⚡ Time per call: {(elapsed/calls)*1000000:.2f} microseconds")
-    print(f"✅ Performance: {'EXCELLENT' if elapsed < 0.1 else 'GOOD' if elapsed < 1.0 else 'SLOW'}")
+    for cp_loss, eval_before, eval_after, expected in test_cases:
+        assert service.classify_move(cp_loss, eval_before, eval_after) == expected
+    
+    def classify_all():
+        for cp_loss, eval_before, eval_after, _ in test_cases:
+            service.classify_move(cp_loss, eval_before, eval_after)
+    
+    # Same loop calling a method that does nothing, so the interpreter's call and
+    # loop overhead can be told apart from the time spent classifying
+    class NoopService:
+        def classify_move(self, cp_loss, eval_before=None, eval_after=None):
+            return None
+    
+    noop = NoopService()
+    
+    def call_noop():
+        for cp_loss, eval_before, eval_after, _ in test_cases:
+            noop.classify_move(cp_loss, eval_before, eval_after)
+    
+    calls = len(test_cases)
+    per_round = benchmark(f"classify_move ({calls} cases)", classify_all)
+    overhead = benchmark(f"no-op method ({calls} cases)", call_noop)
+    
+    median = statistics.median(per_round) / calls
+    print(f"⚡ Time per call: {median*1000000:.2f} microseconds")
+    print(f"🐍 Call overhead: {statistics.median(overhead)/calls*1000000:.2f} microseconds per call")
+    print(f"🔍 Classifier cost: {max(median - statistics.median(overhead)/calls, 0.0)*1000000:.2f} microseconds per call")
+    print(f"✅ Performance: {'EXCELLENT' if median < 20e-6 else 'GOOD' if median < 200e-6 else 'SLOW'}")
 
 
-def test_parse_pgn_performance():
+def test_parse_pgn_performance(analysis_service):
     """Test performance of parse_pgn function"""
-    service = AnalysisService()
+    service = analysis_service
     
     print(f"\n{'='*60}")
     print(f"Testing parse_pgn performance")
     print(f"{'='*60}")
     
-    with PerformanceTimer("parse_pgn (1000 calls)") as timer:
-        for _ in range(1000):
-            game = service.parse_pgn(MEDIUM_GAME_PGN)
-            assert game is not None
+    assert service.parse_pgn(MEDIUM_GAME_PGN) is not None
+    median = statistics.median(benchmark("parse_pgn", service.parse_pgn, MEDIUM_GAME_PGN))
+    print(f"✅ Performance: {'EXCELLENT' if median < 1e-3 else 'GOOD' if median < 5e-3 else 'SLOW'}")
     
-    elapsed = timer.get_elapsed()
+    # Same parse from one buffer rewound each time, without building a StringIO per call
+    buffer = io.StringIO(MEDIUM_GAME_PGN)
+    
+    def read_rewound():
+        buffer.seek(0)
+        return chess.pgn.read_game(buffer)
+    
+    benchmark("read_game (reused buffer)", read_rewound)
+    
+    # Parsing is CPU-bound Python, so throughput scales with processes rather than threads
+    workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        with PerformanceTimer(f"read_game (1000 calls, {workers} processes)") as timer:
+            counts = list(pool.map(count_mainline_moves, [MEDIUM_GAME_PGN] * 1000, chunksize=50))
+    parallel_elapsed = timer.get_elapsed()
+    print(f"🚀 {workers} processes: {1000/parallel_elapsed:.0f} games/second")
     
-    print(f"⏱️  Total time: {elapsed:.4f} seconds")
-    print(f"📊 Total calls: 1000")
-    print(f"⚡ Time per call: {(elapsed/1000)*1000:.3f} milliseconds")
-    print(f"✅ Performance: {'EXCELLENT' if elapsed < 1.0 else 'GOOD' if elapsed < 5.0 else 'SLOW'}")
+    assert len(set(counts)) == 1 and counts[0] > 0
 
 
+@requires_stockfish
 @pytest.mark.asyncio
-async def test_analyze_position_performance():
+async def test_analyze_position_performance(analysis_service):
     """Test performance of analyze_position function"""
-    service = AnalysisService()
+    service = analysis_service
     test_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
     
     print(f"\n{'='*60}")
@@ -239,14 +402,15 @@ async def test_analyze_position_performance():
     print(f"🎯 Best move: {result.get('best_move_san')}")
     
     assert result.get("error") is None
-    # Should complete in reasonable time based on STOCKFISH_TIME_LIMIT
+    # Should complete in reasonable time for BENCH_NODES
     assert elapsed < 5.0
 
 
+@requires_stockfish
 @pytest.mark.asyncio
-async def test_analyze_game_breakdown():
+async def test_analyze_game_breakdown(analysis_service):
     """Break down analyze_game into components to identify bottlenecks"""
-    service = AnalysisService()
+    service = analysis_service
     
     print(f"\n{'='*60}")
     print(f"Performance Breakdown Analysis")
@@ -262,16 +426,15 @@ async def test_analyze_game_breakdown():
     with PerformanceTimer("build_move_list") as timer:
         all_moves = []
         temp_board = game.board()
-        for node in game.mainline():
-            move = node.move
+        for move in game.mainline_moves():
             is_white = temp_board.turn == chess.WHITE
-            san = temp_board.san(move)
+            # One board for the whole walk; SAN is generated as the move is pushed
+            san = temp_board.san_and_push(move)
             all_moves.append({
                 'move': move,
                 'is_white': is_white,
                 'san': san
             })
-            temp_board.push(move)
     build_time = timer.get_elapsed()
     print(f"📋 Build move list: {build_time:.4f}s")
     
@@ -9,8 +9,14 @@ Run with: pytest tests/test_analysis_service_validation.py -v -s -p no:conftest
 import pytest
 import asyncio
 import chess
+import chess.pgn
+import math
 import os
+import re
+import shutil
 import sys
+from collections import Counter
+from io import StringIO
 
 # Add parent directory to path for imports
 # In Docker: /app/tests/test_*.py -> need /app in path
@@ -28,10 +34,20 @@ os.environ.setdefault("STOCKFISH_PATH", "/usr/games/stockfish")  # Use actual pa
 
 # Import AnalysisService
 try:
+    from app.config import settings
     from app.services.analysis_service import AnalysisService
+    from app.services.engine_pool import EnginePool
 except ImportError:
     # Fallback for local development
+    from backend.app.config import settings
     from backend.app.services.analysis_service import AnalysisService
+    from backend.app.services.engine_pool import EnginePool
+
+# Every test here runs Stockfish; check for the binary once instead of failing each test
+pytestmark = pytest.mark.skipif(
+    shutil.which(settings.STOCKFISH_PATH) is None,
+    reason=f"Stockfish not found at {settings.STOCKFISH_PATH}",
+)
 
 
 # Simple test game for validation
@@ -48,12 +64,73 @@ VALIDATION_GAME_PGN = """[Event "Test"]
 1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. Ba4 Nf6 5. O-O Be7 6. Re1 b5 7. Bb3 d6 8. c3 O-O 9. h3 Nb8 10. d4 Nbd7 1-0
 """
 
+# These tests check the structure and arithmetic of the analysis, not engine strength,
+# so each position gets a small fixed search instead of the production depth/time
+VALIDATION_NODES = int(os.environ.get("STOCKFISH_VALIDATION_NODES", "20000"))
+
+# A UCI move: from-square, to-square and an optional promotion piece (e2e4, a7a8q)
+UCI_MOVE_RE = re.compile(r"[a-h][1-8][a-h][1-8][qrbn]?")
+
+# Keys every entry of analyze_game's "moves" must have
+MOVE_REQUIRED_FIELDS = frozenset({
+    "move_number",
+    "is_white",
+    "half_move",
+    "move_san",
+    "move_uci",
+    "evaluation_before",
+    "evaluation_after",
+    "best_move_uci",
+    "classification",
+    "centipawn_loss",
+    "coach_commentary",
+})
+
+# Parsed once for the tests that compare the analysis against the game itself
+VALIDATION_GAME = chess.pgn.read_game(StringIO(VALIDATION_GAME_PGN))
+VALIDATION_GAME_SAN_UCI = [
+    (node.san(), node.move.uci()) for node in VALIDATION_GAME.mainline()
+]
+
+
+def _fens_before(game):
+    board = game.board()
+    fens = []
+    for move in game.mainline_moves():
+        fens.append(board.fen())
+        board.push(move)
+    return fens
+
+
+VALIDATION_GAME_FENS_BEFORE = _fens_before(VALIDATION_GAME)
+
+
+@pytest.fixture(scope="module")
+def validation_service():
+    """One AnalysisService for the module, searching VALIDATION_NODES per position"""
+    service = AnalysisService()
+    service.nodes = VALIDATION_NODES
+    # One engine of its own, quit by whichever loop used it, so the shared pool
+    # (and any engines the session's loop already warmed) is left alone
+    service.engine_pool = EnginePool(service.stockfish_path, 1)
+    return service
+
 
-@pytest.mark.asyncio
-async def test_analyze_game_structure():
+@pytest.fixture(scope="module")
+def analyzed_validation_game(validation_service):
+    """Analyze VALIDATION_GAME_PGN once; the tests below only inspect the result"""
+    async def analyze():
+        try:
+            return await validation_service.analyze_game(VALIDATION_GAME_PGN, "white")
+        finally:
+            await validation_service.engine_pool.close()
+
+    return asyncio.run(analyze())
+
+
+def test_analyze_game_structure(analyzed_validation_game):
     """Test that analyze_game returns the correct structure"""
-    service = AnalysisService()
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    result = analyzed_validation_game
     
     # Should not have errors
     assert "error" not in result, f"Analysis failed with error: {result.get('error')}"
@@ -81,32 +158,16 @@ async def test_analyze_game_structure():
     assert stats["num_moves"] == len(moves), "num_moves should match length of moves list"
 
 
-@pytest.mark.asyncio
-async def test_moves_analysis_required_fields():
+def test_moves_analysis_required_fields(analyzed_validation_game):
     """Test that each move in moves_analysis has all required fields"""
-    service = AnalysisService()
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    result = analyzed_validation_game
     
     assert "error" not in result
     moves = result["moves"]
     
-    required_fields = [
-        "move_number",
-        "is_white",
-        "half_move",
-        "move_san",
-        "move_uci",
-        "evaluation_before",
-        "evaluation_after",
-        "best_move_uci",
-        "classification",
-        "centipawn_loss",
-        "coach_commentary",
-    ]
-    
     for i, move in enumerate(moves):
-        for field in required_fields:
-            assert field in move, f"Move {i} missing required field: {field}"
+        missing = MOVE_REQUIRED_FIELDS - move.keys()
+        assert not missing, f"Move {i} missing required fields: {sorted(missing)}"
         
         # Validate field types
         assert isinstance(move["move_number"], int)
@@ -120,8 +181,7 @@ async def test_moves_analysis_required_fields():
             assert isinstance(move["centipawn_loss"], (int, float)), "centipawn_loss should be numeric if not None"
 
 
-@pytest.mark.asyncio
-async def test_evaluation_reuse_consistency():
+def test_evaluation_reuse_consistency(analyzed_validation_game):
     """
     Test that evaluations are correctly reused between moves.
     
@@ -130,40 +190,37 @@ async def test_evaluation_reuse_consistency():
     and eval_before is from the current player's perspective,
     we need to verify the reuse logic is correct.
     """
-    service = AnalysisService()
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    result = analyzed_validation_game
     
     assert "error" not in result
     moves = result["moves"]
     
-    # The reuse happens internally - eval_after (raw) becomes eval_before for next move
-    # But in the stored data:
-    # - evaluation_after is flipped: -eval_after (from next player's perspective)
-    # - evaluation_before is from current player's perspective
-    # 
-    # So for move N+1, evaluation_before should be the raw eval_after from move N
-    # But we store -eval_after, so we can't directly compare stored values
-    # Instead, we verify that evaluations are present and reasonable
-    for i in range(len(moves) - 1):
-        current_move = moves[i]
-        next_move = moves[i + 1]
-        
+    # Each move starts from the position the previous one left
+    assert [m["fen_before"] for m in moves] == VALIDATION_GAME_FENS_BEFORE
+    
+    # The raw eval_after of move N is reused as the raw eval_before of move N+1.
+    # evaluation_after is stored flipped (-raw), and evaluation_before is stored
+    # raw for white and flipped for black, so the stored pair must satisfy:
+    #   next move white: evaluation_before == -evaluation_after of the move before
+    #   next move black: evaluation_before ==  evaluation_after of the move before
+    # (evaluation_before is only flipped for black when the move's own
+    # evaluation_after exists, so moves without one are skipped)
+    for current_move, next_move in zip(moves, moves[1:]):
         eval_after_current = current_move["evaluation_after"]
         eval_before_next = next_move["evaluation_before"]
+        if eval_after_current is None or eval_before_next is None or next_move["evaluation_after"] is None:
+            continue
         
-        # Both should be present (unless there was an error)
-        # The actual reuse happens internally, so we just verify data is present
-        if eval_after_current is not None and eval_before_next is not None:
-            # Both should be numeric values
-            assert isinstance(eval_after_current, (int, float))
-            assert isinstance(eval_before_next, (int, float))
+        expected = -eval_after_current if next_move["is_white"] else eval_after_current
+        assert eval_before_next == expected, (
+            f"Move {next_move['move_san']} (half_move {next_move['half_move']}): evaluation_before "
+            f"{eval_before_next} does not reuse the previous move's evaluation_after {eval_after_current}"
+        )
 
 
-@pytest.mark.asyncio
-async def test_move_numbering_consistency():
+def test_move_numbering_consistency(analyzed_validation_game):
     """Test that move numbers and half_moves are consistent"""
-    service = AnalysisService()
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    result = analyzed_validation_game
     
     assert "error" not in result
     moves = result["moves"]
@@ -191,22 +248,19 @@ async def test_move_numbering_consistency():
             assert move["move_number"] >= 1
 
 
-@pytest.mark.asyncio
-async def test_stats_accuracy():
+def test_stats_accuracy(analyzed_validation_game):
     """Test that stats accurately reflect the moves"""
-    service = AnalysisService()
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    result = analyzed_validation_game
     
     assert "error" not in result
     moves = result["moves"]
     stats = result["stats"]
     
     # Count classifications in moves (only for white moves since user_color is "white")
-    user_moves = [m for m in moves if m["is_white"]]
-    
-    blunders_count = sum(1 for m in user_moves if m["classification"] == "blunder")
-    mistakes_count = sum(1 for m in user_moves if m["classification"] == "mistake")
-    inaccuracies_count = sum(1 for m in user_moves if m["classification"] == "inaccuracy")
+    counts = Counter(m["classification"] for m in moves if m["is_white"])
+    blunders_count = counts["blunder"]
+    mistakes_count = counts["mistake"]
+    inaccuracies_count = counts["inaccuracy"]
     
     # Stats should match (within reason, since we're only counting user's moves)
     assert stats["num_blunders"] == blunders_count, (
@@ -220,11 +274,9 @@ async def test_stats_accuracy():
     )
 
 
-@pytest.mark.asyncio
-async def test_evaluation_perspective():
+def test_evaluation_perspective(analyzed_validation_game):
     """Test that evaluations are from the correct perspective"""
-    service = AnalysisService()
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    result = analyzed_validation_game
     
     assert "error" not in result
     moves = result["moves"]
@@ -240,51 +292,37 @@ async def test_evaluation_perspective():
             assert isinstance(eval_after, (int, float)), "evaluation_after should be numeric"
 
 
-@pytest.mark.asyncio
-async def test_best_move_uci_format():
+def test_best_move_uci_format(analyzed_validation_game):
     """Test that best_move_uci is in correct UCI format or None"""
-    service = AnalysisService()
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    result = analyzed_validation_game
     
     assert "error" not in result
     moves = result["moves"]
     
-    for move in moves:
-        best_move_uci = move["best_move_uci"]
-        if best_move_uci is not None:
-            # UCI format: e2e4, a7a8q, etc. (4-5 characters)
-            assert len(best_move_uci) >= 4, f"best_move_uci should be at least 4 chars: {best_move_uci}"
-            assert len(best_move_uci) <= 5, f"best_move_uci should be at most 5 chars: {best_move_uci}"
-            # Should be lowercase
-            assert best_move_uci.islower(), f"best_move_uci should be lowercase: {best_move_uci}"
+    malformed = [
+        move["best_move_uci"] for move in moves
+        if move["best_move_uci"] is not None and not UCI_MOVE_RE.fullmatch(move["best_move_uci"])
+    ]
+    assert not malformed, f"best_move_uci values not in UCI format: {malformed}"
 
 
-@pytest.mark.asyncio
-async def test_move_san_uci_consistency():
+def test_move_san_uci_consistency(analyzed_validation_game):
     """Test that move_san and move_uci represent the same move"""
-    service = AnalysisService()
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    result = analyzed_validation_game
     
     assert "error" not in result
     moves = result["moves"]
     
+    assert [(m["move_san"], m["move_uci"]) for m in moves] == VALIDATION_GAME_SAN_UCI
+    
     for move in moves:
-        move_san = move["move_san"]
-        move_uci = move["move_uci"]
-        
-        # Both should be non-empty strings
-        assert isinstance(move_san, str) and len(move_san) > 0
-        assert isinstance(move_uci, str) and len(move_uci) >= 4
-        
-        # UCI should be lowercase
-        assert move_uci.islower()
+        assert isinstance(move["move_san"], str) and move["move_san"]
+        assert UCI_MOVE_RE.fullmatch(move["move_uci"]), f"move_uci not in UCI format: {move['move_uci']}"
 
 
-@pytest.mark.asyncio
-async def test_centipawn_loss_calculated():
+def test_centipawn_loss_calculated(analyzed_validation_game):
     """Test that centipawn_loss is calculated (can be None or a number)"""
-    service = AnalysisService()
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    result = analyzed_validation_game
     
     assert "error" not in result
     moves = result["moves"]
@@ -298,11 +336,9 @@ async def test_centipawn_loss_calculated():
             )
 
 
-@pytest.mark.asyncio
-async def test_average_centipawn_loss_calculated():
+def test_average_centipawn_loss_calculated(analyzed_validation_game):
     """Test that average_centipawn_loss is calculated in stats"""
-    service = AnalysisService()
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    result = analyzed_validation_game
     
     assert "error" not in result
     stats = result["stats"]
@@ -315,32 +351,34 @@ async def test_average_centipawn_loss_calculated():
 
 
 @pytest.mark.asyncio
-async def test_engine_calls_optimization(monkeypatch):
+async def test_engine_calls_optimization(monkeypatch, validation_service):
     """
     Test that the optimization reduces engine calls by reusing evaluations.
     
     With optimization: N+1 calls for N moves (one per position)
     Without optimization: 2N calls (before + after per move)
     """
-    service = AnalysisService()
-    call_count = []
+    service = validation_service
+    engine_calls = 0
     
-    # Monkeypatch to track calls - use the already imported chess module
-    original_popen_uci = chess.engine.popen_uci
+    # Count calls on every engine, including ones already pooled by the shared
+    # analysis above, with the Redis evaluation cache out of the picture
+    original_analyse = chess.engine.UciProtocol.analyse
     
-    async def tracked_popen_uci(path):
-        transport, engine = await original_popen_uci(path)
-        # Wrap the analyse method to track calls
-        original_engine_analyse = engine.analyse
-        async def wrapped_analyse(board, limit):
-            call_count.append(1)
-            return await original_engine_analyse(board, limit)
-        engine.analyse = wrapped_analyse
-        return transport, engine
+    def counted_analyse(self, board, limit, **kwargs):
+        nonlocal engine_calls
+        engine_calls += 1
+        return original_analyse(self, board, limit, **kwargs)
     
-    monkeypatch.setattr("chess.engine.popen_uci", tracked_popen_uci)
+    position_cache = sys.modules[AnalysisService.__module__].position_cache
+    monkeypatch.setattr(chess.engine.UciProtocol, "analyse", counted_analyse)
+    monkeypatch.setattr(position_cache, "get_many", lambda keys: {})
+    monkeypatch.setattr(position_cache, "set_many", lambda evaluations: None)
     
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    try:
+        result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    finally:
+        await service.engine_pool.close()
     
     assert "error" not in result
     moves = result["moves"]
@@ -351,7 +389,7 @@ async def test_engine_calls_optimization(monkeypatch):
     expected_calls_optimized = num_moves + 1
     expected_calls_unoptimized = 2 * num_moves
     
-    actual_calls = len(call_count)
+    actual_calls = engine_calls
     
     print(f"\nEngine calls: {actual_calls} (expected ~{expected_calls_optimized} with optimization, "
           f"would be {expected_calls_unoptimized} without)")
@@ -363,8 +401,7 @@ async def test_engine_calls_optimization(monkeypatch):
         f"Expected ~{expected_calls_optimized}, got {actual_calls}"
     )
 
-@pytest.mark.asyncio
-async def test_centipawn_loss_calculation_correctness():
+def test_centipawn_loss_calculation_correctness(analyzed_validation_game):
     """
     Test that centipawn_loss is calculated correctly from evaluations.
     
@@ -375,45 +412,37 @@ async def test_centipawn_loss_calculation_correctness():
     
     So: cp_loss should equal eval_before - (-eval_after) = eval_before + eval_after
     """
-    service = AnalysisService()
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    result = analyzed_validation_game
     
     assert "error" not in result
     moves = result["moves"]
     
-    for move in moves:
-        eval_before = move["evaluation_before"]
-        eval_after = move["evaluation_after"]
-        cp_loss = move["centipawn_loss"]
-        is_white = move["is_white"]
-        
-        # If we have all three values, verify the calculation
-        if eval_before is not None and eval_after is not None and cp_loss is not None:
-            # Both stored evaluations are from the current player's perspective
-            # evaluation_after is stored as -eval_after (flipped for next player)
-            # So to get eval_after from current player's perspective, we need to flip it back
-            eval_after_from_current_perspective = -eval_after
-            
-            # Calculate expected cp_loss
-            # cp_loss = eval_before - eval_after (both from current player's perspective)
-            expected_cp_loss = eval_before - eval_after_from_current_perspective
-            
-            # Allow small floating point differences
-            tolerance = 0.1
-            assert abs(cp_loss - expected_cp_loss) < tolerance, (
-                f"Move {move['move_san']} ({'white' if is_white else 'black'}, half_move {move['half_move']}): "
-                f"centipawn_loss calculation incorrect.\n"
-                f"  Stored eval_before: {eval_before:.2f}\n"
-                f"  Stored eval_after: {eval_after:.2f} (from next player's perspective)\n"
-                f"  eval_after from current perspective: {eval_after_from_current_perspective:.2f}\n"
-                f"  Expected cp_loss: {expected_cp_loss:.2f} (eval_before - eval_after_from_current)\n"
-                f"  Actual cp_loss: {cp_loss:.2f}\n"
-                f"  Difference: {abs(cp_loss - expected_cp_loss):.2f}"
-            )
+    # Both stored evaluations are from the current player's perspective, but
+    # evaluation_after is stored as -eval_after (flipped for the next player), so
+    # cp_loss = eval_before - (-evaluation_after). Allow small floating point differences.
+    tolerance = 0.1
+    incorrect = [
+        (
+            move["half_move"],
+            move["move_san"],
+            move["evaluation_before"],
+            move["evaluation_after"],
+            move["centipawn_loss"],
+            move["evaluation_before"] + move["evaluation_after"],
+        )
+        for move in moves
+        if move["evaluation_before"] is not None
+        and move["evaluation_after"] is not None
+        and move["centipawn_loss"] is not None
+        and not abs(move["centipawn_loss"] - (move["evaluation_before"] + move["evaluation_after"])) < tolerance
+    ]
+    assert not incorrect, (
+        "centipawn_loss calculation incorrect "
+        f"(half_move, move, eval_before, eval_after, actual cp_loss, expected cp_loss): {incorrect}"
+    )
 
 
-@pytest.mark.asyncio
-async def test_evaluation_reasonable_values():
+def test_evaluation_reasonable_values(analyzed_validation_game):
     """
     Test that evaluations are within reasonable bounds and not corrupted.
     
@@ -422,41 +451,30 @@ async def test_evaluation_reasonable_values():
     - Evaluations are within reasonable chess bounds (mate scores can be large)
     - Evaluations make sense relative to each other
     """
-    import math
-    
-    service = AnalysisService()
-    result = await service.analyze_game(VALIDATION_GAME_PGN, "white")
+    result = analyzed_validation_game
     
     assert "error" not in result
     moves = result["moves"]
     
-    for move in moves:
-        eval_before = move["evaluation_before"]
-        eval_after = move["evaluation_after"]
-        
-        for eval_name, eval_value in [("evaluation_before", eval_before), ("evaluation_after", eval_after)]:
-            if eval_value is not None:
-                # Check for NaN or infinite
-                assert not math.isnan(eval_value), (
-                    f"Move {move['move_san']}: {eval_name} is NaN (Not a Number)"
-                )
-                assert not math.isinf(eval_value), (
-                    f"Move {move['move_san']}: {eval_name} is infinite"
-                )
-                
-                # Evaluations can be large for mate scores, but should be reasonable
-                # Allow up to 50000 for extreme mate scores, but flag if extremely large
-                assert abs(eval_value) < 50000, (
-                    f"Move {move['move_san']}: {eval_name} is extremely large ({eval_value:.2f}), "
-                    f"might indicate an error. Normal evaluations are typically -1000 to +1000 centipawns."
-                )
-                
-                # Check that evaluations are reasonable (not absurdly large for non-mate positions)
-                # Most positions should be within -5000 to +5000 centipawns (50 pawns)
-                # Only mate positions should exceed this
-                if abs(eval_value) > 5000:
-                    # This might be a mate score, which is OK
-                    # But log it for verification
-                    pass
+    evaluations = [
+        (move["move_san"], eval_name, move[eval_name])
+        for move in moves
+        for eval_name in ("evaluation_before", "evaluation_after")
+        if move[eval_name] is not None
+    ]
+    
+    # Check for NaN or infinite
+    not_finite = [entry for entry in evaluations if not math.isfinite(entry[2])]
+    assert not not_finite, f"NaN or infinite evaluations (move, field, value): {not_finite}"
+    
+    # Evaluations can be large for mate scores, but should be reasonable.
+    # Allow up to 50000 for extreme mate scores; normal evaluations are
+    # typically -1000 to +1000 centipawns.
+    extreme = [entry for entry in evaluations if abs(entry[2]) >= 50000]
+    assert not extreme, (
+        f"Extremely large evaluations (move, field, value), might indicate an error: {extreme}"
+    )
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "-s"])
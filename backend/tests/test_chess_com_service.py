@@ -24,3 +24,34 @@ def test_parse_game_data_simple(sample_pgn):
     assert parsed["black_player"] == "Bob"
     assert parsed["opening_eco"] == "C50"
     assert parsed["opening_name"] == "Giuoco Piano"
+
+
+def test_filter_archives_by_month():
+    archives = [
+        f"https://api.chess.com/pub/player/alice/games/{year}/{month:02d}"
+        for year in (2022, 2023)
+        for month in range(1, 13)
+    ]
+
+    selected = ChessComService._filter_archives_by_month(archives, 2022, 11, 2023, 2)
+
+    assert [url.rsplit("/", 2)[-2:] for url in selected] == [
+        ["2022", "11"], ["2022", "12"], ["2023", "01"], ["2023", "02"]
+    ]
+
+
+def test_fetch_archives_keeps_order_and_skips_failures(monkeypatch):
+    service = ChessComService()
+    archives = [f"https://api.chess.com/pub/player/alice/games/2023/{month:02d}" for month in range(1, 13)]
+
+    def fake_get_games_from_archive(archive_url, target_username=None):
+        month = archive_url.rsplit("/", 1)[-1]
+        if month == "05":
+            raise Exception("HTTP 500")
+        return [{"month": month}]
+
+    monkeypatch.setattr(service, "get_games_from_archive", fake_get_games_from_archive)
+
+    games = service._fetch_archives(archives, "alice")
+
+    assert [game["month"] for game in games] == [f"{month:02d}" for month in range(1, 13) if month != 5]
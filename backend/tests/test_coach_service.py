@@ -1,16 +1,20 @@
+import asyncio
+import json
 import os
+import httpx
 import pytest
-from backend.app.services.coach_service import CoachService
+from backend.app.services.coach_service import CoachService, CommentaryStreamError
 
 
-def test_build_coaching_prompt_and_generation(monkeypatch):
+@pytest.mark.asyncio
+async def test_build_coaching_prompt_and_generation(monkeypatch):
     # Enable coach and set provider to Ollama for tests
     from backend.app import config
 
-    config.settings.ENABLE_COACH = True
-    config.settings.COACH_PROVIDER = "ollama"
-    config.settings.OLLAMA_BASE_URL = "http://localhost:11434"
-    config.settings.OLLAMA_MODEL = "llama3.1"
+    monkeypatch.setattr(config.settings, "ENABLE_COACH", True)
+    monkeypatch.setattr(config.settings, "COACH_PROVIDER", "ollama")
+    monkeypatch.setattr(config.settings, "OLLAMA_BASE_URL", "http://localhost:11434")
+    monkeypatch.setattr(config.settings, "OLLAMA_MODEL", "llama3.1")
 
     service = CoachService()
     assert service.is_enabled()
@@ -28,29 +32,138 @@ def test_build_coaching_prompt_and_generation(monkeypatch):
     assert "Move played: Nf3" in prompt
     assert "Centipawn loss: 123.4" in prompt
 
-    # Mock Ollama request
-    class FakeResponse:
-        status_code = 200
-
-        def json(self):
-            return {"response": "Good move, but watch your development."}
-
-    def fake_post(url, json, timeout):
-        return FakeResponse()
-
-    monkeypatch.setattr("requests.post", fake_post)
-
-    import asyncio
-+    commentary = asyncio.run(service.generate_move_commentary(
-+        move_san="Nf3",
-+        classification="mistake",
-+        centipawn_loss=123.4,
-+        fen_before="rnbqkb1r/pppppppp/5n2/8/8/5N2/PPPPPPPP/RNBQKB1R w KQkq - 2 2",
-+        fen_after="rnbqkb1r/pppppppp/5n2/8/8/5N2/PPPPPPPP/RNBQKB1R b KQkq - 3 2",
-+        best_move_san="Nc3",
-+        game_phase="opening",
-+        user_color="white",
-+    ))
-+
-+    assert commentary is not None
-+    assert "Good move" in commentary
+    # Answer the Ollama request in-process through the shared client
+    requests_seen = []
+
+    def ollama(request):
+        requests_seen.append(request)
+        return httpx.Response(200, json={"response": "Good move, but watch your development."})
+
+    monkeypatch.setattr(CoachService, "_http", httpx.AsyncClient(transport=httpx.MockTransport(ollama)))
+    monkeypatch.setattr(CoachService, "_http_loop", asyncio.get_running_loop())
+
+    commentary = await service.generate_move_commentary(
+        move_san="Nf3",
+        classification="mistake",
+        centipawn_loss=123.4,
+        fen_before="rnbqkb1r/pppppppp/5n2/8/8/5N2/PPPPPPPP/RNBQKB1R w KQkq - 2 2",
+        fen_after="rnbqkb1r/pppppppp/5n2/8/8/5N2/PPPPPPPP/RNBQKB1R b KQkq - 3 2",
+        best_move_san="Nc3",
+        game_phase="opening",
+        user_color="white",
+    )
+
+    assert len(requests_seen) == 1
+    assert requests_seen[0].url == "http://localhost:11434/api/generate"
+    assert "Move played: Nf3" in json.loads(requests_seen[0].content)["prompt"]
+    assert commentary is not None
+    assert "Good move" in commentary
+
+
+@pytest.mark.asyncio
+async def test_generate_move_commentaries_batch_runs_requests_concurrently(monkeypatch):
+    from collections import OrderedDict
+    from backend.app import config
+
+    monkeypatch.setattr(config.settings, "ENABLE_COACH", True)
+    monkeypatch.setattr(config.settings, "COACH_PROVIDER", "ollama")
+    monkeypatch.setattr(config.settings, "COACH_CONCURRENCY", 2)
+    monkeypatch.setattr(CoachService, "_memory_cache", OrderedDict())
+    monkeypatch.setattr(CoachService, "_load_cached_commentary", lambda self, key: None)
+    monkeypatch.setattr(CoachService, "_save_cached_commentary", lambda self, key, model, commentary: None)
+
+    in_flight = 0
+    peak = 0
+
+    async def ollama(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        prompt = json.loads(request.content)["prompt"]
+        move_line = next(line for line in prompt.splitlines() if line.startswith("Move played:"))
+        return httpx.Response(200, json={"response": move_line})
+
+    monkeypatch.setattr(CoachService, "_http", httpx.AsyncClient(transport=httpx.MockTransport(ollama)))
+    monkeypatch.setattr(CoachService, "_http_loop", asyncio.get_running_loop())
+
+    fen = "rnbqkb1r/pppppppp/5n2/8/8/5N2/PPPPPPPP/RNBQKB1R w KQkq - 2 2"
+    moves = [
+        {
+            "move_san": move_san,
+            "classification": "mistake",
+            "centipawn_loss": 180.0,
+            "fen_before": fen,
+            "fen_after": fen,
+            "best_move_san": "Nc3",
+            "game_phase": "opening",
+            "user_color": "white",
+        }
+        for move_san in ("a3", "h3", "a4", "h4")
+    ]
+
+    commentaries = await CoachService().generate_move_commentaries_batch(moves)
+
+    # Requests overlap, but never beyond COACH_CONCURRENCY, and results keep move order
+    assert peak == 2
+    assert commentaries == [f"Move played: {move['move_san']}" for move in moves]
+
+
+def test_commentary_draft_only_for_models_accepting_predictions(monkeypatch):
+    from backend.app import config
+
+    monkeypatch.setattr(config.settings, "COACH_OPENAI_PREDICTION", True)
+    monkeypatch.setattr(config.settings, "COACH_OPENAI_PREDICTION_MODELS", ["gpt-4o"])
+    service = CoachService()
+
+    draft = service._build_commentary_draft("gpt-4o-mini", "Qh5", "blunder", 420.0, "Nf3")
+    assert draft.startswith("Playing Qh5 was a blunder")
+    # e.g. the large model that big blunders and endgames are routed to
+    assert service._build_commentary_draft("gpt-4", "Qh5", "blunder", 420.0, "Nf3") is None
+    assert "prediction" not in service._openai_sampling(None)["extra_body"]
+
+
+@pytest.mark.asyncio
+async def test_stream_commentary_is_cached_only_when_complete(monkeypatch):
+    from collections import OrderedDict
+    from backend.app import config
+
+    monkeypatch.setattr(config.settings, "ENABLE_COACH", True)
+    monkeypatch.setattr(config.settings, "COACH_PROVIDER", "ollama")
+    monkeypatch.setattr(CoachService, "_memory_cache", OrderedDict())
+    monkeypatch.setattr(CoachService, "_load_cached_commentary", lambda self, key: None)
+    monkeypatch.setattr(CoachService, "_save_cached_commentary", lambda self, key, model, commentary: None)
+
+    chunks = [{"response": "Watch ", "done": False}, {"response": "the bishop.", "done": False}]
+
+    def ollama(request):
+        body = "\n".join(json.dumps(chunk) for chunk in chunks)
+        return httpx.Response(200, content=body.encode())
+
+    monkeypatch.setattr(CoachService, "_http", httpx.AsyncClient(transport=httpx.MockTransport(ollama)))
+    monkeypatch.setattr(CoachService, "_http_loop", asyncio.get_running_loop())
+
+    move = {
+        "move_san": "Nf3",
+        "classification": "blunder",
+        "centipawn_loss": 320.0,
+        "fen_before": "rnbqkb1r/pppppppp/5n2/8/8/5N2/PPPPPPPP/RNBQKB1R w KQkq - 2 2",
+        "best_move_san": "Nc3",
+        "game_phase": "opening",
+        "user_color": "white",
+    }
+    service = CoachService()
+
+    # Cut off before Ollama's final chunk: tokens arrive, then the stream fails
+    tokens = []
+    with pytest.raises(CommentaryStreamError):
+        async for token in service.stream_move_commentary(**move):
+            tokens.append(token)
+    assert tokens == ["Watch ", "the bishop."]
+    assert len(CoachService._memory_cache) == 0
+
+    chunks.append({"response": "", "done": True})
+    tokens = [token async for token in service.stream_move_commentary(**move)]
+    assert "".join(tokens) == "Watch the bishop."
+    assert list(CoachService._memory_cache.values()) == ["Watch the bishop."]
@@ -0,0 +1,75 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from backend.app.services.engine_pool import EnginePool
+
+
+def fake_pool(size):
+    pool = EnginePool("/nonexistent/stockfish", size)
+    spawned = []
+
+    async def spawn():
+        async def quit():
+            pass
+
+        entry = (SimpleNamespace(kill=lambda: None), SimpleNamespace(returncode=None, quit=quit))
+        spawned.append(entry)
+        return entry
+
+    pool._spawn = spawn
+    return pool, spawned
+
+
+@pytest.mark.asyncio
+async def test_waiter_gets_an_engine_when_the_holder_fails():
+    pool, spawned = fake_pool(1)
+    holding = asyncio.Event()
+
+    async def failing_holder():
+        async with pool.acquire():
+            holding.set()
+            await asyncio.sleep(0.01)
+            raise RuntimeError("analysis failed")
+
+    async def waiter():
+        await holding.wait()
+        async with pool.acquire() as engine:
+            return engine
+
+    results = await asyncio.wait_for(
+        asyncio.gather(failing_holder(), waiter(), return_exceptions=True), timeout=1
+    )
+
+    assert isinstance(results[0], RuntimeError)
+    # The failed engine was dropped and a replacement started for the waiter
+    assert len(spawned) == 2
+    assert results[1] is spawned[1][1]
+
+
+@pytest.mark.asyncio
+async def test_waiter_is_not_stranded_by_close():
+    pool, spawned = fake_pool(1)
+    holding = asyncio.Event()
+    release = asyncio.Event()
+
+    async def holder():
+        async with pool.acquire():
+            holding.set()
+            await release.wait()
+
+    async def waiter():
+        await holding.wait()
+        async with pool.acquire() as engine:
+            return engine
+
+    holder_task = asyncio.create_task(holder())
+    waiter_task = asyncio.create_task(waiter())
+    await holding.wait()
+    await asyncio.sleep(0)
+    await pool.close()
+
+    engine = await asyncio.wait_for(waiter_task, timeout=1)
+    assert engine is spawned[1][1]
+    release.set()
+    await holder_task
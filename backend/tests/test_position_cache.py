@@ -0,0 +1,101 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import chess
+import chess.engine
+from backend.app.config import settings
+from backend.app.services import position_cache
+from backend.app.services.analysis_service import AnalysisService
+
+
+def test_encode_decode_roundtrip():
+    evaluation = (-37.0, chess.Move.from_uci("e7e8q"))
+
+    assert position_cache._decode(position_cache._encode(evaluation)) == evaluation
+    assert position_cache._decode(position_cache._encode((None, None))) == (None, None)
+
+
+def test_position_key_depends_on_side_to_move_and_limits():
+    board = chess.Board()
+    black_to_move = chess.Board()
+    black_to_move.turn = chess.BLACK
+
+    assert position_cache.position_key(board, 18, 0.8) != position_cache.position_key(black_to_move, 18, 0.8)
+    assert position_cache.position_key(board, 18, 0.8) != position_cache.position_key(board, 20, 0.8)
+    assert position_cache.position_key(board, 18, 0.8) != position_cache.position_key(board, 18, 0.8, nodes=200000)
+
+
+def test_get_many_serves_remembered_evaluations_without_redis(monkeypatch):
+    class FailingRedis:
+        def mget(self, keys):
+            raise ConnectionError("redis down")
+
+        def pipeline(self, transaction=True):
+            raise ConnectionError("redis down")
+
+    monkeypatch.setattr(settings, "STOCKFISH_EVAL_CACHE_TTL_SECONDS", 3600)
+    monkeypatch.setattr(position_cache.redis_pubsub, "_redis_client", FailingRedis())
+    evaluation = (15.0, chess.Move.from_uci("e2e4"))
+
+    position_cache.set_many({"engine_eval:a": evaluation})
+
+    assert position_cache.get_many(["engine_eval:a", "engine_eval:b"]) == {"engine_eval:a": evaluation}
+    position_cache.clear_local()
+    assert position_cache.get_many(["engine_eval:a"]) == {}
+
+
+def test_analyze_game_skips_engine_for_cached_positions(monkeypatch, sample_pgn):
+    svc = AnalysisService()
+    analysed = []
+
+    class FakeEngine:
+        async def analyse(self, board, limit):
+            analysed.append(board.fen())
+            return {
+                "score": chess.engine.PovScore(chess.engine.Cp(20), board.turn),
+                "pv": [next(iter(board.legal_moves))],
+            }
+
+    @asynccontextmanager
+    async def fake_acquire_engine():
+        yield FakeEngine()
+
+    stored = {}
+    monkeypatch.setattr(svc, "_acquire_engine", fake_acquire_engine)
+    monkeypatch.setattr(position_cache, "get_many", lambda keys: {key: stored[key] for key in keys if key in stored})
+    monkeypatch.setattr(position_cache, "set_many", stored.update)
+
+    first = asyncio.run(svc.analyze_game(sample_pgn, "white"))
+    engine_calls = len(analysed)
+    second = asyncio.run(svc.analyze_game(sample_pgn, "white"))
+
+    assert engine_calls == first["stats"]["num_moves"] + 1
+    assert len(analysed) == engine_calls
+    assert second["moves"] == first["moves"]
+
+
+def test_analyze_game_searches_repeated_positions_once(monkeypatch):
+    svc = AnalysisService()
+    analysed = []
+
+    class FakeEngine:
+        async def analyse(self, board, limit):
+            analysed.append(board.fen())
+            return {
+                "score": chess.engine.PovScore(chess.engine.Cp(0), board.turn),
+                "pv": [next(iter(board.legal_moves))],
+            }
+
+    @asynccontextmanager
+    async def fake_acquire_engine():
+        yield FakeEngine()
+
+    monkeypatch.setattr(svc, "_acquire_engine", fake_acquire_engine)
+    monkeypatch.setattr(position_cache, "get_many", lambda keys: {})
+    monkeypatch.setattr(position_cache, "set_many", lambda evaluations: None)
+
+    # The start position and the positions after Nf3 and Nf6 each occur twice
+    result = asyncio.run(svc.analyze_game("1. Nf3 Nf6 2. Ng1 Ng8 3. Nf3 Nf6 *", "white"))
+
+    assert result["stats"]["num_moves"] == 6
+    assert len(analysed) == 4
@@ -0,0 +1,111 @@
+import io
+from datetime import datetime
+
+import chess
+import chess.pgn
+import pytest
+from sqlalchemy import insert
+from backend.app.models import Game, Move, User
+from backend.app.services.puzzle_service import _push_san_fast, fen_from_moves_table, fen_from_pgn_at_half_move
+
+
+# Each game is replayed by fen_from_pgn_at_half_move and compared with chess.pgn
+GAMES = {
+    "file_rank_and_square_disambiguation": """[Event "Disambiguation"]
+[SetUp "1"]
+[FEN "k7/8/8/8/Q6Q/8/8/K6Q w - - 0 1"]
+
+1. Qh4e4+ Kb8 2. Qhd1 Kc8 3. Qad4 Kb8 4. Q1d2 Kc8 *""",
+    "rank_disambiguation": """[SetUp "1"]
+[FEN "k7/8/8/R7/8/8/8/R6K w - - 0 1"]
+
+1. R5a3 Kb7 2. R1a2 Kc6 3. Rb3 Kd5 *""",
+    # The e2 knight also attacks d4 but is pinned, so "Nd4" needs no disambiguation
+    "pinned_piece": """[SetUp "1"]
+[FEN "4r2k/8/8/1N6/8/8/4N3/4K3 w - - 0 1"]
+
+1. Nd4 Kg8 2. Nf5 Kh8 *""",
+    "promotions_and_castling": """[SetUp "1"]
+[FEN "r3k2r/1P6/8/3pP3/8/8/6p1/R3K2R w KQkq d6 0 1"]
+
+1. exd6 O-O 2. bxa8=Q gxh1=N 3. O-O-O Ng3 4. d7 Ne2+ 5. Kb2 Kg7 6. d8=B *""",
+    "en_passant_both_sides": """1. e4 d5 2. e5 f5 3. exf6 d4 4. c4 dxc3 5. fxg7 cxb2 6. gxh8=Q bxa1=N 0-1""",
+    "comments_variations_and_nags": """[Event "Annotated"]
+[White "A"]
+[Black "B"]
+
+1. e4 {King's pawn (the most popular)} e5 2. Nf3 $1 Nc6 (2... d6 {Philidor} 3. d4
+(3. Bc4 Be7 (3... h6?!)) exd4) 3. Bb5!? a6 ; Morphy (defence)
+4. Ba4 Nf6 5. 0-0 Be7 6. Re1 b5 7. Bb3 d6 8. c3 O-O 9. h3 Nb8 10. d4 Nbd7
+11. Nbd2 Bb7 12. Bc2 Re8 13. Nf1 Bf8 14. Ng3 g6 15. a4 c5 16. d5 c4 17. Bg5 h6
+18. Be3 Nc5 19. Qd2 h5 20. Bg5 Be7 21. Ra3 Nxa4 22. Bxa4 bxa4 23. Rxa4 a5
+24. Rf1 Nd7 25. Rf1a1 $10 1/2-1/2""",
+}
+
+
+def _mainline(pgn):
+    game = chess.pgn.read_game(io.StringIO(pgn))
+    assert not game.errors
+    board = game.board()
+    fens = [board.fen()]
+    moves = list(game.mainline_moves())
+    for move in moves:
+        board.push(move)
+        fens.append(board.fen())
+    return moves, fens
+
+
+@pytest.mark.parametrize("pgn", GAMES.values(), ids=GAMES.keys())
+def test_fen_from_pgn_matches_python_chess(pgn):
+    moves, fens = _mainline(pgn)
+
+    for half_move, fen in enumerate(fens):
+        assert fen_from_pgn_at_half_move(pgn, half_move) == fen
+
+    assert fen_from_pgn_at_half_move(pgn, len(moves) + 1) is None
+
+
+@pytest.mark.parametrize("pgn", GAMES.values(), ids=GAMES.keys())
+def test_push_san_fast_matches_push_san(pgn):
+    game = chess.pgn.read_game(io.StringIO(pgn))
+    board = game.board()
+    expected = game.board()
+
+    for move in game.mainline_moves():
+        san = expected.san(move)
+        _push_san_fast(board, san)
+        expected.push(move)
+        assert board.move_stack[-1] == move
+        assert board.fen() == expected.fen()
+
+
+def test_fen_from_moves_table_matches_python_chess(db_session):
+    pgn = GAMES["en_passant_both_sides"]
+    moves, fens = _mainline(pgn)
+    user = User(email="puzzles@example.com", username="puzzles", hashed_password="x")
+    db_session.add(user)
+    db_session.commit()
+    game = Game(
+        user_id=user.id, pgn=pgn, white_player="puzzles", black_player="opponent",
+        user_color="white", result="loss", date_played=datetime(2024, 1, 1),
+    )
+    db_session.add(game)
+    db_session.commit()
+    db_session.execute(insert(Move), [
+        {
+            "game_id": game.id,
+            "move_number": ply // 2 + 1,
+            "is_white": ply % 2 == 0,
+            "half_move": ply,
+            "move_san": "",
+            "move_uci": move.uci(),
+        }
+        for ply, move in enumerate(moves)
+    ])
+    db_session.commit()
+
+    for half_move, fen in enumerate(fens):
+        assert fen_from_moves_table(db_session, game.id, half_move) == fen
+
+    assert fen_from_moves_table(db_session, game.id, len(moves) + 1) is None
+    assert fen_from_moves_table(db_session, game.id, -1) is None
@@ -0,0 +1,14 @@
+from backend.app.services.redis_pubsub import RedisPubSub, is_event_id
+
+
+def test_is_event_id():
+    assert is_event_id("1718000000000-0")
+    assert is_event_id("0-0")
+    for value in ("", "$", "abc", "1718000000000", "1-2-3", "-1-0", "1-0 "):
+        assert not is_event_id(value)
+
+
+def test_sse_reader_pool_is_not_capped_by_the_shared_pool_size():
+    client = RedisPubSub().async_redis_client
+
+    assert client.connection_pool.max_connections > 10_000
@@ -1,4 +1,5 @@
 import pytest
+from sqlalchemy import insert
 from backend.app.services.stats_service import StatsService
 from backend.app.models import User, Game, Move, UserStats
 from datetime import datetime, timedelta
@@ -10,46 +11,404 @@ def test_calculate_user_stats_basic(db_session):
     db_session.add(user)
     db_session.commit()
 
-    # Create games for the user
+    # Create games for the user, then their moves, in one batched INSERT each
     now = datetime.utcnow()
-    games = []
-    for i in range(5):
-        g = Game(
+    games = [
+        {
+            "user_id": user.id,
+            "pgn": "",
+            "white_player": "user1",
+            "black_player": "opponent",
+            "user_color": "white",
+            "user_rating": 1500,
+            "result": "win" if i % 2 == 0 else "loss",
+            "date_played": now - timedelta(days=i),
+            "is_analyzed": True,
+            "average_centipawn_loss": 10.0 + i,
+            "accuracy": 90.0 - i,
+            "num_blunders": 0,
+            "num_mistakes": 1,
+            "num_inaccuracies": 2,
+        }
+        for i in range(5)
+    ]
+    game_ids = db_session.scalars(
+        insert(Game).returning(Game.id, sort_by_parameter_order=True), games
+    ).all()
+    db_session.execute(insert(Move), [
+        {
+            "game_id": game_id,
+            "move_number": m_idx + 1,
+            "is_white": True,
+            "half_move": m_idx,
+            "move_san": "e4",
+            "move_uci": "e2e4",
+            "classification": "mistake" if m_idx == 1 else "good",
+        }
+        for game_id in game_ids
+        for m_idx in range(3)
+    ])
+
+    db_session.commit()
+
+    stats = StatsService.calculate_user_stats(db_session, user.id)
+    assert stats["total_games"] == 5
+    assert "avg_accuracy" in stats
+    assert stats["total_mistakes"] >= 0
+
+
+def test_calculate_user_stats_tallies(db_session):
+    user = User(email="t@example.com", username="user2", hashed_password="x", chess_com_username="user2")
+    db_session.add(user)
+    db_session.commit()
+
+    now = datetime.utcnow()
+    rows = [
+        # (color, result, analyzed, accuracy, blunders)
+        ("white", "win", True, 90.0, 1),
+        ("white", "loss", True, 70.0, 3),
+        ("black", "win", False, None, 0),
+        ("black", "draw", True, 80.0, 2),
+        ("black", "loss", False, None, 0),
+    ]
+    for i, (color, result, analyzed, accuracy, blunders) in enumerate(rows):
+        db_session.add(Game(
             user_id=user.id,
             pgn="",
-            white_player="user1",
-            black_player="opponent",
-            user_color="white",
-            user_rating=1500,
-            result="win" if i % 2 == 0 else "loss",
+            white_player="user2" if color == "white" else "opponent",
+            black_player="opponent" if color == "white" else "user2",
+            user_color=color,
+            result=result,
             date_played=now - timedelta(days=i),
-            is_analyzed=True,
-            average_centipawn_loss=10.0 + i,
-            accuracy=90.0 - i,
-            num_blunders=0,
+            is_analyzed=analyzed,
+            accuracy=accuracy,
+            num_blunders=blunders,
             num_mistakes=1,
-            num_inaccuracies=2,
-        )
-        db_session.add(g)
-        db_session.flush()
-        # add some moves
-        for m_idx in range(3):
-            mv = Move(
-                game_id=g.id,
-                move_number=m_idx + 1,
-                is_white=True,
-                half_move=m_idx,
-                move_san="e4",
-                move_uci="e2e4",
-                classification="mistake" if m_idx == 1 else "good",
-            )
-            db_session.add(mv)
-
-        games.append(g)
-
+            num_inaccuracies=0,
+        ))
     db_session.commit()
 
     stats = StatsService.calculate_user_stats(db_session, user.id)
     assert stats["total_games"] == 5
-    assert "avg_accuracy" in stats
-    assert stats["total_mistakes"] >= 0
+    assert (stats["total_wins"], stats["total_losses"], stats["total_draws"]) == (2, 2, 1)
+    assert (stats["white_games"], stats["white_wins"]) == (2, 1)
+    assert (stats["black_games"], stats["black_wins"]) == (3, 1)
+    assert stats["avg_accuracy"] == pytest.approx(80.0)
+    assert stats["total_blunders"] == 6
+    assert stats["total_mistakes"] == 3
+    assert stats["total_inaccuracies"] == 0
+
+
+def test_calculate_user_stats_no_games(db_session):
+    user = User(email="n@example.com", username="user3", hashed_password="x")
+    db_session.add(user)
+    db_session.commit()
+
+    stats = StatsService.calculate_user_stats(db_session, user.id)
+    assert stats["total_games"] == 0
+    assert stats["total_wins"] == 0
+    assert stats["avg_accuracy"] is None
+    assert stats["total_blunders"] == 0
+
+
+def test_dashboard_cache_cleared_on_recalculate(db_session):
+    user = User(email="d@example.com", username="user4", hashed_password="x")
+    db_session.add(user)
+    db_session.commit()
+    StatsService.calculate_user_stats(db_session, user.id)
+
+    assert StatsService.get_cached_dashboard(db_session, user.id) is None
+    StatsService.save_dashboard_cache(db_session, user.id, {"recent_games": []})
+    assert StatsService.get_cached_dashboard(db_session, user.id) == {"recent_games": []}
+
+    StatsService.calculate_user_stats(db_session, user.id)
+    assert StatsService.get_cached_dashboard(db_session, user.id) is None
+
+
+def test_calculate_user_stats_skips_when_unchanged(db_session):
+    user = User(email="s@example.com", username="user5", hashed_password="x")
+    db_session.add(user)
+    db_session.commit()
+    db_session.add(Game(
+        user_id=user.id,
+        pgn="",
+        white_player="user5",
+        black_player="opponent",
+        user_color="white",
+        result="win",
+        date_played=datetime.utcnow(),
+    ))
+    db_session.commit()
+
+    first = StatsService.calculate_user_stats(db_session, user.id)
+    cached = StatsService.calculate_user_stats(db_session, user.id, force=False)
+    assert cached["updated_at"] == first["updated_at"]
+    assert cached["total_wins"] == 1
+
+    db_session.add(Game(
+        user_id=user.id,
+        pgn="",
+        white_player="user5",
+        black_player="opponent",
+        user_color="white",
+        result="loss",
+        date_played=datetime.utcnow(),
+    ))
+    db_session.commit()
+    recomputed = StatsService.calculate_user_stats(db_session, user.id, force=False)
+    assert recomputed["total_games"] == 2
+    assert recomputed["total_losses"] == 1
+
+
+def _add_analyzed_game(db_session, user, accuracy, cp_loss, blunders):
+    game = Game(
+        user_id=user.id,
+        pgn="",
+        white_player=user.username,
+        black_player="opponent",
+        user_color="white",
+        result="win",
+        date_played=datetime.utcnow(),
+        is_analyzed=True,
+        accuracy=accuracy,
+        average_centipawn_loss=cp_loss,
+        num_blunders=blunders,
+        num_mistakes=1,
+        num_inaccuracies=2,
+    )
+    db_session.add(game)
+    db_session.commit()
+    return game
+
+
+def test_add_and_remove_analyzed_game_match_full_recalculation(db_session, monkeypatch):
+    user = User(email="i@example.com", username="user6", hashed_password="x")
+    db_session.add(user)
+    db_session.commit()
+
+    # analyze_game reports no average centipawn loss, so games are stored without one
+    _add_analyzed_game(db_session, user, 90.0, None, 1)
+    StatsService.calculate_user_stats(db_session, user.id)
+
+    second = _add_analyzed_game(db_session, user, 70.0, None, 3)
+    recalculate = StatsService.calculate_user_stats
+
+    def no_rescan(*args, **kwargs):
+        raise AssertionError("the roll-up should be updated without rescanning games")
+
+    monkeypatch.setattr(StatsService, "calculate_user_stats", no_rescan)
+    StatsService.add_analyzed_game(db_session, second)
+    monkeypatch.setattr(StatsService, "calculate_user_stats", recalculate)
+
+    incremental = db_session.query(UserStats).filter(UserStats.user_id == user.id).one()
+    full = StatsService.calculate_user_stats(db_session, user.id)
+    db_session.refresh(incremental)
+    assert incremental.analyzed_games == full["analyzed_games"] == 2
+    assert incremental.avg_accuracy == pytest.approx(full["avg_accuracy"])
+    assert incremental.avg_centipawn_loss is full["avg_centipawn_loss"] is None
+    assert incremental.total_blunders == full["total_blunders"] == 4
+
+    assert StatsService.remove_analyzed_game(db_session, second)
+    db_session.refresh(incremental)
+    assert incremental.analyzed_games == 1
+    assert incremental.avg_accuracy == pytest.approx(90.0)
+    assert incremental.total_blunders == 1
+
+
+def test_analyzed_game_with_centipawn_loss_is_recounted(db_session):
+    user = User(email="k@example.com", username="user8", hashed_password="x")
+    db_session.add(user)
+    db_session.commit()
+
+    _add_analyzed_game(db_session, user, 90.0, None, 1)
+    StatsService.calculate_user_stats(db_session, user.id)
+
+    # Only this game has an average, so the user's average is exactly its value
+    second = _add_analyzed_game(db_session, user, 70.0, 40.0, 3)
+    StatsService.add_analyzed_game(db_session, second)
+    stats = db_session.query(UserStats).filter(UserStats.user_id == user.id).one()
+    db_session.refresh(stats)
+    assert stats.analyzed_games == 2
+    assert stats.avg_centipawn_loss == pytest.approx(40.0)
+
+    assert not StatsService.remove_analyzed_game(db_session, second)
+    db_session.refresh(stats)
+    assert stats.analyzed_games == 2
+
+
+def test_clear_dashboard_cache_keeps_stats(db_session):
+    user = User(email="c@example.com", username="user7", hashed_password="x")
+    db_session.add(user)
+    db_session.commit()
+    stats = StatsService.calculate_user_stats(db_session, user.id)
+    StatsService.save_dashboard_cache(db_session, user.id, {"recent_games": []})
+
+    StatsService.clear_dashboard_cache(db_session, user.id)
+    assert StatsService.get_cached_dashboard(db_session, user.id) is None
+    assert StatsService.calculate_user_stats(db_session, user.id, force=False)["updated_at"] == stats["updated_at"]
+
+
+def _add_phase_games(db_session, username):
+    """Three analyzed games ending in each phase plus one unanalyzed game"""
+    user = User(email=f"{username}@example.com", username=username, hashed_password="x")
+    db_session.add(user)
+    db_session.commit()
+
+    start = datetime(2024, 1, 1)
+    games = [
+        # (result, color, accuracy, blunders, mistakes, inaccuracies, eco, opening, time class, rating, moves)
+        ("win", "white", 90.0, 0, 1, 2, "C50", "Italian Game", "blitz", 1500, 10),
+        ("loss", "black", 0.0, 2, 0, 1, "C50", "Italian Game", "blitz", 1490, 30),
+        ("draw", "white", 80.0, 0, 0, 1, "B20", "Sicilian Defense", "rapid", None, 45),
+    ]
+    game_ids = db_session.scalars(insert(Game).returning(Game.id, sort_by_parameter_order=True), [
+        {
+            "user_id": user.id,
+            "pgn": "",
+            "white_player": username,
+            "black_player": "opponent",
+            "user_color": color,
+            "user_rating": rating,
+            "result": result,
+            "date_played": start + timedelta(days=i),
+            "is_analyzed": True,
+            "analysis_state": "analyzed",
+            "accuracy": accuracy,
+            "num_blunders": blunders,
+            "num_mistakes": mistakes,
+            "num_inaccuracies": inaccuracies,
+            "opening_eco": eco,
+            "opening_name": opening,
+            "time_class": time_class,
+        }
+        for i, (result, color, accuracy, blunders, mistakes, inaccuracies, eco, opening, time_class, rating, _) in enumerate(games)
+    ]).all()
+    db_session.add(Game(
+        user_id=user.id, pgn="", white_player=username, black_player="opponent", user_color="white",
+        user_rating=1520, result="win", date_played=start + timedelta(days=3),
+    ))
+
+    # Errors by ply: opening is the first 20 ply, endgame the last 30% of the game's moves
+    errors = {(0, 3): "inaccuracy", (1, 5): "blunder", (1, 20): "blunder", (1, 25): "mistake", (2, 40): "inaccuracy"}
+    db_session.execute(insert(Move), [
+        {
+            "game_id": game_id,
+            "move_number": ply // 2 + 1,
+            "is_white": ply % 2 == 0,
+            "half_move": ply,
+            "move_san": "e4",
+            "move_uci": "e2e4",
+            "classification": errors.get((index, ply), "good"),
+        }
+        for index, game_id in enumerate(game_ids)
+        for ply in range(games[index][-1])
+    ])
+    db_session.commit()
+    return user
+
+
+def test_phase_and_outcome_breakdowns(db_session):
+    user = _add_phase_games(db_session, "user9")
+
+    assert StatsService.get_error_analysis_by_phase(db_session, user.id) == [
+        {"phase": "Opening", "blunders": 1, "mistakes": 0, "inaccuracies": 1, "total_errors": 2, "total_moves": 50, "error_rate": 4.0},
+        {"phase": "Middlegame", "blunders": 1, "mistakes": 0, "inaccuracies": 0, "total_errors": 1, "total_moves": 13, "error_rate": 7.69},
+        {"phase": "Endgame", "blunders": 0, "mistakes": 1, "inaccuracies": 1, "total_errors": 2, "total_moves": 22, "error_rate": 9.09},
+    ]
+
+    # Draws are every analyzed game that isn't a win or a loss; 0 accuracy stays out of the average
+    assert StatsService.get_performance_by_phase(db_session, user.id) == [
+        {"phase": "Opening", "wins": 1, "losses": 0, "draws": 0, "total_games": 1, "win_rate": 100.0, "avg_accuracy": 90.0},
+        {"phase": "Middlegame", "wins": 0, "losses": 1, "draws": 0, "total_games": 1, "win_rate": 0.0, "avg_accuracy": 0.0},
+        {"phase": "Endgame", "wins": 0, "losses": 0, "draws": 1, "total_games": 1, "win_rate": 0.0, "avg_accuracy": 80.0},
+    ]
+
+    assert StatsService.get_win_loss_error_correlation(db_session, user.id) == {
+        "wins": {"blunders": 0.0, "mistakes": 1.0, "inaccuracies": 2.0, "accuracy": 90.0},
+        "losses": {"blunders": 2.0, "mistakes": 0.0, "inaccuracies": 1.0, "accuracy": 0.0},
+        "win_game_count": 1,
+        "loss_game_count": 1,
+    }
+
+
+def test_opening_time_control_and_rating_stats(db_session):
+    user = _add_phase_games(db_session, "user11")
+
+    # Games without an opening or time class are left out; here 0 accuracy is averaged in
+    assert StatsService.get_opening_stats(db_session, user.id) == [
+        {"opening_eco": "C50", "opening_name": "Italian Game", "games_played": 2, "wins": 1, "losses": 1, "draws": 0, "win_rate": 50.0, "avg_accuracy": 45.0},
+        {"opening_eco": "B20", "opening_name": "Sicilian Defense", "games_played": 1, "wins": 0, "losses": 0, "draws": 1, "win_rate": 0.0, "avg_accuracy": 80.0},
+    ]
+    assert StatsService.get_time_control_stats(db_session, user.id) == [
+        {"time_class": "blitz", "games_played": 2, "wins": 1, "losses": 1, "draws": 0, "win_rate": 50.0},
+        {"time_class": "rapid", "games_played": 1, "wins": 0, "losses": 0, "draws": 1, "win_rate": 0.0},
+    ]
+    assert StatsService.get_rating_over_time(db_session, user.id, limit=2) == [
+        {"date": "2024-01-01", "rating": 1500, "result": "win"},
+        {"date": "2024-01-02", "rating": 1490, "result": "loss"},
+    ]
+
+
+def test_breakdowns_for_user_without_games(db_session):
+    user = User(email="e@example.com", username="user10", hashed_password="x")
+    db_session.add(user)
+    db_session.commit()
+
+    assert StatsService.get_opening_stats(db_session, user.id) == []
+    assert StatsService.get_time_control_stats(db_session, user.id) == []
+    assert StatsService.get_rating_over_time(db_session, user.id) == []
+    assert [row["total_moves"] for row in StatsService.get_error_analysis_by_phase(db_session, user.id)] == [0, 0, 0]
+    assert [row["total_games"] for row in StatsService.get_performance_by_phase(db_session, user.id)] == [0, 0, 0]
+    correlation = StatsService.get_win_loss_error_correlation(db_session, user.id)
+    assert correlation["win_game_count"] == correlation["loss_game_count"] == 0
+    assert correlation["wins"] == correlation["losses"] == {"blunders": 0, "mistakes": 0, "inaccuracies": 0, "accuracy": 0}
+
+
+def test_performance_over_time_sql_fills_every_month():
+    # generate_series and make_interval are Postgres-only, so pin the statement instead
+    from sqlalchemy.dialects import postgresql
+    from backend.app.services.stats_service import _PERFORMANCE_OVER_TIME_QUERY
+
+    sql = " ".join(str(_PERFORMANCE_OVER_TIME_QUERY.params(user_id=7, months=12).compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )).split())
+    current_month = "date_trunc('month', timezone('UTC', now()))"
+    first_month = f"{current_month} - make_interval(0, 12 - 1)"
+
+    assert f"FROM (SELECT generate_series({first_month}, {current_month}, interval '1 month') AS month) AS anon_1" in sql
+    assert "LEFT OUTER JOIN (SELECT date_trunc('month', games.date_played) AS month" in sql
+    assert f"WHERE games.user_id = 7 AND games.date_played >= {first_month}" in sql
+    assert "ON anon_2.month = anon_1.month ORDER BY anon_1.month" in sql
+    # Months without games read as zero games, a 0 win rate and no accuracy
+    for column in ("games", "wins", "losses", "draws"):
+        assert f"coalesce(anon_2.{column}, 0) AS {column}" in sql
+    assert "sum(CASE WHEN (games.result = 'draw') THEN 1 ELSE 0 END) AS draws" in sql
+    assert "coalesce((100.0 * anon_2.wins) / CAST(nullif(anon_2.games, 0) AS NUMERIC), 0)" in sql
+    assert "CAST(round(CAST(anon_2.avg_accuracy AS NUMERIC), 2) AS FLOAT) AS avg_accuracy" in sql
+
+
+def test_performance_over_time_formats_months():
+    from collections import namedtuple
+
+    Row = namedtuple("Row", "date games wins losses draws win_rate avg_accuracy")
+    rows = [Row(datetime(2024, 1, 1), 0, 0, 0, 0, 0.0, None), Row(datetime(2024, 2, 1), 3, 2, 1, 0, 66.67, 81.5)]
+
+    class Result:
+        def __init__(self, rows):
+            self.rows = rows
+
+        def all(self):
+            return self.rows
+
+    class Session:
+        def execute(self, statement, params):
+            self.params = params
+            return Result(rows if params["months"] else [])
+
+    db = Session()
+    assert StatsService.get_performance_over_time(db, 7, months=2) == [
+        {"date": "2024-01", "games": 0, "wins": 0, "losses": 0, "draws": 0, "win_rate": 0.0, "avg_accuracy": None},
+        {"date": "2024-02", "games": 3, "wins": 2, "losses": 1, "draws": 0, "win_rate": 66.67, "avg_accuracy": 81.5},
+    ]
+    assert db.params == {"user_id": 7, "months": 2}
+    assert StatsService.get_performance_over_time(db, 7, months=0) == []